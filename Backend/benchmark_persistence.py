@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+Benchmark for persisting generated plans
+Writes the same synthetic plans with the previous row-by-row persistence
+(a commit after the plan, after every day and after every new exercise type)
+and with the current single-transaction bulk persistence, and reports commits,
+latency and SQLite write-lock hold time per plan.
+
+Run: python benchmark_persistence.py --plans 20 --days 21
+"""
+
+import os
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+from typing import Any, Dict, List
+
+def synthetic_plan(plan_number: int, days: int, exercises_per_day: int, new_types: int, catalog: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """A plan in the generated JSON shape; ``new_types`` exercise names per plan are not in the catalog yet"""
+    fresh = [f"Variation {plan_number}-{k}" for k in range(new_types)]
+    plan_days = []
+    for day_number in range(1, days + 1):
+        rest_day = day_number % 7 == 0
+        names = [] if rest_day else [
+            (fresh + [e["name"] for e in catalog])[(day_number * exercises_per_day + i) % (len(fresh) + len(catalog))]
+            for i in range(exercises_per_day)
+        ]
+        plan_days.append({
+            "day_number": day_number,
+            "title": f"Day {day_number}",
+            "rest_day": rest_day,
+            "exercises": [
+                {"name": name, "sets": 3, "reps": 10, "rest_seconds": 60, "primary_muscle": "full body", "notes": None}
+                for name in dict.fromkeys(names)
+            ]
+        })
+    return {"plan_title": f"Benchmark plan {plan_number}", "plan_description": "Synthetic plan", "days": plan_days}
+
+async def legacy_persist(main, session, user, request, plan_data):
+    """The row-by-row persistence this repo used before bulk inserts, kept as the baseline"""
+    plan = main.Plan(
+        user_id=user.id,
+        title=plan_data["plan_title"],
+        description=plan_data["plan_description"],
+        total_days=request.days,
+        is_active=True
+    )
+    session.add(plan)
+    await session.commit()
+    await session.refresh(plan)
+    for day_data in plan_data["days"]:
+        plan_day = main.PlanDay(plan_id=plan.id, day_number=day_data["day_number"], title=day_data["title"], rest_day=day_data["rest_day"])
+        session.add(plan_day)
+        await session.commit()
+        await session.refresh(plan_day)
+        for i, exercise_data in enumerate(day_data["exercises"]):
+            result = await session.execute(
+                main.select(main.ExerciseType).where(main.ExerciseType.name == exercise_data["name"]).order_by(main.ExerciseType.id)
+            )
+            exercise_type = result.scalars().first()
+            if not exercise_type:
+                exercise_type = main.ExerciseType(
+                    name=exercise_data["name"],
+                    primary_muscle=exercise_data.get("primary_muscle"),
+                    default_sets=exercise_data["sets"],
+                    default_reps=exercise_data["reps"]
+                )
+                session.add(exercise_type)
+                await session.commit()
+                await session.refresh(exercise_type)
+            session.add(main.ExerciseInstance(
+                plan_day_id=plan_day.id,
+                exercise_type_id=exercise_type.id,
+                order_index=i,
+                target_sets=exercise_data["sets"],
+                target_reps=exercise_data["reps"],
+                current_sets=exercise_data["sets"],
+                current_reps=exercise_data["reps"],
+                rest_seconds=exercise_data["rest_seconds"],
+                notes=exercise_data["notes"]
+            ))
+    await session.commit()
+    return plan
+
+async def bulk_persist(main, session, user, request, plan_data):
+    plan = await main.persist_generated_plan(session, user, request, plan_data)
+    await session.commit()
+    return plan
+
+class WriteCounter:
+    """Counts commits and the time from a transaction's first write to its end (SQLite holds the write lock meanwhile)"""
+
+    def __init__(self, engine):
+        from sqlalchemy import event
+        self.commits = 0
+        self.lock_seconds = 0.0
+        self._write_started: Dict[int, float] = {}
+        event.listen(engine, "before_cursor_execute", self._before_execute)
+        event.listen(engine, "commit", self._commit)
+        event.listen(engine, "rollback", self._end)
+
+    def _before_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().split(" ", 1)[0].upper() in ("INSERT", "UPDATE", "DELETE"):
+            self._write_started.setdefault(id(conn), time.perf_counter())
+
+    def _commit(self, conn):
+        self.commits += 1
+        self._end(conn)
+
+    def _end(self, conn):
+        started = self._write_started.pop(id(conn), None)
+        if started is not None:
+            self.lock_seconds += time.perf_counter() - started
+
+    def reset(self):
+        self.commits, self.lock_seconds = 0, 0.0
+
+async def run(args):
+    import main
+
+    await main.init_db()
+    counter = WriteCounter(main.async_engine.sync_engine)
+    request = main.PlanGenerationRequest(days=args.days)
+    catalog = main.BUILTIN_EXERCISES
+    async with main.AsyncSessionLocal() as session:
+        user = main.User(name="Benchmark User", fitness_level="intermediate")
+        session.add(user)
+        await session.commit()
+        await session.refresh(user)
+
+    results = []
+    for label, persist, offset in (("row-by-row", legacy_persist, 0), ("bulk", bulk_persist, args.plans)):
+        counter.reset()
+        started = time.perf_counter()
+        for n in range(args.plans):
+            plan_data = synthetic_plan(offset + n, args.days, args.exercises, args.new_types, catalog)
+            async with main.AsyncSessionLocal() as session:
+                await persist(main, session, user, request, plan_data)
+        elapsed = time.perf_counter() - started
+        results.append((label, counter.commits / args.plans, elapsed * 1000 / args.plans, counter.lock_seconds * 1000 / args.plans))
+
+    await main.async_engine.dispose()
+    print(f"{args.plans} plans x {args.days} days x {args.exercises} exercises ({args.new_types} new exercise types per plan)")
+    print(f"{'persistence':<12} {'commits/plan':>13} {'ms/plan':>9} {'lock ms/plan':>13}")
+    for label, commits, ms, lock_ms in results:
+        print(f"{label:<12} {commits:>13.1f} {ms:>9.1f} {lock_ms:>13.1f}")
+
+def main():
+    """Main function"""
+    parser = argparse.ArgumentParser(description="Benchmark plan persistence")
+    parser.add_argument("--plans", type=int, default=20, help="plans written per variant")
+    parser.add_argument("--days", type=int, default=21, help="days per plan (3-21)")
+    parser.add_argument("--exercises", type=int, default=5, help="exercises per training day")
+    parser.add_argument("--new-types", type=int, default=3, help="exercise names per plan not yet in the catalog")
+    parser.add_argument("--database-url", default=None, help="defaults to a fresh SQLite file in a temp directory")
+    args = parser.parse_args()
+
+    # main reads DATABASE_URL at import time, so point it at the benchmark database first
+    os.environ["DATABASE_URL"] = args.database_url or f"sqlite+aiosqlite:///{tempfile.mkdtemp()}/benchmark.db"
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    asyncio.run(run(args))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Batch pre-generation of the coaching-cue library
+Walks the ExerciseType catalog and generates a cue set for every exercise type,
+fitness level and effort band that does not have one yet, with a bounded number
+of concurrent Ollama calls. Each set is committed as soon as it is generated, so
+an interrupted run can simply be started again, and re-running after new
+exercise types are added only generates the new ones.
+
+Run: python generate_cue_library.py --concurrency 2
+"""
+
+import sys
+import time
+import asyncio
+import argparse
+import logging
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+async def run(args) -> int:
+    from main import init_db, model_client, missing_cue_sets, generate_cue_library, COACHING_CUE_MODEL
+
+    await init_db()
+    pending = await missing_cue_sets(args.exercise_type or None, args.refresh)
+    if args.limit is not None:
+        pending = pending[:args.limit]
+    print(f"Cue sets to generate: {len(pending)} (model {COACHING_CUE_MODEL}, concurrency {args.concurrency})")
+    if args.dry_run or not pending:
+        return 0
+
+    done = 0
+    started = time.perf_counter()
+
+    def report(exercise_type, level, band, error):
+        nonlocal done
+        done += 1
+        status = f"❌ {error}" if error else "✓"
+        print(f"[{done}/{len(pending)}] {exercise_type.name} / {level} / {band} {status}")
+
+    await model_client.start()
+    try:
+        summary = await generate_cue_library(
+            concurrency=args.concurrency,
+            exercise_type_ids=args.exercise_type or None,
+            refresh=args.refresh,
+            limit=args.limit,
+            on_result=report
+        )
+    finally:
+        await model_client.close()
+
+    print(
+        f"Generated {summary['generated']} cue sets, {summary['failed']} failed "
+        f"in {time.perf_counter() - started:.1f}s"
+    )
+    return 1 if summary["failed"] else 0
+
+def main():
+    """Main function"""
+    parser = argparse.ArgumentParser(description="Pre-generate the coaching-cue library")
+    parser.add_argument("--concurrency", type=int, default=2, help="model calls in flight at once")
+    parser.add_argument("--exercise-type", type=int, action="append", help="only this exercise type id (repeatable)")
+    parser.add_argument("--refresh", action="store_true", help="regenerate cue sets that already exist")
+    parser.add_argument("--limit", type=int, default=None, help="generate at most this many cue sets")
+    parser.add_argument("--dry-run", action="store_true", help="only count the cue sets that would be generated")
+    args = parser.parse_args()
+
+    try:
+        sys.exit(asyncio.run(run(args)))
+    except KeyboardInterrupt:
+        print("\n🛑 Stopped; generated cue sets are kept, re-run to resume")
+        sys.exit(130)
+
+if __name__ == "__main__":
+    main()
@@ -9,28 +9,138 @@ Run: uvicorn app:app --reload
 """
 
 import os
+import re
+import copy
 import json
+import time
 import asyncio
+import uuid
+import heapq
+import random
+import hashlib
+import unicodedata
 import logging
-from typing import Optional, List, Dict, Any
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Optional, List, Dict, Any, AsyncIterator, Tuple, Callable
 from datetime import datetime, timedelta
 
 import httpx
-from fastapi import FastAPI, HTTPException, Depends, status, BackgroundTasks
+import numpy as np
+from fastapi import FastAPI, HTTPException, Depends, Query, status, BackgroundTasks
+from fastapi.encoders import jsonable_encoder
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel, Field, validator, constr
 from sqlmodel import SQLModel, Field as SQLField, select, delete
+from sqlalchemy import event, func, insert, update, inspect as sa_inspect, UniqueConstraint
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker, aliased
 
 # ----------------------------
 # Config
 # ----------------------------
 OLLAMA_URL = os.getenv("OLLAMA_URL", "http://localhost:11434")
+# Comma-separated list of Ollama backends to balance across; defaults to OLLAMA_URL alone
+OLLAMA_URLS = [url.strip() for url in os.getenv("OLLAMA_URLS", OLLAMA_URL).split(",") if url.strip()]
 OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "gemma3:4b")
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite+aiosqlite:///./fitness.db")
 HISTORY_WINDOW = int(os.getenv("HISTORY_WINDOW", "3"))
 
+# Outbound HTTP pool for Ollama (one client per process, shared by the API and MCP server)
+OLLAMA_CONNECT_TIMEOUT = float(os.getenv("OLLAMA_CONNECT_TIMEOUT", "5.0"))
+OLLAMA_READ_TIMEOUT = float(os.getenv("OLLAMA_READ_TIMEOUT", "120.0"))
+OLLAMA_POOL_TIMEOUT = float(os.getenv("OLLAMA_POOL_TIMEOUT", "30.0"))
+OLLAMA_MAX_CONNECTIONS = int(os.getenv("OLLAMA_MAX_CONNECTIONS", "8"))
+OLLAMA_MAX_KEEPALIVE = int(os.getenv("OLLAMA_MAX_KEEPALIVE", "8"))
+OLLAMA_KEEPALIVE_EXPIRY = float(os.getenv("OLLAMA_KEEPALIVE_EXPIRY", "60.0"))
+
+# Generated-plan cache (in-process LRU in front of a SQLite-backed table)
+PLAN_CACHE_ENABLED = os.getenv("PLAN_CACHE_ENABLED", "true").lower() == "true"
+PLAN_CACHE_SIZE = int(os.getenv("PLAN_CACHE_SIZE", "512"))
+PLAN_CACHE_TTL_SECONDS = int(os.getenv("PLAN_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+
+# Background plan-generation jobs (POST .../plans/generate?async=true)
+PLAN_JOB_WORKERS = int(os.getenv("PLAN_JOB_WORKERS", "2"))
+PLAN_JOB_QUEUE_SIZE = int(os.getenv("PLAN_JOB_QUEUE_SIZE", "100"))
+PLAN_JOB_RETENTION_SECONDS = int(os.getenv("PLAN_JOB_RETENTION_SECONDS", "3600"))
+
+# Plans longer than this are generated as an outline plus concurrent week-sized chunks (0 disables)
+PLAN_CHUNK_DAYS = int(os.getenv("PLAN_CHUNK_DAYS", "7"))
+
+# Send a JSON schema through Ollama's `format` parameter to constrain plan output
+OLLAMA_STRUCTURED_OUTPUT = os.getenv("OLLAMA_STRUCTURED_OUTPUT", "true").lower() == "true"
+
+# Re-ask the model for missing or unusable days instead of regenerating the whole plan
+PLAN_REPAIR_ENABLED = os.getenv("PLAN_REPAIR_ENABLED", "true").lower() == "true"
+
+# Plan prompts start with a fixed instruction prefix. "prompt" leaves reuse of its evaluation to Ollama's
+# prompt cache; "context" evaluates the prefix once per model and sends only the per-user suffix with its context
+OLLAMA_PREFIX_MODE = os.getenv("OLLAMA_PREFIX_MODE", "prompt").lower()
+
+# Nearest-neighbour retrieval of earlier plans for similar profiles (hashed features, brute-force cosine)
+PLAN_SIMILARITY_ENABLED = os.getenv("PLAN_SIMILARITY_ENABLED", "true").lower() == "true"
+PLAN_INDEX_DIM = int(os.getenv("PLAN_INDEX_DIM", "64"))
+PLAN_CLONE_THRESHOLD = float(os.getenv("PLAN_CLONE_THRESHOLD", "0.97"))  # copy the earlier plan outright
+PLAN_REFERENCE_THRESHOLD = float(os.getenv("PLAN_REFERENCE_THRESHOLD", "0.85"))  # show it to the model as a reference
+
+# Build plans from the exercise catalog without the model when Ollama rejects work (overload, open circuit)
+PLAN_RULES_FALLBACK = os.getenv("PLAN_RULES_FALLBACK", "true").lower() == "true"
+
+# Map new exercise names onto existing types when their canonical names are this trigram-similar (0 disables)
+EXERCISE_NAME_MATCH_THRESHOLD = float(os.getenv("EXERCISE_NAME_MATCH_THRESHOLD", "0.75"))
+
+# Live coaching cues: a hard token budget per cue and a small per-exercise cache of recent cues
+COACHING_CUE_MODEL = os.getenv("COACHING_CUE_MODEL", OLLAMA_MODEL)
+COACHING_CUE_MAX_TOKENS = int(os.getenv("COACHING_CUE_MAX_TOKENS", "32"))
+COACHING_CUE_CACHE_SIZE = int(os.getenv("COACHING_CUE_CACHE_SIZE", "256"))
+COACHING_CUE_CACHE_TTL_SECONDS = int(os.getenv("COACHING_CUE_CACHE_TTL_SECONDS", "900"))
+COACHING_CUE_LIBRARY_VARIANTS = int(os.getenv("COACHING_CUE_LIBRARY_VARIANTS", "3"))  # pre-generated cues per phase
+
+# Model residency: how long Ollama keeps the model loaded after a request, and whether to load it on startup
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m")
+OLLAMA_PRELOAD = os.getenv("OLLAMA_PRELOAD", "true").lower() == "true"
+OLLAMA_STATUS_INTERVAL_SECONDS = float(os.getenv("OLLAMA_STATUS_INTERVAL_SECONDS", "30"))  # residency refresh for /health
+
+# Adaptive (AIMD) concurrency limit, wait queue and circuit breaker in front of Ollama
+OLLAMA_CONCURRENCY_INITIAL = int(os.getenv("OLLAMA_CONCURRENCY_INITIAL", "2"))
+OLLAMA_CONCURRENCY_MIN = int(os.getenv("OLLAMA_CONCURRENCY_MIN", "1"))
+OLLAMA_CONCURRENCY_MAX = int(os.getenv("OLLAMA_CONCURRENCY_MAX", str(OLLAMA_MAX_CONNECTIONS)))
+OLLAMA_LATENCY_TARGET = float(os.getenv("OLLAMA_LATENCY_TARGET", "45.0"))  # seconds per call
+OLLAMA_QUEUE_SIZE = int(os.getenv("OLLAMA_QUEUE_SIZE", "16"))
+OLLAMA_QUEUE_TIMEOUT = float(os.getenv("OLLAMA_QUEUE_TIMEOUT", "30.0"))
+OLLAMA_BREAKER_THRESHOLD = int(os.getenv("OLLAMA_BREAKER_THRESHOLD", "5"))
+OLLAMA_BREAKER_RESET_SECONDS = float(os.getenv("OLLAMA_BREAKER_RESET_SECONDS", "30.0"))
+
+# Backend pool: passive ejection of failing backends and hedged requests (0 disables hedging)
+OLLAMA_EJECT_FAILURES = int(os.getenv("OLLAMA_EJECT_FAILURES", "3"))
+OLLAMA_EJECT_SECONDS = float(os.getenv("OLLAMA_EJECT_SECONDS", "30.0"))
+OLLAMA_HEDGE_PERCENTILE = float(os.getenv("OLLAMA_HEDGE_PERCENTILE", "0"))
+OLLAMA_HEDGE_MIN_SAMPLES = int(os.getenv("OLLAMA_HEDGE_MIN_SAMPLES", "20"))
+
+# Generation scheduling: priority lanes with per-lane concurrency caps, fair queuing per user inside a lane
+GENERATION_LANES = ("interactive", "agent", "batch")  # highest priority first
+GEN_LANE_LIMITS = {
+    "interactive": int(os.getenv("GEN_LANE_INTERACTIVE_CONCURRENCY", "4")),
+    "agent": int(os.getenv("GEN_LANE_AGENT_CONCURRENCY", "2")),
+    "batch": int(os.getenv("GEN_LANE_BATCH_CONCURRENCY", "1")),
+}
+GEN_LANE_QUEUE_SIZE = int(os.getenv("GEN_LANE_QUEUE_SIZE", "50"))
+
+# Model routing: JSON list of rules, first match wins, e.g.
+# [{"model": "gemma3:1b", "max_days": 7, "fitness_levels": ["beginner"]}]
+# Requests matching no rule use OLLAMA_MODEL. Unusable output escalates along MODEL_ESCALATION.
+MODEL_ROUTES = json.loads(os.getenv("MODEL_ROUTES", "[]"))
+MODEL_ESCALATION = [m.strip() for m in os.getenv("MODEL_ESCALATION", OLLAMA_MODEL).split(",") if m.strip()]
+
+# Speculative pre-generation of the next plan block while Ollama is idle
+PREGEN_ENABLED = os.getenv("PREGEN_ENABLED", "true").lower() == "true"
+PREGEN_INTERVAL_SECONDS = float(os.getenv("PREGEN_INTERVAL_SECONDS", "300"))
+PREGEN_DAYS_REMAINING = int(os.getenv("PREGEN_DAYS_REMAINING", "2"))  # start when this close to the last day
+PREGEN_BATCH_SIZE = int(os.getenv("PREGEN_BATCH_SIZE", "5"))  # plans considered per sweep
+
 # ----------------------------
 # Logging
 # ----------------------------
@@ -52,7 +162,8 @@ class User(SQLModel, table=True):
 
 class ExerciseType(SQLModel, table=True):
     id: Optional[int] = SQLField(default=None, primary_key=True)
-    name: str = SQLField(index=True, max_length=100)
+    name: str = SQLField(index=True, unique=True, max_length=100)
+    canonical_name: Optional[str] = SQLField(default=None, index=True, max_length=100)  # see canonical_exercise_name
     primary_muscle: Optional[str] = SQLField(max_length=50)
     equipment_needed: Optional[bool] = Field(default=False)
     default_sets: int = Field(default=3, ge=1, le=10)
@@ -66,6 +177,8 @@ class Plan(SQLModel, table=True):
     description: Optional[str] = SQLField(max_length=1000)
     total_days: int = Field(default=7, ge=1, le=30)
     is_active: bool = Field(default=True)
+    source_plan_id: Optional[int] = SQLField(default=None, foreign_key="plan.id")  # set on follow-up blocks
+    generation_status: Optional[str] = SQLField(default="complete", max_length=20)  # complete, incomplete, failed
     created_at: datetime = SQLField(default_factory=datetime.utcnow)
 
 class PlanDay(SQLModel, table=True):
@@ -101,206 +214,3777 @@ class SessionReport(SQLModel, table=True):
     success: bool = Field(default=True)
     duration_seconds: Optional[int] = Field(default=None, ge=0)
 
+class GeneratedPlanCache(SQLModel, table=True):
+    key: str = SQLField(primary_key=True, max_length=64)  # sha256 of the normalized request fingerprint
+    model: str = SQLField(max_length=100)
+    plan_json: str
+    created_at: datetime = SQLField(default_factory=datetime.utcnow, index=True)
+
+class PlanGenerationRecord(SQLModel, table=True):
+    """Profile/request features of a model-generated plan, for similar-plan retrieval"""
+    id: Optional[int] = SQLField(default=None, primary_key=True)
+    plan_id: int = SQLField(foreign_key="plan.id", index=True)
+    partition: str = SQLField(max_length=100)  # fitness_level|include_equipment|days
+    features_json: str
+    created_at: datetime = SQLField(default_factory=datetime.utcnow)
+
+class CoachingCue(SQLModel, table=True):
+    """Pre-generated cue set for one exercise type, fitness level and effort band"""
+    __table_args__ = (UniqueConstraint("exercise_type_id", "fitness_level", "effort_band", name="uq_coachingcue_key"),)
+    id: Optional[int] = SQLField(default=None, primary_key=True)
+    exercise_type_id: int = SQLField(foreign_key="exercisetype.id")
+    fitness_level: str = SQLField(max_length=20)
+    effort_band: str = SQLField(max_length=20)
+    cues_json: str  # {"setup": [...], "set": [...], "rest": [...]}
+    model: str = SQLField(max_length=100)
+    created_at: datetime = SQLField(default_factory=datetime.utcnow)
+
 # Database setup
 async_engine = create_async_engine(DATABASE_URL, echo=False, future=True)
 AsyncSessionLocal = sessionmaker(async_engine, class_=AsyncSession, expire_on_commit=False)
 
-async def init_db():
-    async with async_engine.begin() as conn:
-        await conn.run_sync(SQLModel.metadata.create_all)
+def _add_missing_columns(connection):
+    """create_all does not alter existing tables, so add columns introduced since (as nullable)"""
+    inspector = sa_inspect(connection)
+    for table in SQLModel.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            column_type = column.type.compile(dialect=connection.dialect)
+            connection.exec_driver_sql(f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {column_type}')
+            for index in table.indexes:
+                if [indexed.name for indexed in index.columns] == [column.name]:
+                    index.create(connection)
+            logger.info(f"Added column {table.name}.{column.name}")
+
+def _unique_exercise_type_names(connection):
+    """Merge duplicate exercise type names into the oldest row, then make the name index unique.
+
+    Older databases only had a plain index on ``exercisetype.name``, so concurrent
+    plan generations could insert the same name twice.
+    """
+    inspector = sa_inspect(connection)
+    name_index = next(
+        (index for index in inspector.get_indexes("exercisetype") if index["column_names"] == ["name"]), None
+    )
+    if name_index and name_index["unique"]:
+        return
+    
+    duplicates = connection.execute(
+        select(ExerciseType.name, func.min(ExerciseType.id))
+        .group_by(ExerciseType.name)
+        .having(func.count() > 1)
+    ).all()
+    for name, keep_id in duplicates:
+        merged_ids = select(ExerciseType.id).where(ExerciseType.name == name, ExerciseType.id != keep_id)
+        connection.execute(
+            update(ExerciseInstance).where(ExerciseInstance.exercise_type_id.in_(merged_ids)).values(exercise_type_id=keep_id)
+        )
+        connection.execute(delete(CoachingCue).where(CoachingCue.exercise_type_id.in_(merged_ids)))
+        connection.execute(delete(ExerciseType).where(ExerciseType.name == name, ExerciseType.id != keep_id))
+    if duplicates:
+        logger.info(f"Merged duplicate exercise types: {', '.join(name for name, _ in duplicates)}")
+    
+    if name_index:
+        connection.exec_driver_sql(f'DROP INDEX "{name_index["name"]}"')
+    for index in ExerciseType.__table__.indexes:
+        if [column.name for column in index.columns] == ["name"]:
+            index.create(connection)
+    logger.info("Made exercisetype.name unique")
+
+def _backfill_canonical_names(connection):
+    # Also recomputes keys stored by an earlier canonicalization (e.g. empty keys for non-Latin names)
+    rows = [
+        (exercise_type_id, canonical_exercise_name(name))
+        for exercise_type_id, name, stored in connection.execute(
+            select(ExerciseType.id, ExerciseType.name, ExerciseType.canonical_name)
+        ).all()
+        if stored != canonical_exercise_name(name)
+    ]
+    for exercise_type_id, canonical in rows:
+        connection.execute(
+            update(ExerciseType).where(ExerciseType.id == exercise_type_id).values(canonical_name=canonical)
+        )
+    if rows:
+        logger.info(f"Backfilled canonical names for {len(rows)} exercise types")
+
+async def init_db():
+    async with async_engine.begin() as conn:
+        await conn.run_sync(SQLModel.metadata.create_all)
+        await conn.run_sync(_add_missing_columns)
+        await conn.run_sync(_unique_exercise_type_names)
+        await conn.run_sync(_backfill_canonical_names)
+
+# Initialize DB on startup
+async def startup_db():
+    await init_db()
+
+# ----------------------------
+# Pydantic schemas with validators
+# ----------------------------
+class UserCreate(BaseModel):
+    name: constr(min_length=2, max_length=100)
+    email: Optional[constr(max_length=128)] = None
+    age: Optional[int] = Field(None, ge=10, le=120)
+    gender: Optional[str] = Field(None, max_length=20)
+    fitness_level: Optional[str] = None
+    goals: Optional[str] = Field(None, max_length=500)
+
+    @validator('email')
+    def validate_email(cls, v):
+        if v and '@' not in v:
+            raise ValueError('Invalid email format')
+        return v
+
+    @validator('fitness_level')
+    def validate_fitness_level(cls, v):
+        if v and v.lower() not in ['beginner', 'intermediate', 'advanced']:
+            raise ValueError('Fitness level must be beginner, intermediate, or advanced')
+        return v.lower() if v else v
+
+    @validator('gender')
+    def validate_gender(cls, v):
+        if v and v.lower() not in ['male', 'female', 'other']:
+            raise ValueError('Gender must be male, female, or other')
+        return v.lower() if v else v
+
+class ExerciseTypeCreate(BaseModel):
+    name: constr(min_length=2, max_length=100)
+    primary_muscle: Optional[str] = Field(None, max_length=50)
+    equipment_needed: Optional[bool] = False
+    default_sets: int = Field(3, ge=1, le=10)
+    default_reps: int = Field(10, ge=1, le=100)
+    notes: Optional[str] = Field(None, max_length=500)
+
+class PlanGenerationRequest(BaseModel):
+    days: int = Field(7, ge=3, le=21, description="Number of days for the workout plan")
+    preferences: Optional[str] = Field(None, max_length=500, description="Additional preferences")
+    include_equipment: bool = Field(False, description="Whether to include equipment-based exercises")
+    focus_areas: Optional[List[str]] = Field(default=None, max_length=10)
+    bypass_cache: bool = Field(False, description="Skip the generated-plan cache and always call the model")
+    generator: str = Field("llm", description="'llm' for the model, 'rules' for the instant catalog-based generator")
+    deadline_seconds: Optional[float] = Field(
+        None, ge=1, le=600,
+        description="Respond within this many seconds with the days generated so far; the rest finish in the background"
+    )
+
+    @validator('focus_areas')
+    def validate_focus_areas(cls, v):
+        valid_areas = ['strength', 'cardio', 'flexibility', 'weight_loss', 'muscle_gain', 'endurance']
+        if v:
+            for area in v:
+                if area.lower() not in valid_areas:
+                    raise ValueError(f'Invalid focus area: {area}. Must be one of {valid_areas}')
+        return v
+
+    @validator('generator')
+    def validate_generator(cls, v):
+        if v.lower() not in ['llm', 'rules']:
+            raise ValueError("Generator must be 'llm' or 'rules'")
+        return v.lower()
+
+class SubstitutionRequest(BaseModel):
+    exercise_instance_ids: Optional[List[int]] = Field(
+        None, description="Instances to replace; defaults to every instance matched by the filters below"
+    )
+    bodyweight_only: bool = Field(False, description="Replace equipment-based exercises with bodyweight ones")
+    avoid_muscles: Optional[List[str]] = Field(None, description="Muscle groups to move away from")
+
+    @validator('avoid_muscles')
+    def validate_avoid_muscles(cls, v):
+        if v:
+            unknown = [m for m in v if _muscle_group(m) is None]
+            if unknown:
+                raise ValueError(f'Unknown muscle groups: {unknown}. Must be one of {sorted(MUSCLE_GROUPS)}')
+            return [_muscle_group(m) for m in v]
+        return v
+
+class SessionReportCreate(BaseModel):
+    exercise_instance_id: int
+    rpe: float = Field(..., ge=1.0, le=10.0, description="Rate of Perceived Exertion (1-10)")
+    reps_completed: int = Field(..., ge=0, le=200)
+    sets_completed: int = Field(..., ge=0, le=15)
+    success: bool = True
+    duration_seconds: Optional[int] = Field(None, ge=0, le=7200)  # max 2 hours
+
+class PlanUpdate(BaseModel):
+    title: Optional[str] = Field(None, max_length=200)
+    description: Optional[str] = Field(None, max_length=1000)
+    is_active: Optional[bool] = None
+
+class PlanJob(BaseModel):
+    id: str
+    user_id: int
+    lane: str = "interactive"
+    status: str = "queued"  # queued, running, succeeded, failed
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    plan_id: Optional[int] = None
+    error: Optional[str] = None
+
+    def summary(self) -> Dict[str, Any]:
+        data = self.dict()
+        data["queue_seconds"] = (
+            round(((self.started_at or datetime.utcnow()) - self.created_at).total_seconds(), 3)
+        )
+        data["run_seconds"] = (
+            round(((self.finished_at or datetime.utcnow()) - self.started_at).total_seconds(), 3)
+            if self.started_at else None
+        )
+        return data
+
+# ----------------------------
+# Incremental plan parsing for streamed model output
+# ----------------------------
+class PlanStreamParser:
+    """Extracts complete day objects from a plan JSON document as it streams in.
+
+    The parser tracks string/escape state and bracket depth across chunks, so a
+    day is emitted as soon as its closing brace arrives. Plan metadata (title,
+    description) is emitted once, right before the first day.
+    """
+
+    _DAYS_KEY = re.compile(r'"days"\s*:\s*$')
+
+    def __init__(self):
+        self.buffer = ""
+        self.meta: Optional[Dict[str, Any]] = None
+        self.days_seen = 0
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._root_start: Optional[int] = None
+        self._days_depth: Optional[int] = None
+        self._day_start: Optional[int] = None
+        self._meta_sent = False
+
+    def feed(self, chunk: str) -> List[Dict[str, Any]]:
+        """Consume a chunk of model output and return any newly completed events"""
+        self.buffer += chunk
+        events: List[Dict[str, Any]] = []
+        buf = self.buffer
+
+        for i in range(self._pos, len(buf)):
+            ch = buf[i]
+            if self._root_start is None:
+                if ch == "{":
+                    self._root_start = i
+                    self._depth = 1
+                continue
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                continue
+
+            if ch == '"':
+                self._in_string = True
+            elif ch == "[" or ch == "{":
+                self._depth += 1
+                if (
+                    ch == "["
+                    and self._days_depth is None
+                    and self._depth == 2
+                    and self._DAYS_KEY.search(buf[max(self._root_start, i - 32):i])
+                ):
+                    self._days_depth = self._depth
+                    self.meta = self._parse_meta(buf[self._root_start:i] + "[]}")
+                elif ch == "{" and self._days_depth is not None and self._depth == self._days_depth + 1:
+                    self._day_start = i
+            elif ch == "]" or ch == "}":
+                if (
+                    ch == "}"
+                    and self._day_start is not None
+                    and self._depth == self._days_depth + 1
+                ):
+                    day = self._parse_day(buf[self._day_start:i + 1])
+                    self._day_start = None
+                    if day is not None:
+                        events.extend(self._emit_day(day))
+                self._depth -= 1
+
+        self._pos = len(buf)
+        return events
+
+    def _emit_day(self, day: Dict[str, Any]) -> List[Dict[str, Any]]:
+        events = []
+        if not self._meta_sent:
+            events.append({"type": "meta", **(self.meta or {})})
+            self._meta_sent = True
+        self.days_seen += 1
+        events.append({"type": "day", "day": day})
+        return events
+
+    @staticmethod
+    def _parse_meta(text: str) -> Dict[str, Any]:
+        try:
+            head = json.loads(text)
+        except json.JSONDecodeError:
+            return {}
+        return {k: head[k] for k in ("plan_title", "plan_description") if k in head}
+
+    @staticmethod
+    def _parse_day(text: str) -> Optional[Dict[str, Any]]:
+        try:
+            day = json.loads(text)
+        except json.JSONDecodeError:
+            try:
+                day = json.loads(_strip_trailing_commas(text))
+            except json.JSONDecodeError as e:
+                logger.warning(f"Skipping unparseable streamed day: {e}")
+                return None
+        return day if isinstance(day, dict) else None
+
+# ----------------------------
+# Plan JSON schemas and tolerant parsing of model output
+# ----------------------------
+EXERCISE_JSON_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "name": {"type": "string"},
+        "sets": {"type": "integer", "minimum": 1, "maximum": 10},
+        "reps": {"type": "integer", "minimum": 1, "maximum": 100},
+        "rest_seconds": {"type": "integer", "minimum": 30, "maximum": 300},
+        "primary_muscle": {"type": "string"},
+        "equipment_needed": {"type": "boolean"},
+        "notes": {"type": "string"}
+    },
+    "required": ["name", "sets", "reps", "rest_seconds", "primary_muscle", "equipment_needed"]
+}
+
+DAY_JSON_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "day_number": {"type": "integer", "minimum": 1, "maximum": 30},
+        "title": {"type": "string"},
+        "rest_day": {"type": "boolean"},
+        "exercises": {"type": "array", "items": EXERCISE_JSON_SCHEMA}
+    },
+    "required": ["day_number", "title", "rest_day", "exercises"]
+}
+
+PLAN_JSON_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "plan_title": {"type": "string"},
+        "plan_description": {"type": "string"},
+        "days": {"type": "array", "items": DAY_JSON_SCHEMA}
+    },
+    "required": ["plan_title", "plan_description", "days"]
+}
+
+PLAN_CHUNK_JSON_SCHEMA = {
+    "type": "object",
+    "properties": {"days": {"type": "array", "items": DAY_JSON_SCHEMA}},
+    "required": ["days"]
+}
+
+PLAN_OUTLINE_JSON_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "plan_title": {"type": "string"},
+        "plan_description": {"type": "string"},
+        "weekly_split": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "day_of_week": {"type": "integer"},
+                    "title": {"type": "string"},
+                    "rest_day": {"type": "boolean"},
+                    "focus": {"type": "string"}
+                },
+                "required": ["day_of_week", "title", "rest_day"]
+            }
+        }
+    },
+    "required": ["plan_title", "plan_description", "weekly_split"]
+}
+
+def _strip_trailing_commas(text: str) -> str:
+    """Drop commas that directly precede a closing bracket, ignoring string contents"""
+    out: List[str] = []
+    in_string = escape = False
+    for ch in text:
+        if in_string:
+            if escape:
+                escape = False
+            elif ch == "\\":
+                escape = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch in "}]":
+            while out and out[-1].isspace():
+                out.pop()
+            if out and out[-1] == ",":
+                out.pop()
+        out.append(ch)
+    return "".join(out)
+
+def _close_truncated_json(text: str) -> Optional[str]:
+    """Cut a truncated document back to its last complete value and close open brackets"""
+    stack: List[str] = []
+    in_string = escape = False
+    cut: Optional[Tuple[int, List[str]]] = None
+
+    for i, ch in enumerate(text):
+        if in_string:
+            if escape:
+                escape = False
+            elif ch == "\\":
+                escape = True
+            elif ch == '"':
+                in_string = False
+            continue
+        if ch == '"':
+            in_string = True
+        elif ch in "{[":
+            stack.append("}" if ch == "{" else "]")
+        elif ch in "}]":
+            if not stack:
+                break
+            stack.pop()
+            cut = (i + 1, list(stack))
+            if not stack:
+                return None  # the document is complete, so truncation is not the problem
+        elif ch == "," and stack:
+            cut = (i, list(stack))
+
+    if cut is None:
+        return None
+    end, open_brackets = cut
+    return text[:end] + "".join(reversed(open_brackets))
+
+def parse_model_json(response: str) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """Parse a JSON object from raw model output, repairing common defects.
+
+    Tries, in order: the text between the outermost braces, the same with
+    trailing commas removed, and a truncated document closed at its last
+    complete value. Returns the parsed object and a report of what was done.
+    Raises ``json.JSONDecodeError`` when nothing parses.
+    """
+    text = response.strip()
+    if text.startswith("```"):
+        text = text.split("\n", 1)[1] if "\n" in text else text[3:]
+    if text.endswith("```"):
+        text = text[:-3]
+
+    start = text.find("{")
+    if start == -1:
+        raise json.JSONDecodeError("No JSON object in model output", text, 0)
+    text = text[start:]
+    end = text.rfind("}") + 1
+    report = {"repaired": False, "truncated": False}
+
+    try:
+        return json.loads(text[:end] if end else text), report
+    except json.JSONDecodeError as first_error:
+        error = first_error
+
+    cleaned = _strip_trailing_commas(text)
+    cleaned_end = cleaned.rfind("}") + 1
+    try:
+        return json.loads(cleaned[:cleaned_end]), {**report, "repaired": True}
+    except json.JSONDecodeError:
+        pass
+
+    closed = _close_truncated_json(cleaned)
+    if closed is not None:
+        try:
+            return json.loads(_strip_trailing_commas(closed)), {"repaired": True, "truncated": True}
+        except json.JSONDecodeError:
+            pass
+
+    raise error
+
+def salvage_plan_days(response: str) -> Optional[Dict[str, Any]]:
+    """Recover every complete day object from plan output that cannot be parsed whole"""
+    parser = PlanStreamParser()
+    days = [event["day"] for event in parser.feed(response) if event["type"] == "day"]
+    if not days:
+        return None
+    return {**(parser.meta or {}), "days": days}
+
+# Bounds from the ExerciseInstance constraints, with the value used when the model gave none
+EXERCISE_LIMITS = {"sets": (1, 10, 3), "reps": (1, 100, 10), "rest_seconds": (30, 300, 60)}
+
+def _clamp_int(value: Any, low: int, high: int, default: int) -> Tuple[int, bool]:
+    """Coerce to an int within [low, high]; the flag tells whether the value had to change"""
+    try:
+        number = int(float(value))
+    except (TypeError, ValueError, OverflowError):
+        return default, True
+    clamped = min(high, max(low, number))
+    return clamped, clamped != value
+
+def normalize_plan_day(day: Any, total_days: int) -> Tuple[Optional[Dict[str, Any]], int]:
+    """Clamp a generated day's exercise values into the allowed ranges.
+
+    Returns the day and how many values were changed, or ``None`` when the day
+    cannot be used: no valid day number, or a training day without exercises.
+    """
+    if not isinstance(day, dict):
+        return None, 0
+    try:
+        number = int(day.get("day_number"))
+    except (TypeError, ValueError, OverflowError):
+        return None, 0
+    if not 1 <= number <= total_days:
+        return None, 0
+
+    changed = 0
+    exercises = []
+    raw_exercises = day.get("exercises")
+    for exercise in raw_exercises if isinstance(raw_exercises, list) else []:
+        if not isinstance(exercise, dict) or not str(exercise.get("name") or "").strip():
+            changed += 1
+            continue
+        for field, (low, high, default) in EXERCISE_LIMITS.items():
+            exercise[field], fixed = _clamp_int(exercise.get(field, default), low, high, default)
+            changed += fixed
+        exercises.append(exercise)
+
+    rest_day = bool(day.get("rest_day"))
+    if not rest_day and not exercises:
+        return None, changed
+    day.update(day_number=number, rest_day=rest_day, exercises=exercises)
+    return day, changed
+
+def validate_plan(plan_data: Dict[str, Any], total_days: int) -> Dict[str, Any]:
+    """Clamp values in place, keep one usable day per number and list the day numbers still needed"""
+    days: Dict[int, Dict[str, Any]] = {}
+    clamped = 0
+    for day in plan_data.get("days") or []:
+        day, changed = normalize_plan_day(day, total_days)
+        clamped += changed
+        if day is not None and day["day_number"] not in days:
+            days[day["day_number"]] = day
+    plan_data["days"] = [days[number] for number in sorted(days)]
+    return {
+        "clamped_values": clamped,
+        "missing_days": [number for number in range(1, total_days + 1) if number not in days],
+    }
+
+def plan_is_complete(plan_data: Dict[str, Any], total_days: int) -> bool:
+    """Whether every day from 1 to ``total_days`` is present and usable (checked on a copy)"""
+    return not validate_plan(copy.deepcopy(plan_data), total_days)["missing_days"]
+
+# ----------------------------
+# Generated-plan cache
+# ----------------------------
+def _age_bucket(age: Optional[int]) -> str:
+    if age is None:
+        return "unknown"
+    for upper, label in ((18, "under18"), (30, "18-29"), (40, "30-39"), (50, "40-49"), (60, "50-59")):
+        if age < upper:
+            return label
+    return "60plus"
+
+def _normalize_text(text: Optional[str]) -> str:
+    return " ".join(re.sub(r"[^a-z0-9]+", " ", (text or "").lower()).split())
+
+def normalized_plan_profile(user: User, request: PlanGenerationRequest) -> Dict[str, Any]:
+    """The profile and request fields that shape a generated plan.
+
+    Only fields that reach the prompt are included, coarsened where an exact
+    value would not change the plan (age is bucketed, goals are reduced to a
+    sorted token set) so that similar users compare equal. Shared by the plan
+    cache key and the similar-plan index.
+    """
+    return {
+        "fitness_level": (user.fitness_level or "beginner").lower(),
+        "age": _age_bucket(user.age),
+        "gender": (user.gender or "unspecified").lower(),
+        "goals": sorted(set(_normalize_text(user.goals or "general fitness").split())),
+        "focus_areas": sorted({area.lower() for area in request.focus_areas or []}),
+        "include_equipment": request.include_equipment,
+        "days": request.days,
+        "preferences": _normalize_text(request.preferences),
+    }
+
+def plan_fingerprint(user: User, request: PlanGenerationRequest, model: str) -> str:
+    """Stable cache key for everything that shapes a generated plan (see normalized_plan_profile)"""
+    fingerprint = {**normalized_plan_profile(user, request), "model": model}
+    raw = json.dumps(fingerprint, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+class PlanCache:
+    """Two-tier cache of parsed plan data: in-process LRU with TTL, backed by SQLite"""
+
+    def __init__(self, max_entries: int = PLAN_CACHE_SIZE, ttl_seconds: int = PLAN_CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (stored_at, plan_json)
+        self._stats = {
+            "memory_hits": 0,
+            "persistent_hits": 0,
+            "misses": 0,
+            "bypasses": 0,
+            "stores": 0,
+            "evictions": 0,
+            "errors": 0,
+        }
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        now = time.time()
+        entry = self._entries.get(key)
+        if entry is not None:
+            stored_at, plan_json = entry
+            if now - stored_at < self.ttl_seconds:
+                self._entries.move_to_end(key)
+                self._stats["memory_hits"] += 1
+                return self._load(plan_json)
+            del self._entries[key]
+
+        try:
+            async with AsyncSessionLocal() as session:
+                row = await session.get(GeneratedPlanCache, key)
+                if row is not None:
+                    age = (datetime.utcnow() - row.created_at).total_seconds()
+                    if age < self.ttl_seconds:
+                        self._remember(key, row.plan_json, now - age)
+                        self._stats["persistent_hits"] += 1
+                        return self._load(row.plan_json)
+                    await session.delete(row)
+                    await session.commit()
+        except Exception as e:
+            self._stats["errors"] += 1
+            logger.warning(f"Plan cache lookup failed: {e}")
+
+        self._stats["misses"] += 1
+        return None
+
+    async def set(self, key: str, model: str, plan_data: Dict[str, Any]):
+        # The parse report describes repairs to the response that produced the plan, not to a cache hit
+        plan_json = json.dumps({k: v for k, v in plan_data.items() if k != "parse_report"}, separators=(",", ":"))
+        self._remember(key, plan_json, time.time())
+        self._stats["stores"] += 1
+        try:
+            async with AsyncSessionLocal() as session:
+                await session.merge(GeneratedPlanCache(key=key, model=model, plan_json=plan_json))
+                await session.commit()
+        except Exception as e:
+            self._stats["errors"] += 1
+            logger.warning(f"Plan cache store failed: {e}")
+
+    def record_bypass(self):
+        self._stats["bypasses"] += 1
+
+    @staticmethod
+    def _load(plan_json: str) -> Dict[str, Any]:
+        plan_data = json.loads(plan_json)
+        plan_data.pop("parse_report", None)  # entries stored before reports were stripped
+        return plan_data
+
+    def _remember(self, key: str, plan_json: str, stored_at: float):
+        self._entries[key] = (stored_at, plan_json)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._stats["evictions"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        hits = self._stats["memory_hits"] + self._stats["persistent_hits"]
+        lookups = hits + self._stats["misses"]
+        return {
+            **self._stats,
+            "entries": len(self._entries),
+            "hit_rate": round(hits / lookups, 3) if lookups else 0.0,
+        }
+
+# ----------------------------
+# Similar-plan retrieval
+# ----------------------------
+def plan_features(user: User, request: PlanGenerationRequest) -> Dict[str, Any]:
+    """normalized_plan_profile with preferences as a token set, for the similar-plan index"""
+    features = normalized_plan_profile(user, request)
+    features["preferences"] = sorted(set(features["preferences"].split()))
+    return features
+
+def _feature_partition(features: Dict[str, Any]) -> str:
+    # Only plans with the same level, equipment and length are ever interchangeable
+    return f"{features['fitness_level']}|{features['include_equipment']}|{features['days']}"
+
+def _feature_vector(features: Dict[str, Any], dim: int) -> "np.ndarray":
+    """Signed feature hashing of the feature tokens into an L2-normalised float32 vector"""
+    weighted = [(f"age:{features['age']}", 1.0), (f"gender:{features['gender']}", 0.5)]
+    weighted += [(f"goal:{token}", 1.0) for token in features["goals"]]
+    weighted += [(f"focus:{area}", 2.0) for area in features["focus_areas"] or ["none"]]
+    weighted += [(f"pref:{token}", 0.5) for token in features["preferences"]]
+    vector = np.zeros(dim, dtype=np.float32)
+    for token, weight in weighted:
+        digest = hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest()
+        bucket = int.from_bytes(digest[:4], "little") % dim
+        vector[bucket] += weight if digest[4] & 1 else -weight
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+class SimilarPlanIndex:
+    """Cosine nearest-neighbour search over earlier generations, one NumPy matrix per partition.
+
+    Rows are hashed feature vectors of (profile, request) pairs stored in the
+    PlanGenerationRecord table and loaded on first use. A query only scans its
+    own partition (fitness level, equipment, days), so a search is one
+    matrix-vector product over plans that could actually be reused.
+    """
+
+    def __init__(self, dim: int = PLAN_INDEX_DIM):
+        self.dim = dim
+        self._vectors: Dict[str, "np.ndarray"] = {}
+        self._plan_ids: Dict[str, "np.ndarray"] = {}
+        self._counts: Dict[str, int] = {}
+        self._rows: Dict[int, Tuple[str, int]] = {}  # plan_id -> (partition, row)
+        self._loaded = False
+        self._lock = asyncio.Lock()
+        self._stats = {"searches": 0, "clones": 0, "references": 0, "search_seconds": 0.0}
+
+    async def ensure_loaded(self):
+        if self._loaded:
+            return
+        async with self._lock:
+            if self._loaded:
+                return
+            async with AsyncSessionLocal() as session:
+                result = await session.execute(select(PlanGenerationRecord).order_by(PlanGenerationRecord.id))
+                for record in result.scalars().all():
+                    self._append(record.partition, record.plan_id, _feature_vector(json.loads(record.features_json), self.dim))
+            self._loaded = True
+            logger.info(f"Loaded similar-plan index: {len(self._rows)} plans in {len(self._counts)} partitions")
+
+    def _append(self, partition: str, plan_id: int, vector: "np.ndarray"):
+        count = self._counts.get(partition, 0)
+        matrix = self._vectors.get(partition)
+        if matrix is None or count == len(matrix):
+            capacity = max(64, count * 2)
+            grown = np.zeros((capacity, self.dim), dtype=np.float32)
+            ids = np.full(capacity, -1, dtype=np.int64)
+            if matrix is not None:
+                grown[:count] = matrix[:count]
+                ids[:count] = self._plan_ids[partition][:count]
+            self._vectors[partition], self._plan_ids[partition] = grown, ids
+        self._vectors[partition][count] = vector
+        self._plan_ids[partition][count] = plan_id
+        self._counts[partition] = count + 1
+        self._rows[plan_id] = (partition, count)
+
+    async def add(self, session: AsyncSession, plan_id: int, user: User, request: PlanGenerationRequest):
+        """Record a freshly generated plan so later similar requests can reuse it. The caller commits."""
+        features = plan_features(user, request)
+        partition = _feature_partition(features)
+        session.add(PlanGenerationRecord(plan_id=plan_id, partition=partition, features_json=json.dumps(features)))
+        if self._loaded:
+            self._append(partition, plan_id, _feature_vector(features, self.dim))
+
+    def remove(self, plan_id: int):
+        """Stop returning a plan; its row is zeroed so it can never score above 0"""
+        location = self._rows.pop(plan_id, None)
+        if location:
+            partition, row = location
+            self._vectors[partition][row] = 0.0
+            self._plan_ids[partition][row] = -1
+
+    def search(self, user: User, request: PlanGenerationRequest) -> Optional[Tuple[int, float]]:
+        """Best (plan_id, cosine similarity) in the request's partition, or None when it is empty"""
+        features = plan_features(user, request)
+        partition = _feature_partition(features)
+        count = self._counts.get(partition, 0)
+        if not count:
+            return None
+        started = time.perf_counter()
+        scores = self._vectors[partition][:count] @ _feature_vector(features, self.dim)
+        best = int(np.argmax(scores))
+        self._stats["searches"] += 1
+        self._stats["search_seconds"] += time.perf_counter() - started
+        plan_id = int(self._plan_ids[partition][best])
+        return (plan_id, float(scores[best])) if plan_id >= 0 else None
+
+    def record_use(self, kind: str):
+        self._stats[kind] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        searches = self._stats["searches"]
+        return {
+            "plans": len(self._rows),
+            "partitions": len(self._counts),
+            "searches": searches,
+            "clones": self._stats["clones"],
+            "references": self._stats["references"],
+            "avg_search_ms": round(self._stats["search_seconds"] * 1000 / searches, 3) if searches else 0.0,
+        }
+
+plan_index = SimilarPlanIndex() if PLAN_SIMILARITY_ENABLED else None
+
+# ----------------------------
+# Rule-based plan generation (no model)
+# ----------------------------
+# Used when the exercise catalog has nothing for a muscle group
+BUILTIN_EXERCISES = [
+    {"name": "Push-ups", "primary_muscle": "chest", "equipment_needed": False, "default_sets": 3, "default_reps": 12},
+    {"name": "Incline Push-ups", "primary_muscle": "chest", "equipment_needed": False, "default_sets": 3, "default_reps": 12},
+    {"name": "Bodyweight Squats", "primary_muscle": "legs", "equipment_needed": False, "default_sets": 3, "default_reps": 15},
+    {"name": "Lunges", "primary_muscle": "legs", "equipment_needed": False, "default_sets": 3, "default_reps": 10},
+    {"name": "Glute Bridges", "primary_muscle": "glutes", "equipment_needed": False, "default_sets": 3, "default_reps": 15},
+    {"name": "Single-leg Romanian Deadlift", "primary_muscle": "hamstrings", "equipment_needed": False, "default_sets": 3, "default_reps": 10},
+    {"name": "Superman", "primary_muscle": "back", "equipment_needed": False, "default_sets": 3, "default_reps": 12},
+    {"name": "Doorframe Rows", "primary_muscle": "back", "equipment_needed": False, "default_sets": 3, "default_reps": 10},
+    {"name": "Pike Push-ups", "primary_muscle": "shoulders", "equipment_needed": False, "default_sets": 3, "default_reps": 8},
+    {"name": "Tricep Dips", "primary_muscle": "triceps", "equipment_needed": False, "default_sets": 3, "default_reps": 10},
+    {"name": "Towel Curls", "primary_muscle": "biceps", "equipment_needed": False, "default_sets": 3, "default_reps": 12},
+    {"name": "Plank", "primary_muscle": "core", "equipment_needed": False, "default_sets": 3, "default_reps": 30},
+    {"name": "Dead Bug", "primary_muscle": "core", "equipment_needed": False, "default_sets": 3, "default_reps": 10},
+    {"name": "Mountain Climbers", "primary_muscle": "cardio", "equipment_needed": False, "default_sets": 3, "default_reps": 20},
+    {"name": "Jumping Jacks", "primary_muscle": "cardio", "equipment_needed": False, "default_sets": 3, "default_reps": 30},
+    {"name": "Hip Flexor Stretch", "primary_muscle": "mobility", "equipment_needed": False, "default_sets": 2, "default_reps": 30},
+    {"name": "Cat-Cow", "primary_muscle": "mobility", "equipment_needed": False, "default_sets": 2, "default_reps": 10},
+    {"name": "Dumbbell Bench Press", "primary_muscle": "chest", "equipment_needed": True, "default_sets": 3, "default_reps": 10},
+    {"name": "Goblet Squat", "primary_muscle": "legs", "equipment_needed": True, "default_sets": 3, "default_reps": 10},
+    {"name": "Dumbbell Row", "primary_muscle": "back", "equipment_needed": True, "default_sets": 3, "default_reps": 10},
+    {"name": "Dumbbell Shoulder Press", "primary_muscle": "shoulders", "equipment_needed": True, "default_sets": 3, "default_reps": 10},
+    {"name": "Dumbbell Romanian Deadlift", "primary_muscle": "hamstrings", "equipment_needed": True, "default_sets": 3, "default_reps": 10},
+    {"name": "Dumbbell Curl", "primary_muscle": "biceps", "equipment_needed": True, "default_sets": 3, "default_reps": 12},
+]
+
+# Catalog muscle names mapped onto the groups the splits are built from
+MUSCLE_GROUPS = {
+    "chest": {"chest", "pecs", "pectorals"},
+    "back": {"back", "lats", "upper back", "lower back", "traps"},
+    "shoulders": {"shoulders", "delts", "deltoids"},
+    "biceps": {"biceps", "arms"},
+    "triceps": {"triceps"},
+    "legs": {"legs", "quads", "quadriceps", "calves"},
+    "glutes": {"glutes"},
+    "hamstrings": {"hamstrings"},
+    "core": {"core", "abs", "obliques"},
+    "cardio": {"cardio", "full body", "conditioning"},
+    "mobility": {"mobility", "flexibility", "stretching"},
+}
+
+# Muscle groups trained in each session type, in exercise order
+SESSION_TYPES = {
+    "Full Body": ["legs", "chest", "back", "shoulders", "core", "glutes"],
+    "Upper Body": ["chest", "back", "shoulders", "biceps", "triceps", "core"],
+    "Lower Body": ["legs", "hamstrings", "glutes", "core", "legs", "cardio"],
+    "Push": ["chest", "shoulders", "triceps", "chest", "core", "shoulders"],
+    "Pull": ["back", "biceps", "back", "core", "hamstrings", "shoulders"],
+    "Legs": ["legs", "hamstrings", "glutes", "legs", "core", "cardio"],
+    "Conditioning": ["cardio", "core", "legs", "cardio", "chest", "back"],
+    "Mobility": ["mobility", "core", "mobility"],
+}
+
+# Weekly splits per fitness level; None is a rest day
+WEEKLY_SPLITS = {
+    "beginner": ["Full Body", None, "Full Body", "Mobility", "Full Body", None, None],
+    "intermediate": ["Upper Body", "Lower Body", None, "Upper Body", "Lower Body", "Conditioning", None],
+    "advanced": ["Push", "Pull", "Legs", "Conditioning", "Upper Body", "Lower Body", None],
+}
+
+def _muscle_group(primary_muscle: Optional[str]) -> Optional[str]:
+    muscle = (primary_muscle or "").strip().lower()
+    return next((group for group, names in MUSCLE_GROUPS.items() if muscle in names), None)
+
+def build_rule_based_plan(
+    user: User,
+    request: PlanGenerationRequest,
+    catalog: List[Dict[str, Any]]
+) -> Dict[str, Any]:
+    """Build a plan in the model's JSON shape from an exercise catalog, deterministically.
+
+    The weekly split comes from the fitness level, exercises are picked per
+    muscle group (rotating through the candidates so repeated sessions vary),
+    and sets/reps start from the catalog defaults, adjusted for level and focus
+    and progressed by one rep per week.
+    """
+    level = (user.fitness_level or "beginner").lower()
+    focus = {area.lower() for area in request.focus_areas or []}
+    split = WEEKLY_SPLITS.get(level, WEEKLY_SPLITS["beginner"])
+    per_day = {"beginner": 4, "intermediate": 5, "advanced": 6}.get(level, 4)
+    set_offset = {"beginner": -1, "intermediate": 0, "advanced": 1}.get(level, 0)
+
+    by_group: Dict[str, List[Dict[str, Any]]] = {}
+    for exercise in sorted(catalog, key=lambda e: e["name"].lower()):
+        group = _muscle_group(exercise.get("primary_muscle"))
+        if group and (request.include_equipment or not exercise.get("equipment_needed")):
+            by_group.setdefault(group, []).append(exercise)
+
+    if focus & {"strength", "muscle_gain"}:
+        reps_range, rest = ((5, 8), 120) if "strength" in focus else ((8, 12), 90)
+    elif focus & {"cardio", "endurance", "weight_loss"}:
+        reps_range, rest = (15, 20), 45
+    else:
+        reps_range, rest = None, 60
+
+    occurrences: Dict[str, int] = {}
+    days = []
+    for day_number in range(1, request.days + 1):
+        session = split[(day_number - 1) % len(split)]
+        if session == "Mobility" and "flexibility" not in focus and level != "beginner":
+            session = None
+        if session is None:
+            days.append({"day_number": day_number, "title": f"Day {day_number} - Rest", "rest_day": True, "exercises": []})
+            continue
+
+        rotation = occurrences.get(session, 0)
+        occurrences[session] = rotation + 1
+        groups = list(SESSION_TYPES[session])
+        if focus & {"cardio", "endurance", "weight_loss"} and "cardio" not in groups[:per_day]:
+            groups.insert(per_day - 1, "cardio")
+        if "flexibility" in focus:
+            groups.insert(0, "mobility")
+
+        week = (day_number - 1) // len(split)
+        chosen: List[Dict[str, Any]] = []
+        for group in groups:
+            candidates = [e for e in by_group.get(group, []) if e not in chosen]
+            if candidates:
+                chosen.append(candidates[(rotation + len(chosen)) % len(candidates)])
+            if len(chosen) == per_day:
+                break
+
+        exercises = []
+        for exercise in chosen:
+            group = _muscle_group(exercise.get("primary_muscle"))
+            reps = exercise.get("default_reps") or 10
+            if reps_range and group not in ("core", "mobility"):
+                reps = min(max(reps, reps_range[0]), reps_range[1])
+            exercises.append({
+                "name": exercise["name"],
+                "sets": min(10, max(1, (exercise.get("default_sets") or 3) + set_offset)),
+                "reps": min(100, reps + week),
+                "rest_seconds": 30 if group == "mobility" else rest,
+                "primary_muscle": exercise.get("primary_muscle"),
+                "equipment_needed": bool(exercise.get("equipment_needed")),
+                "notes": "Hold or move slowly through the range" if group == "mobility" else "Controlled tempo, stop 1-2 reps short of failure"
+            })
+        days.append({"day_number": day_number, "title": f"Day {day_number} - {session}", "rest_day": False, "exercises": exercises})
+
+    focus_text = ", ".join(sorted(focus)) if focus else "balanced fitness"
+    return {
+        "plan_title": f"{request.days}-Day {level.title()} Plan",
+        "plan_description": f"Rule-based {level} plan focused on {focus_text}, built from the exercise catalog",
+        "days": days,
+        "generator": "rules",
+    }
+
+async def generate_rule_based_plan(user: User, request: PlanGenerationRequest) -> Dict[str, Any]:
+    """Build a plan from the ExerciseType catalog, topped up with built-in exercises"""
+    async with AsyncSessionLocal() as session:
+        result = await session.execute(select(ExerciseType))
+        catalog = [
+            {
+                "name": exercise.name,
+                "primary_muscle": exercise.primary_muscle,
+                "equipment_needed": exercise.equipment_needed,
+                "default_sets": exercise.default_sets,
+                "default_reps": exercise.default_reps,
+            }
+            for exercise in result.scalars().all()
+        ]
+    known = {exercise["name"].lower() for exercise in catalog}
+    catalog.extend(exercise for exercise in BUILTIN_EXERCISES if exercise["name"].lower() not in known)
+    return build_rule_based_plan(user, request, catalog)
+
+# ----------------------------
+# Ollama concurrency control
+# ----------------------------
+class ModelOverloadedError(Exception):
+    """Raised instead of queueing more work when Ollama is saturated or failing"""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+class AdaptiveLimiter:
+    """AIMD concurrency limit with a bounded FIFO wait queue.
+
+    Each call that finishes within the latency target raises the limit by
+    1/limit (about +1 per round of calls); a slow or failed call multiplies it
+    by ``backoff``. Callers beyond the limit wait in a queue of at most
+    ``max_queue`` entries; anything beyond that is rejected immediately.
+    """
+
+    def __init__(
+        self,
+        initial_limit: int = OLLAMA_CONCURRENCY_INITIAL,
+        min_limit: int = OLLAMA_CONCURRENCY_MIN,
+        max_limit: int = OLLAMA_CONCURRENCY_MAX,
+        latency_target: float = OLLAMA_LATENCY_TARGET,
+        max_queue: int = OLLAMA_QUEUE_SIZE,
+        queue_timeout: float = OLLAMA_QUEUE_TIMEOUT,
+        backoff: float = 0.7
+    ):
+        self.min_limit = min_limit
+        self.max_limit = max(max_limit, min_limit)
+        self.limit = float(min(max(initial_limit, min_limit), self.max_limit))
+        self.latency_target = latency_target
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.backoff = backoff
+        self.in_flight = 0
+        self._waiters: "deque[asyncio.Future]" = deque()
+        self._avg_latency = latency_target / 2
+        self._stats = {"admitted": 0, "queued": 0, "rejected": 0, "timed_out": 0}
+
+    @asynccontextmanager
+    async def slot(self):
+        await self.acquire()
+        started = time.perf_counter()
+        ok = False
+        try:
+            yield
+            ok = True
+        finally:
+            self.release(time.perf_counter() - started, ok)
+
+    async def acquire(self):
+        if self.in_flight < int(self.limit) and not self._waiters:
+            self.in_flight += 1
+            self._stats["admitted"] += 1
+            return
+        if len(self._waiters) >= self.max_queue:
+            self._stats["rejected"] += 1
+            raise ModelOverloadedError("Model is at capacity, try again later", self.retry_after())
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self._stats["queued"] += 1
+        try:
+            await asyncio.wait_for(waiter, self.queue_timeout)
+        except asyncio.TimeoutError:
+            self._discard(waiter)
+            self._stats["timed_out"] += 1
+            raise ModelOverloadedError("Timed out waiting for model capacity", self.retry_after())
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self.release(0.0, True, adjust=False)  # slot was granted just as we were cancelled
+            else:
+                self._discard(waiter)
+            raise
+        self._stats["admitted"] += 1
+
+    def release(self, latency: float, ok: bool, adjust: bool = True):
+        saturated = self.in_flight >= int(self.limit)
+        self.in_flight -= 1
+        if adjust:
+            self._avg_latency = 0.8 * self._avg_latency + 0.2 * latency
+            if ok and latency <= self.latency_target:
+                # Only probe upwards when the current limit is actually being used
+                if saturated:
+                    self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+            else:
+                self.limit = max(self.min_limit, self.limit * self.backoff)
+        self._wake()
+
+    def has_capacity(self) -> bool:
+        return self.in_flight < int(self.limit) or len(self._waiters) < self.max_queue
+
+    def retry_after(self) -> int:
+        """Rough seconds until a queued caller would get a slot"""
+        rounds = (len(self._waiters) + 1) / max(1, int(self.limit))
+        return int(min(120, max(1, rounds * self._avg_latency)))
+
+    def _wake(self):
+        while self._waiters and self.in_flight < int(self.limit):
+            waiter = self._waiters.popleft()
+            if waiter.done():
+                continue
+            self.in_flight += 1
+            waiter.set_result(True)
+
+    def _discard(self, waiter: "asyncio.Future"):
+        try:
+            self._waiters.remove(waiter)
+        except ValueError:
+            pass
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self._stats,
+            "limit": round(self.limit, 2),
+            "in_flight": self.in_flight,
+            "waiting": len(self._waiters),
+            "avg_latency_seconds": round(self._avg_latency, 3),
+        }
+
+def overloaded_http_error(error: ModelOverloadedError) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail=str(error),
+        headers={"Retry-After": str(error.retry_after)}
+    )
+
+class CircuitBreaker:
+    """Stops sending work to Ollama after consecutive failures, then probes with one call"""
+
+    def __init__(self, failure_threshold: int = OLLAMA_BREAKER_THRESHOLD, reset_seconds: float = OLLAMA_BREAKER_RESET_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = "closed"  # closed, open, half_open
+        self.failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._stats = {"opened": 0, "short_circuited": 0}
+
+    def before_call(self):
+        if self.state == "open":
+            remaining = self.reset_seconds - (time.monotonic() - self._opened_at)
+            if remaining > 0:
+                self._stats["short_circuited"] += 1
+                raise ModelOverloadedError("Model backend is unavailable (circuit open)", int(remaining) + 1)
+            self.state = "half_open"
+        if self.state == "half_open":
+            if self._trial_in_flight:
+                self._stats["short_circuited"] += 1
+                raise ModelOverloadedError("Model backend is recovering, try again shortly", 1)
+            self._trial_in_flight = True
+
+    def record_success(self):
+        self.failures = 0
+        self._trial_in_flight = False
+        self.state = "closed"
+
+    def record_failure(self):
+        self.failures += 1
+        self._trial_in_flight = False
+        if self.state == "half_open" or self.failures >= self.failure_threshold:
+            if self.state != "open":
+                self._stats["opened"] += 1
+                logger.warning(f"Ollama circuit opened after {self.failures} consecutive failures")
+            self.state = "open"
+            self._opened_at = time.monotonic()
+
+    def release_trial(self):
+        self._trial_in_flight = False
+
+    def allows_calls(self) -> bool:
+        return self.state != "open" or time.monotonic() - self._opened_at >= self.reset_seconds
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self._stats, "state": self.state, "consecutive_failures": self.failures}
+
+class GenerationScheduler:
+    """Orders plan generations across priority lanes and, within a lane, fairly across users.
+
+    Lanes are served in strict priority order (interactive, agent, batch), each
+    capped at its own concurrency, and together never above ``capacity()`` (the
+    limiter's current limit) so that ordering is decided here rather than in the
+    limiter's FIFO queue. Inside a lane, requests are ordered by weighted fair
+    queuing: each user's requests get virtual finish tags advanced by their cost
+    (plan days), so one user regenerating long plans cannot starve others.
+    """
+
+    class _Lane:
+        def __init__(self, limit: int):
+            self.limit = limit
+            self.running = 0
+            self.queue: List[list] = []  # heap of [finish_tag, seq, future, start_tag, enqueued_at]
+            self.virtual_time = 0.0
+            self.user_finish: Dict[Any, float] = {}
+            self.waits: "deque[float]" = deque(maxlen=500)
+            self.dispatched = 0
+            self.rejected = 0
+            self.timed_out = 0
+
+    def __init__(
+        self,
+        capacity: Callable[[], int],
+        lane_limits: Optional[Dict[str, int]] = None,
+        max_queue: int = GEN_LANE_QUEUE_SIZE,
+        queue_timeout: float = OLLAMA_QUEUE_TIMEOUT
+    ):
+        self.capacity = capacity
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.lanes = {name: self._Lane(limit) for name, limit in (lane_limits or GEN_LANE_LIMITS).items()}
+        self.running = 0
+        self._seq = 0
+
+    @asynccontextmanager
+    async def slot(self, user_id: Any, lane: str = "interactive", cost: float = 1.0, weight: float = 1.0):
+        lane_name = lane if lane in self.lanes else "interactive"
+        await self._acquire(user_id, lane_name, cost, weight)
+        try:
+            yield
+        finally:
+            self._release(lane_name)
+
+    def has_capacity(self, lane: str = "interactive") -> bool:
+        return len(self.lanes[lane].queue) < self.max_queue
+
+    def is_idle(self) -> bool:
+        return self.running == 0 and not any(l.queue for l in self.lanes.values())
+
+    async def _acquire(self, user_id: Any, lane_name: str, cost: float, weight: float):
+        lane = self.lanes[lane_name]
+        if len(lane.queue) >= self.max_queue:
+            lane.rejected += 1
+            raise ModelOverloadedError(f"Too many queued {lane_name} generations, try again later", 30)
+
+        start_tag = max(lane.virtual_time, lane.user_finish.get(user_id, 0.0))
+        finish_tag = start_tag + cost / max(weight, 1e-6)
+        lane.user_finish[user_id] = finish_tag
+        self._seq += 1
+        waiter = asyncio.get_running_loop().create_future()
+        heapq.heappush(lane.queue, [finish_tag, self._seq, waiter, start_tag, time.perf_counter()])
+        self._dispatch()
+
+        try:
+            await asyncio.wait_for(waiter, self.queue_timeout)
+        except asyncio.TimeoutError:
+            # The cancelled future is skipped when it reaches the head of the queue
+            lane.timed_out += 1
+            raise ModelOverloadedError(f"Timed out waiting for a {lane_name} generation slot", 30)
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self._release(lane_name)  # granted just as the caller went away
+            # otherwise the cancelled future is skipped when it reaches the head of the queue
+            raise
+
+    def _release(self, lane_name: str):
+        lane = self.lanes[lane_name]
+        lane.running -= 1
+        self.running -= 1
+        if lane.running == 0 and not lane.queue:
+            lane.virtual_time = 0.0
+            lane.user_finish.clear()
+        self._dispatch()
+
+    def _dispatch(self):
+        while self.running < max(1, self.capacity()):
+            for name in GENERATION_LANES:
+                lane = self.lanes.get(name)
+                if lane is None or lane.running >= lane.limit:
+                    continue
+                while lane.queue and lane.queue[0][2].done():
+                    heapq.heappop(lane.queue)  # cancelled while waiting
+                if not lane.queue:
+                    continue
+                _, _, waiter, start_tag, enqueued_at = heapq.heappop(lane.queue)
+                lane.virtual_time = max(lane.virtual_time, start_tag)
+                lane.running += 1
+                lane.dispatched += 1
+                lane.waits.append(time.perf_counter() - enqueued_at)
+                self.running += 1
+                waiter.set_result(True)
+                break
+            else:
+                return
+
+    def stats(self) -> Dict[str, Any]:
+        lanes = {}
+        for name, lane in self.lanes.items():
+            waits = sorted(lane.waits)
+            lanes[name] = {
+                "limit": lane.limit,
+                "running": lane.running,
+                "waiting": len(lane.queue),
+                "dispatched": lane.dispatched,
+                "rejected": lane.rejected,
+                "timed_out": lane.timed_out,
+                "queue_seconds_avg": round(sum(waits) / len(waits), 3) if waits else 0.0,
+                "queue_seconds_p50": round(waits[len(waits) // 2], 3) if waits else 0.0,
+                "queue_seconds_p99": round(waits[min(len(waits) - 1, int(len(waits) * 0.99))], 3) if waits else 0.0,
+            }
+        return {"running": self.running, "capacity": self.capacity(), "lanes": lanes}
+
+class OllamaBackend:
+    """One Ollama endpoint with its outstanding-request count and passive health record"""
+
+    def __init__(self, url: str):
+        self.url = url.rstrip("/")
+        self.in_flight = 0
+        self.consecutive_failures = 0
+        self.ejected_until = 0.0
+        self.ewma_latency = 0.0
+        self.requests = 0
+        self.failures = 0
+
+    def is_healthy(self, now: float) -> bool:
+        return self.ejected_until <= now
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "url": self.url,
+            "in_flight": self.in_flight,
+            "requests": self.requests,
+            "failures": self.failures,
+            "avg_latency_seconds": round(self.ewma_latency, 3),
+            "ejected": not self.is_healthy(time.monotonic()),
+        }
+
+class BackendPool:
+    """Routes each call to the healthy backend with the fewest in-flight requests.
+
+    Backends are ejected for ``eject_seconds`` after ``eject_failures``
+    consecutive failures. If every backend is ejected, the one whose ejection
+    ends first is used anyway rather than failing outright.
+    """
+
+    def __init__(
+        self,
+        urls: List[str],
+        eject_failures: int = OLLAMA_EJECT_FAILURES,
+        eject_seconds: float = OLLAMA_EJECT_SECONDS,
+        hedge_percentile: float = OLLAMA_HEDGE_PERCENTILE,
+        hedge_min_samples: int = OLLAMA_HEDGE_MIN_SAMPLES
+    ):
+        self.backends = [OllamaBackend(url) for url in urls]
+        self.eject_failures = eject_failures
+        self.eject_seconds = eject_seconds
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        self._latencies: "deque[float]" = deque(maxlen=500)
+        self._stats = {"hedged": 0, "hedge_wins": 0}
+
+    def pick(self, exclude: Optional[List[OllamaBackend]] = None) -> Optional[OllamaBackend]:
+        candidates = [b for b in self.backends if not exclude or b not in exclude]
+        if not candidates:
+            return None
+        now = time.monotonic()
+        healthy = [b for b in candidates if b.is_healthy(now)]
+        if not healthy:
+            return min(candidates, key=lambda b: b.ejected_until)
+        return min(healthy, key=lambda b: (b.in_flight, b.consecutive_failures, b.ewma_latency))
+
+    def record_success(self, backend: OllamaBackend, latency: float):
+        backend.consecutive_failures = 0
+        backend.ewma_latency = latency if not backend.ewma_latency else 0.8 * backend.ewma_latency + 0.2 * latency
+        self._latencies.append(latency)
+
+    def record_failure(self, backend: OllamaBackend):
+        backend.failures += 1
+        backend.consecutive_failures += 1
+        if backend.consecutive_failures >= self.eject_failures:
+            backend.ejected_until = time.monotonic() + self.eject_seconds
+            logger.warning(f"Ejected Ollama backend {backend.url} for {self.eject_seconds:.0f}s")
+
+    def record_hedge(self, won: bool = False):
+        self._stats["hedge_wins" if won else "hedged"] += 1
+
+    def hedge_delay(self) -> Optional[float]:
+        """Latency percentile after which a duplicate request is sent, once enough samples exist"""
+        if self.hedge_percentile <= 0 or len(self.backends) < 2 or len(self._latencies) < self.hedge_min_samples:
+            return None
+        ordered = sorted(self._latencies)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * self.hedge_percentile))]
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self._stats, "hedge_delay_seconds": self.hedge_delay(), "backends": [b.stats() for b in self.backends]}
+
+# ----------------------------
+# Model routing
+# ----------------------------
+class ModelRouter:
+    """Picks a model per request from rules and records per-model outcomes.
+
+    Each rule may constrain ``min_days``/``max_days``, ``fitness_levels`` and
+    ``focus_areas`` (every requested area must be listed). ``route`` returns the
+    chosen model followed by the models it escalates to when its output cannot
+    be parsed or is incomplete: the entries after it in ``escalation``, or the
+    whole list when the chosen model is not part of it.
+    """
+
+    def __init__(
+        self,
+        default_model: str = OLLAMA_MODEL,
+        rules: Optional[List[Dict[str, Any]]] = None,
+        escalation: Optional[List[str]] = None
+    ):
+        self.default_model = default_model
+        self.rules = MODEL_ROUTES if rules is None else rules
+        self.escalation = MODEL_ESCALATION if escalation is None else escalation
+        self._stats: Dict[str, Dict[str, Any]] = {}
+
+    def route(self, user: User, request: PlanGenerationRequest) -> List[str]:
+        model = next((rule["model"] for rule in self.rules if self._matches(rule, user, request)), self.default_model)
+        if model in self.escalation:
+            chain = [model] + self.escalation[self.escalation.index(model) + 1:]
+        else:
+            chain = [model] + [m for m in self.escalation if m != model]
+        return chain
+
+    @staticmethod
+    def _matches(rule: Dict[str, Any], user: User, request: PlanGenerationRequest) -> bool:
+        if "min_days" in rule and request.days < rule["min_days"]:
+            return False
+        if "max_days" in rule and request.days > rule["max_days"]:
+            return False
+        if "fitness_levels" in rule and (user.fitness_level or "beginner") not in rule["fitness_levels"]:
+            return False
+        if "focus_areas" in rule:
+            allowed = {area.lower() for area in rule["focus_areas"]}
+            if not {area.lower() for area in request.focus_areas or []} <= allowed:
+                return False
+        return True
+
+    def models(self) -> List[str]:
+        """Every model a request can be routed or escalated to"""
+        names = [self.default_model] + [rule["model"] for rule in self.rules] + self.escalation
+        return list(dict.fromkeys(names))
+
+    def record(self, model: str, ok: bool, latency: float, escalated: bool = False):
+        entry = self._stats.setdefault(
+            model, {"attempts": 0, "succeeded": 0, "escalated": 0, "total_latency": 0.0}
+        )
+        entry["attempts"] += 1
+        entry["succeeded"] += int(ok)
+        entry["escalated"] += int(escalated)
+        entry["total_latency"] += latency
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            model: {
+                "attempts": entry["attempts"],
+                "succeeded": entry["succeeded"],
+                "escalated": entry["escalated"],
+                "success_rate": round(entry["succeeded"] / entry["attempts"], 3),
+                "avg_latency_seconds": round(entry["total_latency"] / entry["attempts"], 3),
+            }
+            for model, entry in self._stats.items()
+        }
+
+# ----------------------------
+# Model client (Ollama wrapper) with better error handling
+# ----------------------------
+class ModelClient:
+    def __init__(
+        self,
+        base_url: Optional[str] = None,
+        model: str = OLLAMA_MODEL,
+        max_connections: int = OLLAMA_MAX_CONNECTIONS,
+        max_keepalive: int = OLLAMA_MAX_KEEPALIVE,
+        keepalive_expiry: float = OLLAMA_KEEPALIVE_EXPIRY,
+        connect_timeout: float = OLLAMA_CONNECT_TIMEOUT,
+        read_timeout: float = OLLAMA_READ_TIMEOUT,
+        pool_timeout: float = OLLAMA_POOL_TIMEOUT,
+        cache: Optional[PlanCache] = None,
+        chunk_days: int = PLAN_CHUNK_DAYS,
+        repair: bool = PLAN_REPAIR_ENABLED,
+        rules_fallback: bool = PLAN_RULES_FALLBACK,
+        structured_output: bool = OLLAMA_STRUCTURED_OUTPUT,
+        prefix_mode: str = OLLAMA_PREFIX_MODE,
+        keep_alive: str = OLLAMA_KEEP_ALIVE,
+        status_interval: float = OLLAMA_STATUS_INTERVAL_SECONDS,
+        limiter: Optional[AdaptiveLimiter] = None,
+        breaker: Optional[CircuitBreaker] = None,
+        base_urls: Optional[List[str]] = None,
+        scheduler: Optional[GenerationScheduler] = None,
+        router: Optional[ModelRouter] = None,
+    ):
+        self.pool = BackendPool(base_urls or ([base_url] if base_url else OLLAMA_URLS))
+        self.base_url = self.pool.backends[0].url
+        self.model = model
+        self.cache = cache
+        self.chunk_days = chunk_days
+        self.repair = repair
+        self.rules_fallback = rules_fallback
+        self.structured_output = structured_output
+        self.prefix_mode = prefix_mode
+        self._prefix_contexts: Dict[str, List[int]] = {}  # model -> token context of the evaluated prefix
+        self._prefix_lock = asyncio.Lock()
+        self._prompt_eval: Dict[str, Dict[str, float]] = {}  # "full" / "context" -> prompt-eval totals
+        self.keep_alive = keep_alive
+        self.status_interval = status_interval
+        self._model_status: Dict[str, Any] = {
+            "model": model, "keep_alive": keep_alive, "resident": False, "models": {}, "checked_at": None, "backends": []
+        }
+        self._warm_up_task: Optional[asyncio.Task] = None
+        self._status_task: Optional[asyncio.Task] = None
+        self.limiter = limiter or AdaptiveLimiter()
+        self.breaker = breaker or CircuitBreaker()
+        self.scheduler = scheduler or GenerationScheduler(capacity=lambda: int(self.limiter.limit))
+        self.router = router or ModelRouter(default_model=model)
+        self._inflight: Dict[str, "asyncio.Task"] = {}  # prompt hash -> shared model call
+        self._stats = {"model_calls": 0, "coalesced": 0, "rules_fallbacks": 0}
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.timeout = httpx.Timeout(
+            connect=connect_timeout,
+            read=read_timeout,
+            write=connect_timeout,
+            pool=pool_timeout,
+        )
+        self._client: Optional[httpx.AsyncClient] = None
+
+    async def start(self):
+        """Open the pooled HTTP client. Safe to call more than once."""
+        if self._client is None or self._client.is_closed:
+            self._client = self._open_client()
+            logger.info(
+                f"Ollama client opened ({', '.join(b.url for b in self.pool.backends)}, "
+                f"max_connections={self.limits.max_connections})"
+            )
+
+    async def close(self):
+        """Stop background warm-up and status polling, then close the pooled HTTP client."""
+        tasks = [task for task in (self._warm_up_task, self._status_task) if task is not None]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._warm_up_task = self._status_task = None
+        if self._client is not None and not self._client.is_closed:
+            await self._client.aclose()
+        self._client = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        # Lazily open for callers that never went through an app startup hook
+        # (scripts, tests); the pool itself is still reused across calls.
+        if self._client is None or self._client.is_closed:
+            self._client = self._open_client()
+        return self._client
+
+    def _open_client(self) -> httpx.AsyncClient:
+        return httpx.AsyncClient(limits=self.limits, timeout=self.timeout)
+
+    def start_warm_up(self):
+        """Warm up in the background so startup does not wait on a cold or unreachable backend"""
+        if self._warm_up_task is None:
+            self._warm_up_task = asyncio.create_task(self._warm_up_and_refresh())
+
+    async def _warm_up_and_refresh(self):
+        await self.warm_up()
+        await self.refresh_model_status()
+
+    def start_status_refresh(self):
+        """Poll model residency every ``status_interval`` seconds for ``model_status``"""
+        if self._status_task is None:
+            self._status_task = asyncio.create_task(self._refresh_model_status_loop())
+
+    async def _refresh_model_status_loop(self):
+        while True:
+            try:
+                await self.refresh_model_status()
+            except Exception as e:
+                logger.warning(f"Model status refresh failed: {e}")
+            await asyncio.sleep(self.status_interval)
+
+    async def warm_up(self) -> bool:
+        """Load every routable model on every backend so the first real request skips the load time"""
+        results = await asyncio.gather(*[
+            self._warm_up_backend(b, model) for b in self.pool.backends for model in self.router.models()
+        ])
+        return all(results)
+
+    async def _warm_up_backend(self, backend: OllamaBackend, model: str) -> bool:
+        started = time.perf_counter()
+        try:
+            # An empty prompt makes Ollama load the model and return without generating
+            response = await self.client.post(
+                f"{backend.url}/api/generate",
+                json={"model": model, "prompt": "", "keep_alive": self.keep_alive}
+            )
+            response.raise_for_status()
+        except Exception as e:
+            logger.warning(f"Model warm-up failed for {model} on {backend.url}: {e}")
+            return False
+        logger.info(
+            f"Model {model} loaded on {backend.url} in {time.perf_counter() - started:.1f}s "
+            f"(keep_alive={self.keep_alive})"
+        )
+        return True
+
+    def model_status(self) -> Dict[str, Any]:
+        """The last residency snapshot; refreshed in the background, so this does no I/O"""
+        return self._model_status
+
+    async def refresh_model_status(self) -> Dict[str, Any]:
+        """Record which routable models are resident on each backend (via /api/ps)"""
+        models = self.router.models()
+        backends = await asyncio.gather(*[self._backend_model_status(b, models) for b in self.pool.backends])
+        self._model_status = {
+            "model": self.model,
+            "keep_alive": self.keep_alive,
+            "resident": any(self.model in b["resident"] for b in backends),
+            "models": {model: any(model in b["resident"] for b in backends) for model in models},
+            "checked_at": datetime.utcnow().isoformat(),
+            "backends": backends,
+        }
+        return self._model_status
+
+    async def _backend_model_status(self, backend: OllamaBackend, models: List[str]) -> Dict[str, Any]:
+        status_info: Dict[str, Any] = {"url": backend.url, "resident": {}}
+        try:
+            response = await self.client.get(f"{backend.url}/api/ps", timeout=3.0)
+            response.raise_for_status()
+        except Exception as e:
+            status_info["error"] = str(e) or type(e).__name__
+            return status_info
+        
+        # Ollama reports untagged models as "<name>:latest"
+        aliases = {name: model for model in models for name in (model, model if ":" in model else f"{model}:latest")}
+        for loaded in response.json().get("models", []):
+            model = aliases.get(loaded.get("name")) or aliases.get(loaded.get("model"))
+            if model:
+                status_info["resident"][model] = loaded.get("expires_at")
+        return status_info
+
+    async def generate_plan(
+        self,
+        user: User,
+        request: PlanGenerationRequest,
+        lane: str = "interactive",
+        reference: Optional[Dict[str, Any]] = None
+    ) -> Dict[str, Any]:
+        """Generate (or fetch from cache) a plan; ``lane`` picks the scheduling priority.
+
+        ``reference`` is an earlier plan for a similar profile, summarised in the
+        prompt as a starting point.
+
+        ``request.generator == "rules"`` builds the plan from the exercise catalog
+        without the model, which is also the fallback when Ollama rejects work.
+        """
+        if request.generator == "rules":
+            return await generate_rule_based_plan(user, request)
+
+        models = self.router.route(user, request)
+        cache_key = self._cache_key(user, request, models[0])
+        if cache_key:
+            cached = await self.cache.get(cache_key)
+            if cached is not None:
+                logger.info(f"Plan cache hit for user {user.id}")
+                return cached
+
+        try:
+            async with self.scheduler.slot(user.id, lane, cost=request.days):
+                plan_data, model = await self._generate_routed(user, request, models, reference)
+        except ModelOverloadedError as e:
+            if self.rules_fallback:
+                logger.warning(f"Plan generation rejected ({e}), falling back to the rule-based generator")
+                self._stats["rules_fallbacks"] += 1
+                return await generate_rule_based_plan(user, request)
+            logger.warning(f"Plan generation rejected: {e}")
+            raise overloaded_http_error(e)
+        except Exception as e:
+            logger.error(f"Plan generation failed: {e}")
+            raise HTTPException(status_code=500, detail=f"Plan generation failed: {str(e)}")
+
+        if self.cache and self._cacheable(plan_data, request):
+            await self.cache.set(plan_fingerprint(user, request, models[0]), model, plan_data)
+        return plan_data
+
+    async def _generate_routed(
+        self,
+        user: User,
+        request: PlanGenerationRequest,
+        models: List[str],
+        reference: Optional[Dict[str, Any]] = None
+    ) -> Tuple[Dict[str, Any], str]:
+        """Try each model in the routing chain until one returns a complete plan.
+
+        Unparseable or incomplete output moves on to the next (larger) model;
+        the last model's salvaged result is returned rather than failing.
+        Transport errors and overload are not the model's fault and are raised.
+        """
+        for index, model in enumerate(models):
+            last = index == len(models) - 1
+            started = time.perf_counter()
+            try:
+                if self.chunk_days and request.days > self.chunk_days:
+                    plan_data = await self._generate_chunked(user, request, model)
+                else:
+                    prompt, context = await self._plan_prompt(user, request, model, reference)
+                    plan_data = await self._generate_json(prompt, PLAN_JSON_SCHEMA, model=model, context=context)
+                plan_data = await self._repair_plan(user, request, plan_data, model)
+                reason = None if self._plan_complete(plan_data, request) else "incomplete plan"
+            except ValueError as e:
+                plan_data, reason = None, str(e)
+            except Exception:
+                self.router.record(model, False, time.perf_counter() - started)
+                raise
+            
+            self.router.record(model, reason is None, time.perf_counter() - started, escalated=reason is not None and not last)
+            if reason is None or (last and plan_data is not None):
+                return plan_data, model
+            if last:
+                raise ValueError(reason)
+            logger.warning(f"Escalating plan generation from {model} to {models[index + 1]}: {reason}")
+        raise ValueError("No model configured")
+
+    async def _repair_plan(
+        self,
+        user: User,
+        request: PlanGenerationRequest,
+        plan_data: Dict[str, Any],
+        model: str
+    ) -> Dict[str, Any]:
+        """Clamp out-of-range values and regenerate only the days that are missing or unusable"""
+        report = validate_plan(plan_data, request.days)
+        missing = report["missing_days"]
+        if missing and self.repair:
+            regenerated = await self._regenerate_days(user, request, plan_data, missing, model)
+            plan_data["days"] = sorted(plan_data["days"] + regenerated, key=lambda day: day["day_number"])
+            report["regenerated_days"] = [day["day_number"] for day in regenerated]
+            report["missing_days"] = [n for n in missing if n not in report["regenerated_days"]]
+        if report["clamped_values"] or missing:
+            plan_data["parse_report"] = {**plan_data.get("parse_report", {}), **report}
+            logger.info(f"Validated plan with {model}: {report}")
+        return plan_data
+
+    async def _regenerate_days(
+        self,
+        user: User,
+        request: PlanGenerationRequest,
+        plan_data: Dict[str, Any],
+        missing: List[int],
+        model: str
+    ) -> List[Dict[str, Any]]:
+        """Ask for just the listed day numbers, with the good days as context; returns the usable ones"""
+        prompt = self._build_repair_prompt(user, request, plan_data, missing)
+        try:
+            response = await self._generate_json(prompt, PLAN_CHUNK_JSON_SCHEMA, model=model)
+        except ValueError as e:
+            logger.warning(f"Regenerating days {missing} failed: {e}")
+            return []
+
+        days = [day for day in response.get("days") or [] if isinstance(day, dict)]
+        if len(days) == len(missing) and any(day.get("day_number") not in missing for day in days):
+            for number, day in zip(missing, days):  # the model numbered them from 1
+                day["day_number"] = number
+        regenerated: Dict[int, Dict[str, Any]] = {}
+        for day in days:
+            day, _ = normalize_plan_day(day, request.days)
+            if day is not None and day["day_number"] in missing:
+                regenerated.setdefault(day["day_number"], day)
+        return [regenerated[number] for number in sorted(regenerated)]
+
+    @staticmethod
+    def _plan_complete(plan_data: Dict[str, Any], request: PlanGenerationRequest) -> bool:
+        days = [day for day in plan_data.get("days") or [] if isinstance(day, dict)]
+        return len(days) >= request.days
+
+    @classmethod
+    def _cacheable(cls, plan_data: Dict[str, Any], request: PlanGenerationRequest) -> bool:
+        # A salvaged short plan would be served to every identical profile, without its parse report
+        return cls._plan_complete(plan_data, request) and plan_is_complete(plan_data, request.days)
+
+    async def _generate_chunked(self, user: User, request: PlanGenerationRequest, model: Optional[str] = None) -> Dict[str, Any]:
+        """Generate a long plan as a shared outline followed by concurrent week-sized chunks.
+
+        The outline fixes the title and the repeating weekly split first, so the
+        chunks generated in parallel stay consistent with each other.
+        """
+        outline = await self._generate_json(
+            self._build_outline_prompt(user, request), PLAN_OUTLINE_JSON_SCHEMA, required_key="weekly_split", model=model
+        )
+        split = outline.get("weekly_split") or []
+
+        ranges = [
+            (start, min(start + self.chunk_days - 1, request.days))
+            for start in range(1, request.days + 1, self.chunk_days)
+        ]
+        chunks = await asyncio.gather(*[
+            self._generate_json(
+                self._build_chunk_prompt(user, request, outline, start, end), PLAN_CHUNK_JSON_SCHEMA, model=model
+            )
+            for start, end in ranges
+        ])
+
+        days: List[Dict[str, Any]] = []
+        recovered: List[Any] = []
+        for (start, end), chunk in zip(ranges, chunks):
+            aligned = self._align_chunk_days(chunk.get("days", []), start, end, split)
+            days.extend(aligned)
+            if "parse_report" in chunk:
+                recovered.extend(day["day_number"] for day in aligned)
+
+        logger.info(f"Merged {len(ranges)} plan chunks into {len(days)} days")
+        plan_data = {
+            "plan_title": outline.get("plan_title"),
+            "plan_description": outline.get("plan_description"),
+            "days": days,
+        }
+        if recovered:
+            plan_data["parse_report"] = {"repaired": True, "recovered_days": recovered}
+        return plan_data
+
+    @staticmethod
+    def _align_chunk_days(
+        chunk_days: List[Dict[str, Any]],
+        start: int,
+        end: int,
+        split: List[Dict[str, Any]]
+    ) -> List[Dict[str, Any]]:
+        """Number a chunk's days start..end, whether the model counted from 1 or from start"""
+        chunk_days = [day for day in chunk_days if isinstance(day, dict)][:end - start + 1]
+        numbers = [day.get("day_number") for day in chunk_days]
+        if not all(isinstance(n, int) and start <= n <= end for n in numbers):
+            for offset, day in enumerate(chunk_days):
+                day["day_number"] = start + offset
+        for day in chunk_days:
+            if not day.get("title") and split:
+                slot = split[(day["day_number"] - 1) % len(split)]
+                day["title"] = f"Day {day['day_number']} - {slot.get('title', 'Workout')}"
+        return sorted(chunk_days, key=lambda day: day["day_number"])
+
+    async def _generate_json(
+        self,
+        prompt: str,
+        schema: Optional[Dict[str, Any]] = None,
+        required_key: str = "days",
+        model: Optional[str] = None,
+        context: Optional[List[int]] = None
+    ) -> Dict[str, Any]:
+        """Call the model and parse its JSON, sharing one call between identical concurrent prompts.
+
+        The shared call runs as its own task so that a caller disconnecting does
+        not cancel it for everyone else; each caller gets a private copy of the
+        result to persist as its own plan.
+        """
+        model = model or self.model
+        key = hashlib.sha256(f"{model}\n{bool(context)}\n{prompt}".encode("utf-8")).hexdigest()
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._call_and_parse(prompt, schema, required_key, model, context))
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._forget_inflight(key, done))
+        else:
+            self._stats["coalesced"] += 1
+            logger.info(f"Coalesced plan generation onto in-flight request {key[:12]}")
+        result = await asyncio.shield(task)
+        return copy.deepcopy(result)
+
+    async def _call_and_parse(
+        self,
+        prompt: str,
+        schema: Optional[Dict[str, Any]],
+        required_key: str,
+        model: str,
+        context: Optional[List[int]] = None
+    ) -> Dict[str, Any]:
+        self._stats["model_calls"] += 1
+        response = await self._call_ollama(prompt, schema, model, context)
+        return self._parse_plan_response(response, required_key)
+
+    def _forget_inflight(self, key: str, task: "asyncio.Task"):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            task.exception()  # mark retrieved even if every waiter went away
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self._stats,
+            "inflight": len(self._inflight),
+            "prefix_mode": self.prefix_mode,
+            "prompt_eval": {
+                kind: {
+                    "calls": int(totals["calls"]),
+                    "avg_tokens": round(totals["tokens"] / totals["calls"], 1),
+                    "avg_ms": round(totals["seconds"] * 1000 / totals["calls"], 1),
+                }
+                for kind, totals in self._prompt_eval.items()
+            },
+        }
+
+    def _record_prompt_eval(self, data: Dict[str, Any], reused_context: bool):
+        """Accumulate Ollama's prompt_eval_count/duration, split by whether the prefix context was reused"""
+        if "prompt_eval_count" not in data:
+            return
+        totals = self._prompt_eval.setdefault(
+            "context" if reused_context else "full", {"calls": 0, "tokens": 0, "seconds": 0.0}
+        )
+        totals["calls"] += 1
+        totals["tokens"] += data.get("prompt_eval_count") or 0
+        totals["seconds"] += (data.get("prompt_eval_duration") or 0) / 1e9
+
+    def _cache_key(self, user: User, request: PlanGenerationRequest, model: str) -> Optional[str]:
+        """Cache key to look up, or None when the cache is disabled or bypassed"""
+        if not self.cache:
+            return None
+        if request.bypass_cache:
+            self.cache.record_bypass()
+            return None
+        return plan_fingerprint(user, request, model)
+
+    async def stream_plan(
+        self,
+        user: User,
+        request: PlanGenerationRequest,
+        lane: str = "interactive"
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """Stream a plan as events: one ``meta`` event, then a ``day`` event per completed day.
+
+        The ``meta`` event's ``generator`` says what actually produced the plan
+        (``llm`` or ``rules``), which can differ from ``request.generator``.
+
+        Streams from the routed model only: days already sent cannot be taken
+        back, so there is no escalation on this path. If Ollama rejects the work
+        before anything was sent, the rule-based plan is streamed instead when
+        the fallback is enabled.
+        """
+        if request.generator == "rules":
+            for item in self._plan_events(await generate_rule_based_plan(user, request)):
+                yield item
+            return
+
+        sent = False
+        try:
+            async for item in self._stream_model_plan(user, request, lane):
+                sent = True
+                yield item
+        except ModelOverloadedError as e:
+            if sent or not self.rules_fallback:
+                raise
+            logger.warning(f"Plan generation rejected ({e}), streaming a rule-based plan")
+            self._stats["rules_fallbacks"] += 1
+            for item in self._plan_events(await generate_rule_based_plan(user, request)):
+                yield item
+
+    async def _stream_model_plan(
+        self,
+        user: User,
+        request: PlanGenerationRequest,
+        lane: str
+    ) -> AsyncIterator[Dict[str, Any]]:
+        model = self.router.route(user, request)[0]
+        cache_key = self._cache_key(user, request, model)
+        if cache_key:
+            cached = await self.cache.get(cache_key)
+            if cached is not None:
+                for item in self._plan_events(cached):
+                    yield item
+                return
+
+        parser = PlanStreamParser()
+        plan_data: Dict[str, Any] = {"days": []}
+
+        started = time.perf_counter()
+        async with self.scheduler.slot(user.id, lane, cost=request.days):
+            prompt, context = await self._plan_prompt(user, request, model)
+            async for chunk in self._stream_ollama(prompt, PLAN_JSON_SCHEMA, model, context):
+                for item in parser.feed(chunk):
+                    if item["type"] == "meta":
+                        plan_data.update({k: v for k, v in item.items() if k != "type"})
+                        yield {**item, "generator": "llm"}
+                    elif self._accept_streamed_day(plan_data, item["day"], request):
+                        yield item
+
+            if parser.days_seen == 0:
+                # Fall back to parsing the whole document, e.g. when the model
+                # nested or wrapped the days array in an unexpected way.
+                parsed = self._parse_plan_response(parser.buffer)
+                plan_data.update({k: parsed.get(k) for k in ("plan_title", "plan_description")})
+                for item in self._plan_events({**parsed, "days": []}):
+                    yield item
+                for day in parsed.get("days", []):
+                    if self._accept_streamed_day(plan_data, day, request):
+                        yield {"type": "day", "day": day}
+
+            missing = validate_plan(plan_data, request.days)["missing_days"]
+            if missing and self.repair:
+                for day in await self._regenerate_days(user, request, plan_data, missing, model):
+                    plan_data["days"].append(day)
+                    yield {"type": "day", "day": day}
+                plan_data["days"].sort(key=lambda day: day["day_number"])
+
+        self.router.record(model, self._plan_complete(plan_data, request), time.perf_counter() - started)
+        if self.cache and self._cacheable(plan_data, request):
+            await self.cache.set(plan_fingerprint(user, request, model), model, plan_data)
+
+    @staticmethod
+    def _accept_streamed_day(plan_data: Dict[str, Any], day: Dict[str, Any], request: PlanGenerationRequest) -> bool:
+        """Clamp a streamed day and keep it unless it is unusable or repeats a day number"""
+        day, _ = normalize_plan_day(day, request.days)
+        if day is None or any(seen["day_number"] == day["day_number"] for seen in plan_data["days"]):
+            return False
+        plan_data["days"].append(day)
+        return True
+
+    @staticmethod
+    def _plan_events(plan_data: Dict[str, Any]) -> List[Dict[str, Any]]:
+        events = [{
+            "type": "meta",
+            "plan_title": plan_data.get("plan_title"),
+            "plan_description": plan_data.get("plan_description"),
+            "generator": plan_data.get("generator", "llm"),
+        }]
+        events.extend({"type": "day", "day": day} for day in plan_data.get("days", []))
+        return events
+
+    def _profile_block(self, user: User, request: PlanGenerationRequest) -> str:
+        # The user's name is deliberately left out: it does not shape the plan,
+        # and cached plans are shared between users with matching profiles.
+        user_profile = {
+            "age": user.age,
+            "gender": user.gender,
+            "fitness_level": user.fitness_level or "beginner",
+            "goals": user.goals or "general fitness"
+        }
+        
+        focus_str = ", ".join(request.focus_areas) if request.focus_areas else "balanced fitness"
+        equipment_str = "with equipment" if request.include_equipment else "bodyweight/minimal equipment"
+        
+        return f"""User Profile: {json.dumps(user_profile)}
+Focus Areas: {focus_str}
+Equipment: {equipment_str}
+Preferences: {request.preferences or "None"}"""
+
+    # Identical for every plan request, so its evaluation can be reused across
+    # generations; everything user-specific goes in the suffix after it.
+    PLAN_PROMPT_PREFIX = """You are a certified personal trainer. You write workout plans as JSON.
+
+Return a JSON response with this exact structure:
+{
+  "plan_title": "descriptive title",
+  "plan_description": "brief description", 
+  "days": [
+    {
+      "day_number": 1,
+      "title": "Day 1 - Upper Body",
+      "rest_day": false,
+      "exercises": [
+        {
+          "name": "Push-ups",
+          "sets": 3,
+          "reps": 12,
+          "rest_seconds": 60,
+          "primary_muscle": "chest",
+          "equipment_needed": false,
+          "notes": "Keep core tight"
+        }
+      ]
+    }
+  ]
+}
+
+Sets must be 1-10, reps 1-100 and rest_seconds 30-300. Return ONLY valid JSON.
+"""
+
+    def _build_prompt(
+        self,
+        user: User,
+        request: PlanGenerationRequest,
+        reference: Optional[Dict[str, Any]] = None
+    ) -> str:
+        return self.PLAN_PROMPT_PREFIX + "\n" + self._build_prompt_suffix(user, request, reference)
+
+    def _build_prompt_suffix(
+        self,
+        user: User,
+        request: PlanGenerationRequest,
+        reference: Optional[Dict[str, Any]] = None
+    ) -> str:
+        reference_block = ""
+        if reference:
+            reference_block = (
+                f"\nA plan that worked for a similar profile (adapt it, do not copy it):\n"
+                f"{self._days_summary(reference.get('days', [])[:7])}\n"
+            )
+        return f"""Create a {request.days}-day workout plan.
+
+{self._profile_block(user, request)}
+{reference_block}
+Ensure exercises are appropriate for {user.fitness_level or 'beginner'} level. Return ONLY valid JSON."""
+
+    async def _plan_prompt(
+        self,
+        user: User,
+        request: PlanGenerationRequest,
+        model: str,
+        reference: Optional[Dict[str, Any]] = None
+    ) -> Tuple[str, Optional[List[int]]]:
+        """The plan prompt to send, with the prefix context when it can be reused"""
+        if self.prefix_mode == "context":
+            context = await self._prefix_context(model)
+            if context:
+                return self._build_prompt_suffix(user, request, reference), context
+        return self._build_prompt(user, request, reference), None
+
+    async def _prefix_context(self, model: str) -> Optional[List[int]]:
+        """Evaluate the fixed prefix once per model and keep the token context Ollama returns"""
+        if model in self._prefix_contexts:
+            return self._prefix_contexts[model]
+        async with self._prefix_lock:
+            if model not in self._prefix_contexts:
+                payload = {
+                    "model": model,
+                    "prompt": self.PLAN_PROMPT_PREFIX + "\nReply with OK.",
+                    "stream": False,
+                    "options": {"temperature": 0, "num_predict": 2},
+                    "keep_alive": self.keep_alive
+                }
+                try:
+                    async with self._guarded():
+                        data = await self._post_generate(payload)
+                except ModelOverloadedError:
+                    raise
+                except Exception as e:
+                    logger.warning(f"Evaluating the prompt prefix for {model} failed, sending full prompts: {e}")
+                    return None
+                self._record_prompt_eval(data, reused_context=False)
+                if not isinstance(data.get("context"), list):
+                    logger.warning(f"Ollama returned no context for {model}, sending full prompts")
+                    return None
+                self._prefix_contexts[model] = data["context"]
+                logger.info(f"Cached prompt prefix context for {model} ({len(data['context'])} tokens)")
+        return self._prefix_contexts[model]
+
+    def _build_outline_prompt(self, user: User, request: PlanGenerationRequest) -> str:
+        return f"""You are a certified personal trainer. Outline a {request.days}-day workout plan built from a repeating {self.chunk_days}-day split. Do not list exercises yet.
+
+{self._profile_block(user, request)}
+
+Return a JSON response with this exact structure, with exactly {self.chunk_days} entries in "weekly_split":
+{{
+  "plan_title": "descriptive title",
+  "plan_description": "brief description",
+  "weekly_split": [
+    {{"day_of_week": 1, "title": "Upper Body", "rest_day": false, "focus": "chest, back, shoulders"}}
+  ]
+}}
+
+Ensure the split suits a {user.fitness_level or 'beginner'} level and includes recovery. Return ONLY valid JSON."""
+
+    @staticmethod
+    def _days_summary(days: List[Dict[str, Any]]) -> str:
+        """One line per day with its title and exercise names, to keep prompts that quote plans small"""
+        return "\n".join(
+            f"- Day {day['day_number']}: {day.get('title') or 'Workout'}"
+            + (" (rest)" if day.get("rest_day") else f" - {', '.join(e['name'] for e in day.get('exercises', []))}")
+            for day in days
+        )
+
+    def _build_repair_prompt(
+        self,
+        user: User,
+        request: PlanGenerationRequest,
+        plan_data: Dict[str, Any],
+        missing: List[int]
+    ) -> str:
+        written = self._days_summary(plan_data.get("days", [])) or "- none yet"
+        numbers = ", ".join(str(n) for n in missing)
+        return f"""You are a certified personal trainer completing a {request.days}-day workout plan titled "{plan_data.get('plan_title') or 'Workout Plan'}".
+
+{self._profile_block(user, request)}
+Days already written:
+{written}
+
+Write only days {numbers}, consistent with the days above. Sets must be 1-10, reps 1-100 and rest_seconds 30-300.
+
+Return a JSON response with this exact structure, with one entry per requested day_number ({numbers}):
+{{
+  "days": [
+    {{
+      "day_number": {missing[0]},
+      "title": "Day {missing[0]} - Upper Body",
+      "rest_day": false,
+      "exercises": [
+        {{
+          "name": "Push-ups",
+          "sets": 3,
+          "reps": 12,
+          "rest_seconds": 60,
+          "primary_muscle": "chest",
+          "equipment_needed": false,
+          "notes": "Keep core tight"
+        }}
+      ]
+    }}
+  ]
+}}
+
+Return ONLY valid JSON."""
+
+    def _build_chunk_prompt(
+        self,
+        user: User,
+        request: PlanGenerationRequest,
+        outline: Dict[str, Any],
+        start: int,
+        end: int
+    ) -> str:
+        split = outline.get("weekly_split") or []
+        return f"""You are a certified personal trainer. Write days {start} to {end} of a {request.days}-day workout plan titled "{outline.get('plan_title', 'Workout Plan')}".
+
+{self._profile_block(user, request)}
+Weekly split (repeats every {len(split) or self.chunk_days} days, day 1 is entry 1): {json.dumps(split)}
+Progress volume or intensity slightly in later weeks.
+
+Return a JSON response with this exact structure, with day_number running from {start} to {end}:
+{{
+  "days": [
+    {{
+      "day_number": {start},
+      "title": "Day {start} - Upper Body",
+      "rest_day": false,
+      "exercises": [
+        {{
+          "name": "Push-ups",
+          "sets": 3,
+          "reps": 12,
+          "rest_seconds": 60,
+          "primary_muscle": "chest",
+          "equipment_needed": false,
+          "notes": "Keep core tight"
+        }}
+      ]
+    }}
+  ]
+}}
+
+Ensure exercises are appropriate for {user.fitness_level or 'beginner'} level. Return ONLY valid JSON."""
+
+    def _generate_payload(
+        self,
+        prompt: str,
+        stream: bool,
+        schema: Optional[Dict[str, Any]],
+        model: Optional[str] = None,
+        context: Optional[List[int]] = None,
+        options: Optional[Dict[str, Any]] = None
+    ) -> Dict[str, Any]:
+        payload = {
+            "model": model or self.model,
+            "prompt": prompt,
+            "stream": stream,
+            "options": {"temperature": 0.3, "top_k": 40, "top_p": 0.9, **(options or {})},
+            "keep_alive": self.keep_alive
+        }
+        if context:
+            payload["context"] = context
+        if schema and self.structured_output:
+            payload["format"] = schema
+        return payload
+
+    @asynccontextmanager
+    async def _guarded(self):
+        """Admit a call through the circuit breaker and the adaptive limiter"""
+        self.breaker.before_call()
+        succeeded: Optional[bool] = None
+        try:
+            async with self.limiter.slot():
+                yield
+            succeeded = True
+        except ModelOverloadedError:
+            raise
+        except Exception:
+            succeeded = False
+            raise
+        finally:
+            if succeeded is True:
+                self.breaker.record_success()
+            elif succeeded is False:
+                self.breaker.record_failure()
+            else:
+                self.breaker.release_trial()  # rejected or abandoned: says nothing about Ollama's health
+
+    def ensure_capacity(self, lane: str = "interactive"):
+        """Fail fast with 503 before starting work that would only be rejected later"""
+        if not self.scheduler.has_capacity(lane):
+            raise overloaded_http_error(ModelOverloadedError(f"Too many queued {lane} generations, try again later", 30))
+        if not self.breaker.allows_calls():
+            raise overloaded_http_error(ModelOverloadedError("Model backend is unavailable (circuit open)", int(self.breaker.reset_seconds)))
+        if not self.limiter.has_capacity():
+            raise overloaded_http_error(ModelOverloadedError("Model is at capacity, try again later", self.limiter.retry_after()))
+
+    def admit_plan_request(self, request: PlanGenerationRequest, lane: str = "interactive") -> PlanGenerationRequest:
+        """Check capacity before starting a plan that is written as it streams.
+
+        Under overload the request is switched to the rule-based generator when
+        the fallback is enabled; otherwise the 503 from ``ensure_capacity`` is raised.
+        """
+        if request.generator == "rules":
+            return request
+        try:
+            self.ensure_capacity(lane)
+        except HTTPException as e:
+            if not self.rules_fallback:
+                raise
+            logger.warning(f"Plan generation rejected ({e.detail}), falling back to the rule-based generator")
+            self._stats["rules_fallbacks"] += 1
+            return request.copy(update={"generator": "rules"})
+        return request
+
+    async def _call_ollama(
+        self,
+        prompt: str,
+        schema: Optional[Dict[str, Any]] = None,
+        model: Optional[str] = None,
+        context: Optional[List[int]] = None
+    ) -> str:
+        payload = self._generate_payload(prompt, False, schema, model, context)
+        
+        async with self._guarded():
+            data = await self._post_generate(payload)
+        self._record_prompt_eval(data, reused_context=bool(context))
+        return data.get("response", "")
+
+    async def _post_generate(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """Send to the least-loaded backend, hedging onto a second one if it is slow"""
+        primary = self.pool.pick()
+        delay = self.pool.hedge_delay()
+        if delay is None:
+            return await self._post_to(primary, payload)
+        
+        first = asyncio.ensure_future(self._post_to(primary, payload))
+        pending = {first}
+        try:
+            done, _ = await asyncio.wait(pending, timeout=delay)
+            if done:
+                return first.result()
+            
+            secondary = self.pool.pick(exclude=[primary])
+            if secondary is None:
+                return await first
+            hedge = asyncio.ensure_future(self._post_to(secondary, payload))
+            pending.add(hedge)
+            self.pool.record_hedge()
+            
+            error: Optional[BaseException] = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            self.pool.record_hedge(won=True)
+                        return task.result()
+                    error = error or task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _post_to(self, backend: OllamaBackend, payload: Dict[str, Any]) -> Dict[str, Any]:
+        backend.in_flight += 1
+        backend.requests += 1
+        started = time.perf_counter()
+        try:
+            response = await self.client.post(f"{backend.url}/api/generate", json=payload)
+            response.raise_for_status()
+            data = response.json()
+        except Exception:
+            self.pool.record_failure(backend)
+            raise
+        finally:
+            backend.in_flight -= 1
+        self.pool.record_success(backend, time.perf_counter() - started)
+        return data
+
+    async def _stream_ollama(
+        self,
+        prompt: str,
+        schema: Optional[Dict[str, Any]] = None,
+        model: Optional[str] = None,
+        context: Optional[List[int]] = None,
+        options: Optional[Dict[str, Any]] = None
+    ) -> AsyncIterator[str]:
+        payload = self._generate_payload(prompt, True, schema, model, context, options)
+        backend = self.pool.pick()
+
+        async with self._guarded():
+            backend.in_flight += 1
+            backend.requests += 1
+            started = time.perf_counter()
+            try:
+                async with self.client.stream("POST", f"{backend.url}/api/generate", json=payload) as response:
+                    response.raise_for_status()
+                    async for line in response.aiter_lines():
+                        if not line:
+                            continue
+                        data = json.loads(line)
+                        if data.get("error"):
+                            raise ValueError(f"Ollama error: {data['error']}")
+                        if data.get("response"):
+                            yield data["response"]
+                        if data.get("done"):
+                            self._record_prompt_eval(data, reused_context=bool(context))
+                            break
+            except Exception:
+                self.pool.record_failure(backend)
+                raise
+            finally:
+                backend.in_flight -= 1
+            self.pool.record_success(backend, time.perf_counter() - started)
+
+    async def stream_cue(self, prompt: str) -> AsyncIterator[str]:
+        """Stream a one-line coaching cue, capped at COACHING_CUE_MAX_TOKENS tokens"""
+        options = {"num_predict": COACHING_CUE_MAX_TOKENS, "temperature": 0.7, "stop": ["\n"]}
+        async for token in self._stream_ollama(prompt, model=COACHING_CUE_MODEL, options=options):
+            yield token
+
+    async def generate_cue_set(self, prompt: str) -> Dict[str, Any]:
+        """One JSON cue set (lists of cues per coaching phase) for the cue library"""
+        return await self._generate_json(prompt, CUE_SET_JSON_SCHEMA, required_key="set", model=COACHING_CUE_MODEL)
+
+    def _parse_plan_response(self, response: str, required_key: str = "days") -> Dict[str, Any]:
+        """Parse model output, repairing defects and salvaging complete days from truncated plans.
+
+        When any repair was needed the result carries a ``parse_report`` with the
+        day numbers that were recovered, instead of failing the whole generation.
+        """
+        error: Optional[json.JSONDecodeError] = None
+        try:
+            parsed, report = parse_model_json(response)
+        except json.JSONDecodeError as e:
+            parsed, report, error = None, {"repaired": True, "truncated": True}, e
+        
+        if required_key == "days" and (parsed is None or report["truncated"]):
+            # Only whole days are trusted from a cut-off document
+            salvaged = salvage_plan_days(response)
+            if salvaged:
+                parsed = {**(parsed or {}), **salvaged}
+        
+        if parsed is None:
+            logger.error(f"JSON parsing failed: {error}, Response: {response[:500]}")
+            raise ValueError(f"Invalid JSON response from model: {str(error)}")
+        
+        # Validate structure
+        if required_key not in parsed:
+            raise ValueError(f"Missing '{required_key}' in response")
+        
+        if report["repaired"]:
+            report["recovered_days"] = [
+                day.get("day_number") for day in parsed.get("days", []) if isinstance(day, dict)
+            ]
+            parsed["parse_report"] = report
+            logger.warning(f"Repaired model output: {report}")
+        
+        return parsed
+
+model_client = ModelClient(cache=PlanCache() if PLAN_CACHE_ENABLED else None)
+
+# ----------------------------
+# Database helpers
+# ----------------------------
+async def get_session() -> AsyncSession:
+    async with AsyncSessionLocal() as session:
+        yield session
+
+async def get_user_or_404(user_id: int, session: AsyncSession) -> User:
+    user = await session.get(User, user_id)
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    return user
+
+async def get_plan_or_404(plan_id: int, session: AsyncSession) -> Plan:
+    plan = await session.get(Plan, plan_id)
+    if not plan:
+        raise HTTPException(status_code=404, detail="Plan not found")
+    return plan
+
+# ----------------------------
+# Exercise name canonicalization
+# ----------------------------
+_NAME_QUALIFIER = re.compile(r"\([^)]*\)|\[[^\]]*\]")
+
+def _singular(token: str) -> str:
+    if not token.isascii():
+        return token
+    if len(token) > 4 and token.endswith(("ches", "shes", "sses", "xes")):
+        return token[:-2]
+    if len(token) > 2 and token.endswith("s") and not token.endswith(("ss", "us", "is")):
+        return token[:-1]
+    return token
+
+def exercise_name_tokens(name: str) -> List[str]:
+    """Words of an exercise name, NFKC-normalized and case-folded, without bracketed
+    qualifiers, punctuation or English plural endings"""
+    text = _NAME_QUALIFIER.sub(" ", unicodedata.normalize("NFKC", name).casefold())
+    return [_singular(token) for token in re.findall(r"[^\W_]+", text, re.UNICODE)]
+
+def canonical_exercise_name(name: str) -> str:
+    """Comparison key for an exercise name: its tokens joined without spacing
+    ("Push Ups (knees)" and "Pushups" -> "pushup"). Names without any word
+    characters keep their lower-cased text, so the key is only empty for a blank name."""
+    return "".join(exercise_name_tokens(name)) or name.strip().lower()
+
+# Smallest trigram similarity for two differing words to count as one word misspelt
+SPELLING_VARIANT_SIMILARITY = 0.5
+
+def _similarity(a: str, b: str) -> float:
+    grams_a, grams_b = _trigrams(a), _trigrams(b)
+    return len(grams_a & grams_b) / len(grams_a | grams_b)
+
+def same_exercise_words(tokens: List[str], other: List[str]) -> bool:
+    """Whether two names differ only by misspelt words.
+
+    An added word ("Bulgarian Split Squat Jump"), a different modifier
+    ("Incline" / "Decline") or a different number means a different exercise.
+    """
+    if len(tokens) != len(other):
+        return False
+    for token, other_token in zip(tokens, other):
+        if token == other_token:
+            continue
+        if token.isdigit() or other_token.isdigit() or _similarity(token, other_token) < SPELLING_VARIANT_SIMILARITY:
+            return False
+    return True
+
+def _trigrams(key: str) -> set:
+    padded = f"  {key} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+class TrigramIndex:
+    """Inverted trigram index over canonical names; similarity is trigram Jaccard, as in pg_trgm"""
+
+    def __init__(self):
+        self._postings: Dict[str, set] = {}
+        self._sizes: Dict[str, int] = {}
+
+    def add(self, key: str):
+        if not key or key in self._sizes:
+            return
+        grams = _trigrams(key)
+        self._sizes[key] = len(grams)
+        for gram in grams:
+            self._postings.setdefault(gram, set()).add(key)
+
+    def search(self, key: str, threshold: float) -> List[Tuple[str, float]]:
+        """Other keys at least ``threshold`` similar to ``key``, most similar first.
+
+        Keys with different numbers never match ("variation 1" is not "variation 2").
+        """
+        if not key:
+            return []
+        grams = _trigrams(key)
+        numbers = re.findall(r"\d+", key)
+        shared: Dict[str, int] = {}
+        for gram in grams:
+            for candidate in self._postings.get(gram, ()):
+                shared[candidate] = shared.get(candidate, 0) + 1
+        matches = []
+        for candidate, count in shared.items():
+            score = count / (len(grams) + self._sizes[candidate] - count)
+            if candidate != key and score >= threshold and re.findall(r"\d+", candidate) == numbers:
+                matches.append((candidate, round(score, 3)))
+        return sorted(matches, key=lambda match: -match[1])
+
+# ----------------------------
+# Plan persistence
+# ----------------------------
+class ExerciseTypeIndex:
+    """Process-wide exercise type name -> row index, loaded on startup.
+
+    Resolving a plan's exercises only touches the database for names the index
+    cannot place. A name is matched exactly, then by canonical name, then by
+    trigram similarity of canonical names among names with the same words up
+    to misspellings, so spelling variants reuse one type.
+    Rows inserted in a transaction are staged on the session and published when
+    it commits, so a rolled-back insert is never served.
+    """
+
+    def __init__(self, match_threshold: float = EXERCISE_NAME_MATCH_THRESHOLD):
+        self.match_threshold = match_threshold
+        self._by_name: Dict[str, ExerciseType] = {}
+        self._by_canonical: Dict[str, ExerciseType] = {}  # oldest type per canonical name
+        self._tokens: Dict[str, List[str]] = {}  # canonical name -> words of its type's name
+        self._trigrams = TrigramIndex()
+        self._loaded = False
+        self._lock = asyncio.Lock()
+        self._stats = {"hits": 0, "misses": 0, "canonical_matches": 0, "similar_matches": 0, "upserts": 0}
+
+    async def ensure_loaded(self):
+        if self._loaded:
+            return
+        async with self._lock:
+            if self._loaded:
+                return
+            async with AsyncSessionLocal() as session:
+                result = await session.execute(select(ExerciseType).order_by(ExerciseType.id))
+                for exercise_type in result.scalars().all():
+                    self.add(exercise_type)
+            self._loaded = True
+            logger.info(f"Loaded exercise type index: {len(self._by_name)} names, {len(self._by_canonical)} canonical")
+
+    def get(self, name: str) -> Optional[ExerciseType]:
+        exercise_type = self._by_name.get(name)
+        self._stats["hits" if exercise_type else "misses"] += 1
+        return exercise_type
+
+    def get_canonical(self, canonical: str) -> Optional[ExerciseType]:
+        return self._by_canonical.get(canonical) if canonical else None
+
+    def match(self, name: str) -> Optional[Tuple[ExerciseType, float]]:
+        """An existing type for an unknown name, by canonical name or trigram similarity.
+
+        The name is remembered as an alias, so it resolves directly next time.
+        """
+        canonical = canonical_exercise_name(name)
+        exercise_type, score = self.get_canonical(canonical), 1.0
+        if exercise_type:
+            self._stats["canonical_matches"] += 1
+        elif canonical and self.match_threshold > 0:
+            tokens = exercise_name_tokens(name)
+            for candidate, similarity in self._trigrams.search(canonical, self.match_threshold):
+                if same_exercise_words(tokens, self._tokens[candidate]):
+                    exercise_type, score = self._by_canonical[candidate], similarity
+                    self._stats["similar_matches"] += 1
+                    break
+        if exercise_type is None:
+            return None
+        self._by_name[name] = exercise_type
+        return exercise_type, score
+
+    def add(self, exercise_type: ExerciseType):
+        self._by_name[exercise_type.name] = exercise_type
+        canonical = exercise_type.canonical_name or canonical_exercise_name(exercise_type.name)
+        if not canonical:
+            return
+        current = self._by_canonical.get(canonical)
+        if current is None or current.id > exercise_type.id:
+            self._by_canonical[canonical] = exercise_type
+            self._tokens[canonical] = exercise_name_tokens(exercise_type.name)
+        self._trigrams.add(canonical)
+
+    def stage(self, session: AsyncSession, exercise_types: List[ExerciseType]):
+        """Publish rows to the index once the session's transaction commits"""
+        session.info.setdefault("exercise_types", []).extend(exercise_types)
+
+    def record_upsert(self):
+        self._stats["upserts"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {"names": len(self._by_name), "canonical_names": len(self._by_canonical), **self._stats}
+
+exercise_type_index = ExerciseTypeIndex()
+
+@event.listens_for(Session, "after_commit")
+def _publish_exercise_types(session):
+    for exercise_type in session.info.pop("exercise_types", []):
+        exercise_type_index.add(exercise_type)
+
+@event.listens_for(Session, "after_rollback")
+def _discard_exercise_types(session):
+    session.info.pop("exercise_types", None)
+
+def _upsert(model):
+    """INSERT with ON CONFLICT support for the configured database"""
+    return (postgresql if async_engine.dialect.name == "postgresql" else sqlite).insert(model)
+
+async def resolve_exercise_types(
+    session: AsyncSession,
+    exercises: List[Dict[str, Any]]
+) -> Dict[str, ExerciseType]:
+    """Map each generated exercise name to its exercise type, creating the missing ones.
+
+    Known names and their spelling variants come from the in-memory index. The
+    rest are resolved with one ``INSERT ... ON CONFLICT (name) DO UPDATE ...
+    RETURNING`` that creates new types and returns existing ones, so concurrent
+    generations cannot insert the same name twice. The caller commits.
+    """
+    await exercise_type_index.ensure_loaded()
+    names = {exercise.get("name", "Unknown Exercise"): exercise for exercise in exercises}
+    types: Dict[str, ExerciseType] = {}
+    missing: Dict[str, Tuple[str, Dict[str, Any]]] = {}  # canonical (or blank name) -> first new name and its data
+    variants: Dict[str, str] = {}  # further new names -> their key in ``missing``
+    for name, exercise_data in names.items():
+        exercise_type = exercise_type_index.get(name)
+        if exercise_type is None:
+            match = exercise_type_index.match(name)
+            if match:
+                exercise_type = match[0]
+                if match[0].name != name:
+                    logger.info(f"Mapped exercise '{name}' to '{match[0].name}' (similarity {match[1]:.2f})")
+        if exercise_type:
+            types[name] = exercise_type
+            continue
+        key = canonical_exercise_name(name) or name
+        if key in missing:
+            variants[name] = key
+        else:
+            missing[key] = (name, exercise_data)
+    if not missing:
+        return types
+    
+    statement = _upsert(ExerciseType).values([
+        {
+            "name": name,
+            "canonical_name": canonical_exercise_name(name),
+            "primary_muscle": exercise_data.get("primary_muscle"),
+            "equipment_needed": exercise_data.get("equipment_needed", False),
+            "default_sets": exercise_data.get("sets", 3),
+            "default_reps": exercise_data.get("reps", 10)
+        }
+        for name, exercise_data in missing.values()
+    ])
+    # A no-op update rather than DO NOTHING, so RETURNING also reports rows that already existed
+    statement = statement.on_conflict_do_update(
+        index_elements=[ExerciseType.name], set_={"name": statement.excluded.name}
+    ).returning(*ExerciseType.__table__.columns)
+    result = await session.execute(statement)
+    resolved = [ExerciseType(**row) for row in result.mappings().all()]
+    types.update((exercise_type.name, exercise_type) for exercise_type in resolved)
+    for name, key in variants.items():
+        types[name] = types[missing[key][0]]
+    exercise_type_index.stage(session, resolved)
+    exercise_type_index.record_upsert()
+    exercise_substitutions.invalidate()
+    return types
+
+async def create_exercise_type_record(session: AsyncSession, exercise_data: "ExerciseTypeCreate") -> ExerciseType:
+    """Insert a new exercise type, raising 409 when the name or its canonical form is taken"""
+    await exercise_type_index.ensure_loaded()
+    canonical = canonical_exercise_name(exercise_data.name)
+    existing = exercise_type_index.get_canonical(canonical)
+    if existing:
+        raise HTTPException(status_code=409, detail=f"Exercise type '{exercise_data.name}' already exists as '{existing.name}'")
+    exercise = ExerciseType(**exercise_data.dict(), canonical_name=canonical)
+    session.add(exercise)
+    try:
+        await session.commit()
+    except IntegrityError:
+        await session.rollback()
+        raise HTTPException(status_code=409, detail=f"Exercise type '{exercise_data.name}' already exists")
+    await session.refresh(exercise)
+    exercise_type_index.add(exercise)
+    exercise_substitutions.invalidate()
+    return exercise
+
+def _plan_day_row(plan_id: int, day_data: Dict[str, Any]) -> PlanDay:
+    return PlanDay(
+        plan_id=plan_id,
+        day_number=day_data.get("day_number", 1),
+        title=day_data.get("title", f"Day {day_data.get('day_number', 1)}"),
+        rest_day=day_data.get("rest_day", False)
+    )
+
+def _exercise_instance_rows(
+    plan_day_id: int,
+    day_data: Dict[str, Any],
+    types: Dict[str, ExerciseType]
+) -> List[Dict[str, Any]]:
+    rows = []
+    for i, exercise_data in enumerate(day_data.get("exercises", [])):
+        exercise_type = types[exercise_data.get("name", "Unknown Exercise")]
+        rows.append({
+            "plan_day_id": plan_day_id,
+            "exercise_type_id": exercise_type.id,
+            "order_index": i,
+            "target_sets": exercise_data.get("sets", exercise_type.default_sets),
+            "target_reps": exercise_data.get("reps", exercise_type.default_reps),
+            "current_sets": exercise_data.get("sets", exercise_type.default_sets),
+            "current_reps": exercise_data.get("reps", exercise_type.default_reps),
+            "rest_seconds": exercise_data.get("rest_seconds", 60),
+            "notes": exercise_data.get("notes")
+        })
+    return rows
+
+async def persist_plan_days(
+    session: AsyncSession,
+    plan_id: int,
+    days: List[Dict[str, Any]]
+) -> List[PlanDay]:
+    """Bulk-insert generated days and their exercises into a plan. The caller commits.
+
+    Days go in as one INSERT ... RETURNING executemany, with the ids returned
+    in the order of the days (on SQLite, SQLAlchemy sends those rows one at a
+    time to guarantee it), and all exercise instances as one executemany,
+    instead of an ORM flush per row. The returned days are not attached to
+    the session.
+    """
+    if not days:
+        return []
+    types = await resolve_exercise_types(
+        session, [exercise for day_data in days for exercise in day_data.get("exercises", [])]
+    )
+    plan_days = [_plan_day_row(plan_id, day_data) for day_data in days]
+    result = await session.execute(
+        insert(PlanDay).returning(PlanDay.id, sort_by_parameter_order=True),
+        [plan_day.dict(exclude={"id"}) for plan_day in plan_days]
+    )
+    for plan_day, plan_day_id in zip(plan_days, result.scalars().all()):
+        plan_day.id = plan_day_id
+    instances = [
+        row
+        for plan_day, day_data in zip(plan_days, days)
+        for row in _exercise_instance_rows(plan_day.id, day_data, types)
+    ]
+    if instances:
+        await session.execute(insert(ExerciseInstance), instances)
+    return plan_days
+
+async def persist_plan_day(session: AsyncSession, plan_id: int, day_data: Dict[str, Any]) -> PlanDay:
+    """Add one generated day and its exercises to a plan. The caller commits."""
+    return (await persist_plan_days(session, plan_id, [day_data]))[0]
+
+async def create_plan_record(
+    session: AsyncSession,
+    user: User,
+    request: PlanGenerationRequest,
+    plan_data: Dict[str, Any],
+    is_active: bool = True,
+    source_plan_id: Optional[int] = None,
+    generation_status: str = "complete"
+) -> Plan:
+    """Create the Plan row for generated plan data (days are added separately). The caller commits."""
+    plan = Plan(
+        user_id=user.id,
+        title=plan_data.get("plan_title") or f"AI Plan for {user.name}",
+        description=plan_data.get("plan_description") or "AI-generated workout plan",
+        total_days=request.days,
+        is_active=is_active,
+        source_plan_id=source_plan_id,
+        generation_status=generation_status
+    )
+    session.add(plan)
+    await session.flush()
+    return plan
+
+async def persist_generated_plan(
+    session: AsyncSession,
+    user: User,
+    request: PlanGenerationRequest,
+    plan_data: Dict[str, Any],
+    **plan_fields: Any
+) -> Plan:
+    """Add a fully generated plan with all of its days and exercises. The caller commits.
+
+    Everything is written in the caller's transaction, so a plan costs a single
+    commit however many days and new exercise types it has.
+    """
+    plan = await create_plan_record(session, user, request, plan_data, **plan_fields)
+    await persist_plan_days(session, plan.id, plan_data.get("days", []))
+    return plan
+
+async def load_plan_data(session: AsyncSession, plan_id: int) -> Optional[Dict[str, Any]]:
+    """Read a stored plan back into the generated-plan JSON shape"""
+    plan = await session.get(Plan, plan_id)
+    if not plan:
+        return None
+    query = (
+        select(PlanDay, ExerciseInstance, ExerciseType)
+        .outerjoin(ExerciseInstance, ExerciseInstance.plan_day_id == PlanDay.id)
+        .outerjoin(ExerciseType, ExerciseInstance.exercise_type_id == ExerciseType.id)
+        .where(PlanDay.plan_id == plan_id)
+        .order_by(PlanDay.day_number, ExerciseInstance.order_index)
+    )
+    days: Dict[int, Dict[str, Any]] = {}
+    for plan_day, instance, exercise_type in (await session.execute(query)).all():
+        day = days.setdefault(plan_day.id, {
+            "day_number": plan_day.day_number,
+            "title": plan_day.title,
+            "rest_day": plan_day.rest_day,
+            "exercises": []
+        })
+        if instance is not None and exercise_type is not None:
+            day["exercises"].append({
+                "name": exercise_type.name,
+                "sets": instance.target_sets,
+                "reps": instance.target_reps,
+                "rest_seconds": instance.rest_seconds,
+                "primary_muscle": exercise_type.primary_muscle,
+                "equipment_needed": exercise_type.equipment_needed,
+                "notes": instance.notes
+            })
+    return {
+        "plan_title": plan.title,
+        "plan_description": plan.description,
+        "generation_status": plan.generation_status,
+        "days": list(days.values())
+    }
+
+async def find_similar_plan(user: User, request: PlanGenerationRequest) -> Tuple[Optional[Dict[str, Any]], float]:
+    """Best earlier plan for a similar profile and its similarity, when above the reference threshold"""
+    if plan_index is None or request.generator != "llm" or request.bypass_cache:
+        return None, 0.0
+    await plan_index.ensure_loaded()
+    match = plan_index.search(user, request)
+    if match is None or match[1] < PLAN_REFERENCE_THRESHOLD:
+        return None, 0.0
+    async with AsyncSessionLocal() as session:
+        plan_data = await load_plan_data(session, match[0])
+    if not plan_data or plan_data["generation_status"] not in (None, "complete") or len(plan_data["days"]) < request.days:
+        return None, 0.0
+    return {**plan_data, "plan_id": match[0]}, match[1]
+
+async def create_generated_plan(
+    user: User,
+    request: PlanGenerationRequest,
+    lane: str = "interactive"
+) -> Dict[str, Any]:
+    """Generate a plan and persist it, opening a DB session only for the persistence step.
+
+    A sufficiently similar earlier plan is cloned instead of calling the model,
+    or, when only fairly similar, passed to the model as a reference.
+    """
+    similar, similarity = await find_similar_plan(user, request)
+    if similar and similarity >= PLAN_CLONE_THRESHOLD:
+        plan_data = {**similar, "generator": "clone"}
+        plan_index.record_use("clones")
+        logger.info(f"Cloning plan {similar['plan_id']} for user {user.id} (similarity {similarity:.3f})")
+    else:
+        if similar:
+            plan_index.record_use("references")
+        plan_data = await model_client.generate_plan(user, request, lane=lane, reference=similar)
+    
+    async with AsyncSessionLocal() as session:
+        try:
+            plan = await persist_generated_plan(session, user, request, plan_data)
+            if (
+                plan_index is not None
+                and plan_data.get("generator", "llm") == "llm"
+                and plan_is_complete(plan_data, request.days)
+            ):
+                await plan_index.add(session, plan.id, user, request)
+            await session.commit()
+        except Exception:
+            await session.rollback()
+            raise
+    
+    return {
+        "plan_id": plan.id,
+        "title": plan.title,
+        "description": plan.description,
+        "total_days": plan.total_days,
+        "status": "generated",
+        "generator": plan_data.get("generator", "llm"),
+        **({"similar_plan_id": similar["plan_id"], "similarity": round(similarity, 3)} if similar else {}),
+        **({"parse_report": plan_data["parse_report"]} if "parse_report" in plan_data else {})
+    }
+
+async def write_streamed_plan(
+    user: User,
+    request: PlanGenerationRequest,
+    plan_id: Optional[int] = None
+) -> AsyncIterator[Dict[str, Any]]:
+    """Stream a plan from the model and persist each day as soon as it is complete.
+
+    Yields ``plan``, ``day`` and ``complete`` events. The plan stays marked
+    ``incomplete`` until every requested day is written (so also when the model
+    stops short), and ``failed`` if generation errors; days already written are
+    kept either way. Pass ``plan_id`` to fill
+    a placeholder plan created beforehand.
+    """
+    plan: Optional[Plan] = None
+    days_generated = 0
+    day_numbers: set = set()
+    generator = request.generator
+    
+    async with AsyncSessionLocal() as session:
+        try:
+            if plan_id is not None:
+                plan = await session.get(Plan, plan_id)
+                existing = await session.execute(select(PlanDay.day_number).where(PlanDay.plan_id == plan_id))
+                day_numbers.update(existing.scalars().all())
+            async for item in model_client.stream_plan(user, request):
+                if item["type"] == "meta":
+                    generator = item.get("generator", generator)
+                    if plan is None:
+                        plan = await create_plan_record(session, user, request, item, generation_status="incomplete")
+                        await session.commit()
+                    elif item.get("plan_title") or item.get("plan_description"):
+                        plan.title = item.get("plan_title") or plan.title
+                        plan.description = item.get("plan_description") or plan.description
+                        await session.commit()
+                    yield {
+                        "event": "plan",
+                        "plan_id": plan.id,
+                        "title": plan.title,
+                        "description": plan.description,
+                        "total_days": plan.total_days,
+                        "generator": generator
+                    }
+                    continue
+                
+                if plan is None:
+                    plan = await create_plan_record(session, user, request, {}, generation_status="incomplete")
+                day_data = item["day"]
+                plan_day = await persist_plan_day(session, plan.id, day_data)
+                await session.commit()
+                days_generated += 1
+                day_numbers.add(plan_day.day_number)
+                yield {
+                    "event": "day",
+                    "plan_id": plan.id,
+                    "plan_day_id": plan_day.id,
+                    "day_number": plan_day.day_number,
+                    "day": day_data
+                }
+            
+            complete = len(day_numbers) >= request.days
+            if plan is not None and complete:
+                plan.generation_status = "complete"
+                if plan_index is not None and generator == "llm":
+                    await plan_index.add(session, plan.id, user, request)
+                await session.commit()
+            yield {
+                "event": "complete",
+                "plan_id": plan.id if plan else None,
+                "days_generated": days_generated,
+                "status": "generated" if complete else "incomplete",
+                "generator": generator
+            }
+        except Exception:
+            # A client going away (cancellation) leaves the plan "incomplete" instead
+            await session.rollback()
+            if plan is not None:
+                plan.generation_status = "failed"
+                await session.commit()
+            raise
+
+_background_generations: Dict[int, "asyncio.Task"] = {}  # plan id -> task still finishing it after its deadline
+
+async def create_plan_within_deadline(user: User, request: PlanGenerationRequest) -> Dict[str, Any]:
+    """Generate by streaming, but respond once ``request.deadline_seconds`` has passed.
+
+    A placeholder plan is created up front so a valid (possibly empty) plan
+    exists whenever the deadline hits. Days stream into it as they complete,
+    and generation carries on in the background until the plan is complete.
+    """
+    request = model_client.admit_plan_request(request)
+    async with AsyncSessionLocal() as session:
+        placeholder = await create_plan_record(session, user, request, {}, generation_status="incomplete")
+        await session.commit()
+    progress = {"days": 0, "generator": request.generator}
+    
+    async def fill_plan():
+        async for item in write_streamed_plan(user, request, plan_id=placeholder.id):
+            progress["days"] += item["event"] == "day"
+            progress["generator"] = item.get("generator", progress["generator"])
+    
+    task = asyncio.create_task(fill_plan())
+    _background_generations[placeholder.id] = task
+    task.add_done_callback(lambda done: _finish_background_generation(placeholder.id, done))
+    try:
+        await asyncio.wait_for(asyncio.shield(task), timeout=request.deadline_seconds)
+    except asyncio.TimeoutError:
+        logger.info(
+            f"Deadline of {request.deadline_seconds}s reached for plan {placeholder.id}: "
+            f"{progress['days']}/{request.days} days written, finishing in the background"
+        )
+    except Exception:
+        if progress["days"] == 0:
+            async with AsyncSessionLocal() as session:
+                await session.execute(delete(Plan).where(Plan.id == placeholder.id))
+                await session.commit()
+        raise
+    
+    async with AsyncSessionLocal() as session:
+        plan = await session.get(Plan, placeholder.id)
+    return {
+        "plan_id": plan.id,
+        "title": plan.title,
+        "description": plan.description,
+        "total_days": plan.total_days,
+        "days_generated": progress["days"],
+        "status": "generated" if plan.generation_status == "complete" else "incomplete",
+        "generator": progress["generator"]
+    }
+
+def _finish_background_generation(plan_id: int, task: "asyncio.Task"):
+    _background_generations.pop(plan_id, None)
+    if not task.cancelled() and task.exception() is not None:
+        logger.error(f"Plan generation with a deadline failed for plan {plan_id}: {task.exception()}")
+
+async def cancel_background_generation(plan_id: int):
+    """Stop filling a plan in the background, e.g. before it is deleted"""
+    task = _background_generations.get(plan_id)
+    if task is not None:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+async def cancel_background_generations():
+    tasks = list(_background_generations.values())
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+# ----------------------------
+# Background plan-generation jobs
+# ----------------------------
+class PlanJobQueue:
+    """Bounded queue of plan-generation jobs drained by a fixed pool of workers"""
+
+    def __init__(
+        self,
+        workers: int = PLAN_JOB_WORKERS,
+        max_queue: int = PLAN_JOB_QUEUE_SIZE,
+        retention_seconds: int = PLAN_JOB_RETENTION_SECONDS
+    ):
+        self.workers = workers
+        self.retention_seconds = retention_seconds
+        self.jobs: Dict[str, PlanJob] = {}
+        self._queue: "asyncio.Queue" = asyncio.Queue(maxsize=max_queue)
+        self._tasks: List["asyncio.Task"] = []
+
+    async def start(self):
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+            logger.info(f"Plan job workers started ({self.workers})")
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def submit(self, user: User, request: PlanGenerationRequest, lane: str = "interactive") -> PlanJob:
+        self._prune()
+        job = PlanJob(id=uuid.uuid4().hex, user_id=user.id, lane=lane)
+        try:
+            self._queue.put_nowait((job, user, request))
+        except asyncio.QueueFull:
+            raise HTTPException(
+                status_code=503,
+                detail="Plan generation queue is full, try again later",
+                headers={"Retry-After": "30"}
+            )
+        self.jobs[job.id] = job
+        return job
+
+    def get(self, job_id: str) -> Optional[PlanJob]:
+        return self.jobs.get(job_id)
+
+    def stats(self) -> Dict[str, Any]:
+        counts: Dict[str, int] = {}
+        for job in self.jobs.values():
+            counts[job.status] = counts.get(job.status, 0) + 1
+        return {"workers": self.workers, "queued": self._queue.qsize(), "jobs": counts}
+
+    async def _worker(self, worker_id: int):
+        while True:
+            job, user, request = await self._queue.get()
+            job.status = "running"
+            job.started_at = datetime.utcnow()
+            try:
+                result = await create_generated_plan(user, request, lane=job.lane)
+                job.plan_id = result["plan_id"]
+                job.status = "succeeded"
+            except Exception as e:
+                job.status = "failed"
+                job.error = e.detail if isinstance(e, HTTPException) else str(e)
+                logger.error(f"Plan job {job.id} failed for user {job.user_id}: {job.error}")
+            finally:
+                job.finished_at = datetime.utcnow()
+                self._queue.task_done()
+
+    def _prune(self):
+        cutoff = datetime.utcnow() - timedelta(seconds=self.retention_seconds)
+        expired = [
+            job_id for job_id, job in self.jobs.items()
+            if job.finished_at is not None and job.finished_at < cutoff
+        ]
+        for job_id in expired:
+            del self.jobs[job_id]
+
+plan_jobs = PlanJobQueue()
+
+# ----------------------------
+# Speculative pre-generation of follow-up plans
+# ----------------------------
+class PlanPregenerator:
+    """Stages the next plan block for users close to finishing their active plan.
+
+    A periodic sweep finds active plans whose reported sessions have reached
+    within ``days_remaining`` of ``total_days`` and that have no follow-up yet.
+    While Ollama is idle, it generates a follow-up on the batch lane, tuned by
+    recent RPE and success, and stores it as an inactive Plan pointing back at
+    its source (``source_plan_id``) so it can be activated without waiting.
+    """
+
+    def __init__(
+        self,
+        interval: float = PREGEN_INTERVAL_SECONDS,
+        days_remaining: int = PREGEN_DAYS_REMAINING,
+        batch_size: int = PREGEN_BATCH_SIZE
+    ):
+        self.interval = interval
+        self.days_remaining = days_remaining
+        self.batch_size = batch_size
+        self._task: Optional[asyncio.Task] = None
+        self._stats = {"sweeps": 0, "candidates": 0, "staged": 0, "skipped_busy": 0, "failures": 0}
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def stats(self) -> Dict[str, Any]:
+        return dict(self._stats)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.sweep()
+            except Exception as e:
+                logger.error(f"Plan pre-generation sweep failed: {e}")
+
+    @staticmethod
+    def model_idle() -> bool:
+        return model_client.scheduler.is_idle() and model_client.limiter.in_flight == 0
+
+    async def sweep(self) -> int:
+        """Stage follow-ups for plans nearing their last day; returns how many were staged"""
+        self._stats["sweeps"] += 1
+        staged = 0
+        async with AsyncSessionLocal() as session:
+            candidates = await self._find_candidates(session)
+        self._stats["candidates"] += len(candidates)
+
+        for plan_id in candidates:
+            if not self.model_idle():
+                self._stats["skipped_busy"] += 1
+                break  # interactive work takes precedence; retry on the next sweep
+            try:
+                if await self.stage_follow_up(plan_id):
+                    staged += 1
+            except Exception as e:
+                self._stats["failures"] += 1
+                logger.error(f"Pre-generating follow-up for plan {plan_id} failed: {getattr(e, 'detail', e)}")
+        return staged
+
+    async def _find_candidates(self, session: AsyncSession) -> List[int]:
+        follow_up = aliased(Plan)
+        reached_day = func.max(PlanDay.day_number)
+        query = (
+            select(Plan.id)
+            .join(SessionReport, SessionReport.plan_id == Plan.id)
+            .join(ExerciseInstance, ExerciseInstance.id == SessionReport.exercise_instance_id)
+            .join(PlanDay, PlanDay.id == ExerciseInstance.plan_day_id)
+            .where(
+                Plan.is_active == True,
+                ~select(follow_up.id).where(follow_up.source_plan_id == Plan.id).exists()
+            )
+            .group_by(Plan.id, Plan.total_days)
+            .having(reached_day >= Plan.total_days - self.days_remaining)
+            .order_by(func.max(SessionReport.date).desc())
+            .limit(self.batch_size)
+        )
+        result = await session.execute(query)
+        return [row[0] for row in result.all()]
+
+    async def stage_follow_up(self, plan_id: int) -> Optional[Plan]:
+        async with AsyncSessionLocal() as session:
+            plan = await session.get(Plan, plan_id)
+            user = await session.get(User, plan.user_id) if plan else None
+            if not plan or not user:
+                return None
+            request = await self._follow_up_request(session, plan)
+
+        plan_data = await model_client.generate_plan(user, request, lane="batch")
+
+        async with AsyncSessionLocal() as session:
+            try:
+                follow_up = await persist_generated_plan(
+                    session, user, request, plan_data, is_active=False, source_plan_id=plan_id
+                )
+                await session.commit()
+            except Exception:
+                await session.rollback()
+                raise
+        self._stats["staged"] += 1
+        logger.info(f"Staged follow-up plan {follow_up.id} for plan {plan_id} (user {user.id})")
+        return follow_up
+
+    async def _follow_up_request(self, session: AsyncSession, plan: Plan) -> PlanGenerationRequest:
+        """Build the next block's request from the plan's shape and recent performance"""
+        reports_query = (
+            select(SessionReport)
+            .where(SessionReport.plan_id == plan.id)
+            .order_by(SessionReport.date.desc())
+            .limit(50)
+        )
+        reports = (await session.execute(reports_query)).scalars().all()
+        equipment_query = (
+            select(ExerciseType.id)
+            .join(ExerciseInstance, ExerciseInstance.exercise_type_id == ExerciseType.id)
+            .join(PlanDay, PlanDay.id == ExerciseInstance.plan_day_id)
+            .where(PlanDay.plan_id == plan.id, ExerciseType.equipment_needed == True)
+            .limit(1)
+        )
+        uses_equipment = (await session.execute(equipment_query)).first() is not None
+
+        preferences = f"Follow-up block to '{plan.title}'."
+        if reports:
+            avg_rpe = sum(r.rpe for r in reports) / len(reports)
+            success_rate = sum(1 for r in reports if r.success) / len(reports)
+            # Same thresholds as adjust_exercise_by_history
+            if avg_rpe >= 8.5 or success_rate <= 0.4:
+                guidance = "Keep volume the same or slightly lower and prioritise recovery."
+            elif avg_rpe <= 4.0 and success_rate >= 0.9:
+                guidance = "Progress volume and intensity noticeably."
+            else:
+                guidance = "Progress volume moderately."
+            preferences += (
+                f" Recent sessions: average RPE {avg_rpe:.1f}/10, "
+                f"{success_rate:.0%} completed successfully. {guidance}"
+            )
+
+        return PlanGenerationRequest(
+            days=min(21, max(3, plan.total_days)),
+            preferences=preferences[:500],
+            include_equipment=uses_equipment
+        )
+
+plan_pregenerator = PlanPregenerator()
+
+# ----------------------------
+# Exercise substitution
+# ----------------------------
+# Groups to draw from when a muscle group has to be avoided, closest first
+ALTERNATE_MUSCLE_GROUPS = {
+    "chest": ["back", "shoulders", "triceps"],
+    "back": ["chest", "biceps", "core"],
+    "shoulders": ["back", "chest", "core"],
+    "biceps": ["back", "triceps"],
+    "triceps": ["chest", "biceps"],
+    "legs": ["glutes", "hamstrings", "core"],
+    "glutes": ["hamstrings", "legs", "core"],
+    "hamstrings": ["glutes", "legs", "core"],
+    "core": ["mobility", "cardio"],
+    "cardio": ["core", "legs"],
+    "mobility": ["core"],
+}
+
+class ExerciseSubstitutionIndex:
+    """In-memory index of exercise types by (muscle group, equipment_needed).
+
+    Built from the ExerciseType table on first use and rebuilt lazily after
+    ``invalidate()``, which is called whenever a new exercise type is added.
+    """
+
+    def __init__(self):
+        self._by_key: Dict[Tuple[str, bool], List[int]] = {}
+        self._types: Dict[int, ExerciseType] = {}
+        self._stale = True
+
+    def invalidate(self):
+        self._stale = True
+
+    async def ensure_loaded(self, session: AsyncSession):
+        if not self._stale:
+            return
+        result = await session.execute(select(ExerciseType).order_by(ExerciseType.name, ExerciseType.id))
+        by_key: Dict[Tuple[str, bool], List[int]] = {}
+        types: Dict[int, ExerciseType] = {}
+        seen_names = set()
+        for exercise_type in result.scalars().all():
+            types[exercise_type.id] = exercise_type
+            name = exercise_type.name.strip().lower()
+            if name in seen_names:
+                continue  # duplicate names are never offered twice
+            seen_names.add(name)
+            by_key.setdefault(self.key(exercise_type), []).append(exercise_type.id)
+        self._by_key, self._types, self._stale = by_key, types, False
+        logger.info(f"Built exercise substitution index: {len(types)} types in {len(by_key)} groups")
+
+    @staticmethod
+    def key(exercise_type: ExerciseType) -> Tuple[str, bool]:
+        group = _muscle_group(exercise_type.primary_muscle) or (exercise_type.primary_muscle or "other").strip().lower()
+        return group, bool(exercise_type.equipment_needed)
+
+    def get(self, exercise_type_id: int) -> Optional[ExerciseType]:
+        return self._types.get(exercise_type_id)
 
-# Initialize DB on startup
-async def startup_db():
-    await init_db()
+    def find(
+        self,
+        current: ExerciseType,
+        groups: List[str],
+        allow_equipment: bool,
+        exclude: set
+    ) -> Optional[ExerciseType]:
+        """First alternative to ``current`` in the given groups, in a stable order.
 
-# ----------------------------
-# Pydantic schemas with validators
-# ----------------------------
-class UserCreate(BaseModel):
-    name: constr(min_length=2, max_length=100)
-    email: Optional[constr(max_length=128)] = None
-    age: Optional[int] = Field(None, ge=10, le=120)
-    gender: Optional[str] = Field(None, max_length=20)
-    fitness_level: Optional[str] = None
-    goals: Optional[str] = Field(None, max_length=500)
+        Within a group, candidates are taken in name order starting after the
+        current exercise, so repeated substitutions cycle through the options.
+        """
+        equipment_options = [False, True] if allow_equipment else [False]
+        for group in groups:
+            candidates = sorted(
+                (type_id for equipment in equipment_options for type_id in self._by_key.get((group, equipment), [])),
+                key=lambda type_id: self._types[type_id].name.lower()
+            )
+            names = [self._types[type_id].name.lower() for type_id in candidates]
+            start = next((i for i, name in enumerate(names) if name > current.name.lower()), 0)
+            for type_id in candidates[start:] + candidates[:start]:
+                if type_id != current.id and type_id not in exclude:
+                    return self._types[type_id]
+        return None
 
-    @validator('email')
-    def validate_email(cls, v):
-        if v and '@' not in v:
-            raise ValueError('Invalid email format')
-        return v
+exercise_substitutions = ExerciseSubstitutionIndex()
 
-    @validator('fitness_level')
-    def validate_fitness_level(cls, v):
-        if v and v.lower() not in ['beginner', 'intermediate', 'advanced']:
-            raise ValueError('Fitness level must be beginner, intermediate, or advanced')
-        return v.lower() if v else v
+async def substitute_plan_exercises(
+    session: AsyncSession,
+    plan_id: int,
+    request: SubstitutionRequest
+) -> Dict[str, Any]:
+    """Swap exercise types on a plan's instances in place, keeping targets and order.
 
-    @validator('gender')
-    def validate_gender(cls, v):
-        if v and v.lower() not in ['male', 'female', 'other']:
-            raise ValueError('Gender must be male, female, or other')
-        return v.lower() if v else v
+    Progress recorded for the old exercise (current sets and reps, last RPE,
+    notes) does not apply to its replacement, so it is reset to the targets.
+    """
+    await exercise_substitutions.ensure_loaded(session)
+    query = (
+        select(ExerciseInstance, PlanDay.id)
+        .join(PlanDay, ExerciseInstance.plan_day_id == PlanDay.id)
+        .where(PlanDay.plan_id == plan_id)
+        .order_by(PlanDay.day_number, ExerciseInstance.order_index)
+    )
+    rows = (await session.execute(query)).all()
+    instances = {instance.id: instance for instance, _ in rows}
+    day_types: Dict[int, set] = {}
+    for instance, day_id in rows:
+        day_types.setdefault(day_id, set()).add(instance.exercise_type_id)
 
-class ExerciseTypeCreate(BaseModel):
-    name: constr(min_length=2, max_length=100)
-    primary_muscle: Optional[str] = Field(None, max_length=50)
-    equipment_needed: Optional[bool] = False
-    default_sets: int = Field(3, ge=1, le=10)
-    default_reps: int = Field(10, ge=1, le=100)
-    notes: Optional[str] = Field(None, max_length=500)
+    if request.exercise_instance_ids:
+        missing = [i for i in request.exercise_instance_ids if i not in instances]
+        if missing:
+            raise HTTPException(status_code=404, detail=f"Exercise instances {missing} not found in plan")
+        targets = [instances[i] for i in request.exercise_instance_ids]
+    elif request.bodyweight_only or request.avoid_muscles:
+        targets = list(instances.values())
+    else:
+        raise HTTPException(status_code=400, detail="Give exercise_instance_ids, bodyweight_only or avoid_muscles")
 
-class PlanGenerationRequest(BaseModel):
-    days: int = Field(7, ge=3, le=21, description="Number of days for the workout plan")
-    preferences: Optional[str] = Field(None, max_length=500, description="Additional preferences")
-    include_equipment: bool = Field(False, description="Whether to include equipment-based exercises")
-    focus_areas: Optional[List[str]] = Field(default=None, max_length=10)
+    avoid = set(request.avoid_muscles or [])
+    substituted, unchanged = [], []
+    for instance in targets:
+        current = exercise_substitutions.get(instance.exercise_type_id)
+        if current is None:
+            unchanged.append({"exercise_instance_id": instance.id, "reason": "unknown exercise type"})
+            continue
+        group, needs_equipment = exercise_substitutions.key(current)
+        avoided = group in avoid
+        if not request.exercise_instance_ids and not avoided and not (request.bodyweight_only and needs_equipment):
+            continue  # already satisfies the filters
 
-    @validator('focus_areas')
-    def validate_focus_areas(cls, v):
-        valid_areas = ['strength', 'cardio', 'flexibility', 'weight_loss', 'muscle_gain', 'endurance']
-        if v:
-            for area in v:
-                if area.lower() not in valid_areas:
-                    raise ValueError(f'Invalid focus area: {area}. Must be one of {valid_areas}')
-        return v
+        groups = [g for g in ALTERNATE_MUSCLE_GROUPS.get(group, ["core"]) if g not in avoid] if avoided else [group]
+        day_id = instance.plan_day_id
+        replacement = exercise_substitutions.find(
+            current, groups, allow_equipment=not request.bodyweight_only, exclude=day_types[day_id]
+        )
+        if replacement is None:
+            unchanged.append({"exercise_instance_id": instance.id, "reason": "no alternative in the catalog"})
+            continue
 
-class SessionReportCreate(BaseModel):
-    exercise_instance_id: int
-    rpe: float = Field(..., ge=1.0, le=10.0, description="Rate of Perceived Exertion (1-10)")
-    reps_completed: int = Field(..., ge=0, le=200)
-    sets_completed: int = Field(..., ge=0, le=15)
-    success: bool = True
-    duration_seconds: Optional[int] = Field(None, ge=0, le=7200)  # max 2 hours
+        day_types[day_id].discard(current.id)
+        day_types[day_id].add(replacement.id)
+        instance.exercise_type_id = replacement.id
+        instance.current_sets = instance.target_sets
+        instance.current_reps = instance.target_reps
+        instance.last_rpe = None
+        instance.notes = None
+        instance.last_updated = datetime.utcnow()
+        substituted.append({
+            "exercise_instance_id": instance.id,
+            "from": {"id": current.id, "name": current.name},
+            "to": {"id": replacement.id, "name": replacement.name},
+        })
 
-class PlanUpdate(BaseModel):
-    title: Optional[str] = Field(None, max_length=200)
-    description: Optional[str] = Field(None, max_length=1000)
-    is_active: Optional[bool] = None
+    await session.commit()
+    return {"plan_id": plan_id, "substituted": substituted, "unchanged": unchanged}
 
 # ----------------------------
-# Model client (Ollama wrapper) with better error handling
+# Live coaching cues
 # ----------------------------
-class ModelClient:
-    def __init__(self, base_url: str = OLLAMA_URL, model: str = OLLAMA_MODEL):
-        self.base_url = base_url.rstrip("/")
-        self.model = model
+FITNESS_LEVELS = ("beginner", "intermediate", "advanced")
 
-    async def generate_plan(self, user: User, request: PlanGenerationRequest) -> Dict[str, Any]:
-        prompt = self._build_prompt(user, request)
-        try:
-            response = await self._call_ollama(prompt)
-            return self._parse_plan_response(response)
-        except Exception as e:
-            logger.error(f"Plan generation failed: {e}")
-            raise HTTPException(status_code=500, detail=f"Plan generation failed: {str(e)}")
+COACHING_PHASES = {
+    "setup": "about to start a set",
+    "set": "in the middle of a set",
+    "rest": "resting between sets",
+}
 
-    def _build_prompt(self, user: User, request: PlanGenerationRequest) -> str:
-        user_profile = {
-            "name": user.name,
-            "age": user.age,
-            "gender": user.gender,
-            "fitness_level": user.fitness_level or "beginner",
-            "goals": user.goals or "general fitness"
+def _effort_band(last_rpe: Optional[float]) -> str:
+    if last_rpe is None:
+        return "none"
+    if last_rpe >= 8.5:
+        return "hard"
+    if last_rpe <= 6.0:
+        return "easy"
+    return "on_target"
+
+EFFORT_GUIDANCE = {
+    "none": "no previous session",
+    "hard": "it felt very hard, so stress form and pacing",
+    "easy": "it felt easy, so push for a strong effort",
+    "on_target": "effort was on target",
+}
+
+class CoachingCueCache:
+    """LRU of finished cues keyed by exercise instance, its targets, the phase and the effort band.
+
+    Keying on the targets and effort band means a cue is regenerated as soon as
+    the plan is adjusted or a new session is reported for the exercise.
+    """
+
+    def __init__(self, max_entries: int = COACHING_CUE_CACHE_SIZE, ttl_seconds: int = COACHING_CUE_CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._stats = {
+            "hits": 0, "misses": 0, "library_cues": 0, "model_cues": 0, "template_cues": 0, "first_token_seconds": 0.0
         }
-        
-        focus_str = ", ".join(request.focus_areas) if request.focus_areas else "balanced fitness"
-        equipment_str = "with equipment" if request.include_equipment else "bodyweight/minimal equipment"
-        
-        return f"""You are a certified personal trainer. Create a {request.days}-day workout plan.
 
-User Profile: {json.dumps(user_profile)}
-Focus Areas: {focus_str}
-Equipment: {equipment_str}
-Preferences: {request.preferences or "None"}
+    @staticmethod
+    def key(instance: ExerciseInstance, phase: str) -> str:
+        return (
+            f"{instance.id}:{instance.exercise_type_id}:{phase}:{instance.target_sets}x{instance.target_reps}:"
+            f"{instance.rest_seconds}:{_effort_band(instance.last_rpe)}"
+        )
 
-Return a JSON response with this exact structure:
-{{
-  "plan_title": "descriptive title",
-  "plan_description": "brief description", 
-  "days": [
-    {{
-      "day_number": 1,
-      "title": "Day 1 - Upper Body",
-      "rest_day": false,
-      "exercises": [
-        {{
-          "name": "Push-ups",
-          "sets": 3,
-          "reps": 12,
-          "rest_seconds": 60,
-          "primary_muscle": "chest",
-          "equipment_needed": false,
-          "notes": "Keep core tight"
-        }}
-      ]
-    }}
-  ]
-}}
+    def get(self, key: str) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry and time.time() - entry[0] < self.ttl_seconds:
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            return entry[1]
+        self._entries.pop(key, None)
+        self._stats["misses"] += 1
+        return None
 
-Ensure exercises are appropriate for {user.fitness_level or 'beginner'} level. Return ONLY valid JSON."""
+    def set(self, key: str, cue: str):
+        self._entries[key] = (time.time(), cue)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
 
-    async def _call_ollama(self, prompt: str) -> str:
-        url = f"{self.base_url}/api/generate"
-        payload = {
-            "model": self.model,
-            "prompt": prompt,
-            "stream": False,
-            "options": {"temperature": 0.3, "top_k": 40, "top_p": 0.9}
+    def record(self, source: str, first_token_seconds: Optional[float] = None):
+        self._stats[f"{source}_cues"] += 1
+        if first_token_seconds is not None:
+            self._stats["first_token_seconds"] += first_token_seconds
+
+    def stats(self) -> Dict[str, Any]:
+        model_cues = self._stats["model_cues"]
+        return {
+            "entries": len(self._entries),
+            "hits": self._stats["hits"],
+            "misses": self._stats["misses"],
+            "library_cues": self._stats["library_cues"],
+            "model_cues": model_cues,
+            "template_cues": self._stats["template_cues"],
+            "avg_first_token_ms": round(self._stats["first_token_seconds"] * 1000 / model_cues, 1) if model_cues else 0.0,
         }
-        
-        async with httpx.AsyncClient(timeout=120.0) as client:
-            response = await client.post(url, json=payload)
-            response.raise_for_status()
-            data = response.json()
-            return data.get("response", "")
 
-    def _parse_plan_response(self, response: str) -> Dict[str, Any]:
-        try:
-            # Clean response - sometimes models add extra text
-            response = response.strip()
-            if response.startswith("```json"):
-                response = response[7:]
-            if response.endswith("```"):
-                response = response[:-3]
-            
-            # Find JSON object
-            start = response.find("{")
-            end = response.rfind("}") + 1
-            if start != -1 and end > start:
-                response = response[start:end]
-            
-            parsed = json.loads(response)
-            
-            # Validate structure
-            if "days" not in parsed:
-                raise ValueError("Missing 'days' in response")
-            
-            return parsed
-        except json.JSONDecodeError as e:
-            logger.error(f"JSON parsing failed: {e}, Response: {response[:500]}")
-            raise ValueError(f"Invalid JSON response from model: {str(e)}")
+coaching_cues = CoachingCueCache()
+
+def build_cue_prompt(instance: ExerciseInstance, exercise_type: ExerciseType, phase: str) -> str:
+    # Kept short on purpose: prompt evaluation dominates time-to-first-token for a cue this small
+    rpe = f"RPE {instance.last_rpe:g}, " if instance.last_rpe is not None else ""
+    return (
+        "You are a strength coach speaking to an athlete during a workout. "
+        "Reply with one spoken cue of at most 15 words. No quotes, lists or emojis.\n"
+        f"Exercise: {exercise_type.name} ({exercise_type.primary_muscle or 'general'}), "
+        f"{instance.target_sets} sets x {instance.target_reps} reps, {instance.rest_seconds or 60}s rest.\n"
+        f"Moment: {COACHING_PHASES[phase]}.\n"
+        f"Last session: {rpe}{EFFORT_GUIDANCE[_effort_band(instance.last_rpe)]}.\n"
+        "Cue:"
+    )
+
+def template_cue(instance: ExerciseInstance, exercise_type: ExerciseType, phase: str) -> str:
+    """A cue built from the exercise targets alone, used when the model is unavailable"""
+    if phase == "rest":
+        return f"Rest {instance.rest_seconds or 60} seconds, breathe deep, then {instance.target_reps} more reps."
+    if phase == "setup":
+        return f"Set up for {exercise_type.name}: {instance.target_reps} controlled reps, brace first."
+    band = _effort_band(instance.last_rpe)
+    if band == "hard":
+        return "Smooth and steady, own every rep, form before speed."
+    if band == "easy":
+        return "You have more in the tank, drive every rep with intent."
+    return f"Stay tight and keep the tempo, {instance.target_reps} clean reps."
+
+def _cue_level(fitness_level: Optional[str]) -> str:
+    level = (fitness_level or "beginner").lower()
+    return level if level in FITNESS_LEVELS else "beginner"
+
+async def lookup_library_cue(
+    session: AsyncSession,
+    exercise_type_id: int,
+    fitness_level: Optional[str],
+    last_rpe: Optional[float],
+    phase: str
+) -> Optional[str]:
+    """A pre-generated cue from the CoachingCue library (one indexed lookup), if one exists"""
+    query = select(CoachingCue.cues_json).where(
+        CoachingCue.exercise_type_id == exercise_type_id,
+        CoachingCue.fitness_level == _cue_level(fitness_level),
+        CoachingCue.effort_band == _effort_band(last_rpe)
+    )
+    cues_json = (await session.execute(query)).scalar_one_or_none()
+    cues = json.loads(cues_json).get(phase) if cues_json else None
+    return random.choice(cues) if cues else None
+
+def _sse(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+async def stream_coaching_cue(
+    instance: ExerciseInstance,
+    exercise_type: ExerciseType,
+    phase: str,
+    library_cue: Optional[str] = None
+) -> AsyncIterator[str]:
+    """Server-sent events for one cue: ``token`` events as the model produces them, then ``done``.
+
+    Library and cached cues are sent as a single token. When Ollama is unavailable
+    before the first token, a template cue is sent instead so the client always gets a cue.
+    """
+    if library_cue:
+        coaching_cues.record("library")
+        yield _sse("token", {"text": library_cue})
+        yield _sse("done", {"cue": library_cue, "source": "library", "first_token_ms": 0.0})
+        return
+
+    key = coaching_cues.key(instance, phase)
+    cached = coaching_cues.get(key)
+    if cached:
+        yield _sse("token", {"text": cached})
+        yield _sse("done", {"cue": cached, "source": "cache", "first_token_ms": 0.0})
+        return
+
+    started = time.perf_counter()
+    first_token: Optional[float] = None
+    parts: List[str] = []
+    failed = False
+    try:
+        async for token in model_client.stream_cue(build_cue_prompt(instance, exercise_type, phase)):
+            if first_token is None:
+                first_token = time.perf_counter() - started
+            parts.append(token)
+            yield _sse("token", {"text": token})
+    except Exception as e:
+        failed = True
+        logger.warning(f"Coaching cue generation failed for exercise instance {instance.id}: {e}")
 
-model_client = ModelClient()
+    cue = " ".join("".join(parts).split()).strip("\"' ")
+    if cue:
+        if not failed:
+            coaching_cues.set(key, cue)
+        coaching_cues.record("model", first_token)
+        source = "model"
+    else:
+        cue = template_cue(instance, exercise_type, phase)
+        coaching_cues.record("template")
+        source = "template"
+        yield _sse("token", {"text": cue})
+    yield _sse("done", {
+        "cue": cue,
+        "source": source,
+        "first_token_ms": round((first_token if first_token is not None else time.perf_counter() - started) * 1000, 1)
+    })
 
 # ----------------------------
-# Database helpers
+# Coaching cue library (offline batch generation)
 # ----------------------------
-async def get_session() -> AsyncSession:
+CUE_SET_JSON_SCHEMA = {
+    "type": "object",
+    "properties": {
+        phase: {"type": "array", "items": {"type": "string"}} for phase in COACHING_PHASES
+    },
+    "required": list(COACHING_PHASES)
+}
+
+def build_cue_set_prompt(exercise_type: ExerciseType, fitness_level: str, effort_band: str) -> str:
+    moments = "\n".join(f'- "{phase}": the athlete is {moment}' for phase, moment in COACHING_PHASES.items())
+    return f"""You are a strength coach writing spoken coaching cues.
+Write {COACHING_CUE_LIBRARY_VARIANTS} different cues for each moment below, each at most 15 words, no quotes or emojis.
+
+Exercise: {exercise_type.name} ({exercise_type.primary_muscle or 'general'})
+Athlete level: {fitness_level}
+Last session: {EFFORT_GUIDANCE[effort_band]}
+
+Moments:
+{moments}
+
+Return ONLY valid JSON with one list of cues per moment, keyed "setup", "set" and "rest"."""
+
+def _clean_cue_set(cue_set: Dict[str, Any]) -> Dict[str, List[str]]:
+    cleaned = {}
+    for phase in COACHING_PHASES:
+        cues = [" ".join(str(cue).split()).strip("\"' ") for cue in cue_set.get(phase) or []]
+        cleaned[phase] = [cue for cue in cues if cue][:COACHING_CUE_LIBRARY_VARIANTS]
+    return cleaned
+
+async def missing_cue_sets(
+    exercise_type_ids: Optional[List[int]] = None,
+    refresh: bool = False
+) -> List[Tuple[ExerciseType, str, str]]:
+    """(exercise type, fitness level, effort band) combinations without a stored cue set.
+
+    With ``refresh`` every combination is returned so existing sets are regenerated.
+    """
     async with AsyncSessionLocal() as session:
-        yield session
+        query = select(ExerciseType).order_by(ExerciseType.id)
+        if exercise_type_ids:
+            query = query.where(ExerciseType.id.in_(exercise_type_ids))
+        exercise_types = (await session.execute(query)).scalars().all()
+        existing = set()
+        if not refresh:
+            rows = await session.execute(
+                select(CoachingCue.exercise_type_id, CoachingCue.fitness_level, CoachingCue.effort_band)
+            )
+            existing = set(rows.all())
+    return [
+        (exercise_type, level, band)
+        for exercise_type in exercise_types
+        for level in FITNESS_LEVELS
+        for band in EFFORT_GUIDANCE
+        if (exercise_type.id, level, band) not in existing
+    ]
 
-async def get_user_or_404(user_id: int, session: AsyncSession) -> User:
-    user = await session.get(User, user_id)
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-    return user
+async def store_cue_set(exercise_type_id: int, fitness_level: str, effort_band: str, cues: Dict[str, List[str]]):
+    """Insert or replace one cue set, committed on its own so an interrupted run can resume"""
+    async with AsyncSessionLocal() as session:
+        query = select(CoachingCue).where(
+            CoachingCue.exercise_type_id == exercise_type_id,
+            CoachingCue.fitness_level == fitness_level,
+            CoachingCue.effort_band == effort_band
+        )
+        row = (await session.execute(query)).scalar_one_or_none()
+        if row is None:
+            row = CoachingCue(exercise_type_id=exercise_type_id, fitness_level=fitness_level, effort_band=effort_band, cues_json="")
+            session.add(row)
+        row.cues_json = json.dumps(cues, separators=(",", ":"))
+        row.model = COACHING_CUE_MODEL
+        row.created_at = datetime.utcnow()
+        await session.commit()
 
-async def get_plan_or_404(plan_id: int, session: AsyncSession) -> Plan:
-    plan = await session.get(Plan, plan_id)
-    if not plan:
-        raise HTTPException(status_code=404, detail="Plan not found")
-    return plan
+async def generate_cue_library(
+    concurrency: int = 2,
+    exercise_type_ids: Optional[List[int]] = None,
+    refresh: bool = False,
+    limit: Optional[int] = None,
+    on_result: Optional[Callable[[ExerciseType, str, str, Optional[str]], None]] = None
+) -> Dict[str, int]:
+    """Generate the missing cue sets with at most ``concurrency`` model calls in flight.
+
+    Only combinations without a stored set are generated, so re-running after an
+    interruption or after new exercise types are added only does the new work.
+    """
+    pending = await missing_cue_sets(exercise_type_ids, refresh)
+    if limit is not None:
+        pending = pending[:limit]
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    summary = {"pending": len(pending), "generated": 0, "failed": 0}
+
+    async def generate_one(exercise_type: ExerciseType, level: str, band: str):
+        async with semaphore:
+            error = None
+            try:
+                cues = _clean_cue_set(await model_client.generate_cue_set(build_cue_set_prompt(exercise_type, level, band)))
+                if not all(cues.values()):
+                    raise ValueError("cue set is missing a phase")
+                await store_cue_set(exercise_type.id, level, band, cues)
+                summary["generated"] += 1
+            except Exception as e:
+                error = str(e) or type(e).__name__
+                summary["failed"] += 1
+                logger.warning(f"Cue set for {exercise_type.name} ({level}, {band}) failed: {error}")
+            if on_result:
+                on_result(exercise_type, level, band, error)
+
+    await asyncio.gather(*(generate_one(*combination) for combination in pending))
+    return summary
 
 # ----------------------------
 # History-aware adjustment logic
@@ -380,9 +4064,21 @@ app.add_middleware(
 async def startup():
     await startup_db()
     logger.info("Database initialized")
+    await exercise_type_index.ensure_loaded()
+    await model_client.start()
+    if OLLAMA_PRELOAD:
+        model_client.start_warm_up()
+    model_client.start_status_refresh()
+    await plan_jobs.start()
+    if PREGEN_ENABLED:
+        await plan_pregenerator.start()
 
 @app.on_event("shutdown")
 async def shutdown():
+    await plan_pregenerator.stop()
+    await plan_jobs.stop()
+    await cancel_background_generations()
+    await model_client.close()
     await async_engine.dispose()
 
 # Health check
@@ -391,7 +4087,26 @@ async def health_check():
     return {
         "status": "healthy",
         "timestamp": datetime.utcnow().isoformat(),
-        "version": "1.0.0"
+        "version": "1.0.0",
+        "model": model_client.model_status()
+    }
+
+@app.get("/metrics")
+async def get_metrics():
+    """Runtime counters for plan generation"""
+    return {
+        "generation": model_client.stats(),
+        "limiter": model_client.limiter.stats(),
+        "circuit_breaker": model_client.breaker.stats(),
+        "backends": model_client.pool.stats(),
+        "models": model_client.router.stats(),
+        "scheduler": model_client.scheduler.stats(),
+        "jobs": plan_jobs.stats(),
+        "pregeneration": plan_pregenerator.stats(),
+        "plan_cache": model_client.cache.stats() if model_client.cache else None,
+        "similar_plans": plan_index.stats() if plan_index else None,
+        "coaching_cues": coaching_cues.stats(),
+        "exercise_types": exercise_type_index.stats()
     }
 
 # ----------------------------
@@ -423,12 +4138,8 @@ async def list_users(limit: int = 50, session: AsyncSession = Depends(get_sessio
 # ----------------------------
 @app.post("/exercise-types", status_code=status.HTTP_201_CREATED, response_model=ExerciseType)
 async def create_exercise_type(exercise_data: ExerciseTypeCreate, session: AsyncSession = Depends(get_session)):
-    """Create a new exercise type"""
-    exercise = ExerciseType(**exercise_data.dict())
-    session.add(exercise)
-    await session.commit()
-    await session.refresh(exercise)
-    return exercise
+    """Create a new exercise type (409 if the name already exists)"""
+    return await create_exercise_type_record(session, exercise_data)
 
 @app.get("/exercise-types", response_model=List[ExerciseType])
 async def list_exercise_types(session: AsyncSession = Depends(get_session)):
@@ -437,6 +4148,53 @@ async def list_exercise_types(session: AsyncSession = Depends(get_session)):
     result = await session.execute(query)
     return result.scalars().all()
 
+@app.get("/exercise-types/merge-candidates")
+async def exercise_type_merge_candidates(
+    threshold: float = Query(0.6, ge=0.1, le=1.0),
+    session: AsyncSession = Depends(get_session)
+):
+    """Report groups of exercise types that look like one exercise, for manual merging.
+
+    Types sharing a canonical name are grouped first, then distinct canonical
+    names at least ``threshold`` trigram-similar. Each group suggests keeping the
+    most used type.
+    """
+    query = (
+        select(ExerciseType, func.count(ExerciseInstance.id))
+        .outerjoin(ExerciseInstance, ExerciseInstance.exercise_type_id == ExerciseType.id)
+        .group_by(ExerciseType.id)
+        .order_by(ExerciseType.id)
+    )
+    by_canonical: Dict[str, List[Dict[str, Any]]] = {}
+    for exercise_type, instances in (await session.execute(query)).all():
+        canonical = exercise_type.canonical_name or canonical_exercise_name(exercise_type.name) or f"#{exercise_type.id}"
+        by_canonical.setdefault(canonical, []).append({
+            "id": exercise_type.id, "name": exercise_type.name, "instances": instances
+        })
+    
+    def group(reason: str, similarity: float, members: List[Dict[str, Any]]) -> Dict[str, Any]:
+        members = sorted(members, key=lambda member: (-member["instances"], member["id"]))
+        return {"reason": reason, "similarity": similarity, "keep": members[0], "merge": members[1:]}
+    
+    groups = [
+        group("same canonical name", 1.0, members)
+        for members in by_canonical.values() if len(members) > 1
+    ]
+    trigrams = TrigramIndex()
+    for canonical in by_canonical:
+        trigrams.add(canonical)
+    for canonical in by_canonical:
+        for other, score in trigrams.search(canonical, threshold):
+            if canonical < other:
+                groups.append(group("similar names", score, by_canonical[canonical] + by_canonical[other]))
+    groups.sort(key=lambda entry: -entry["similarity"])
+    return {
+        "exercise_types": sum(len(members) for members in by_canonical.values()),
+        "canonical_names": len(by_canonical),
+        "threshold": threshold,
+        "groups": groups
+    }
+
 # ----------------------------
 # Plan management
 # ----------------------------
@@ -444,87 +4202,87 @@ async def list_exercise_types(session: AsyncSession = Depends(get_session)):
 async def generate_workout_plan(
     user_id: int,
     request: PlanGenerationRequest,
-    session: AsyncSession = Depends(get_session)
+    run_async: bool = Query(False, alias="async", description="Queue the generation and return a job id")
 ):
-    """Generate a personalized workout plan using AI"""
-    user = await get_user_or_404(user_id, session)
+    """Generate a personalized workout plan using AI.
     
-    try:
-        # Generate plan using AI
-        plan_data = await model_client.generate_plan(user, request)
-        
-        # Create plan in database
-        plan = Plan(
-            user_id=user_id,
-            title=plan_data.get("plan_title", f"AI Plan for {user.name}"),
-            description=plan_data.get("plan_description", "AI-generated workout plan"),
-            total_days=request.days
+    With ``?async=true`` the generation is queued and a 202 with a job id is
+    returned immediately; poll ``GET /jobs/{job_id}`` for the resulting plan.
+    With ``deadline_seconds`` set, the response comes within that budget and
+    may be a partial plan (``status: incomplete``) that is completed in the
+    background; ``generation_status`` on the plan turns ``complete`` when done.
+    """
+    async with AsyncSessionLocal() as session:
+        user = await get_user_or_404(user_id, session)
+    
+    if run_async:
+        job = plan_jobs.submit(user, request, lane="batch")
+        return JSONResponse(
+            status_code=status.HTTP_202_ACCEPTED,
+            content=jsonable_encoder(job.summary()),
+            headers={"Location": f"/jobs/{job.id}"}
         )
-        session.add(plan)
-        await session.commit()
-        await session.refresh(plan)
-        
-        # Create days and exercises
-        for day_data in plan_data.get("days", []):
-            plan_day = PlanDay(
-                plan_id=plan.id,
-                day_number=day_data.get("day_number", 1),
-                title=day_data.get("title", f"Day {day_data.get('day_number', 1)}"),
-                rest_day=day_data.get("rest_day", False)
-            )
-            session.add(plan_day)
-            await session.commit()
-            await session.refresh(plan_day)
-            
-            # Add exercises to the day
-            for i, exercise_data in enumerate(day_data.get("exercises", [])):
-                # Find or create exercise type
-                exercise_name = exercise_data.get("name", "Unknown Exercise")
-                query = select(ExerciseType).where(ExerciseType.name == exercise_name)
-                result = await session.execute(query)
-                exercise_type = result.scalar_one_or_none()
-                
-                if not exercise_type:
-                    exercise_type = ExerciseType(
-                        name=exercise_name,
-                        primary_muscle=exercise_data.get("primary_muscle"),
-                        equipment_needed=exercise_data.get("equipment_needed", False),
-                        default_sets=exercise_data.get("sets", 3),
-                        default_reps=exercise_data.get("reps", 10)
-                    )
-                    session.add(exercise_type)
-                    await session.commit()
-                    await session.refresh(exercise_type)
-                
-                # Create exercise instance
-                exercise_instance = ExerciseInstance(
-                    plan_day_id=plan_day.id,
-                    exercise_type_id=exercise_type.id,
-                    order_index=i,
-                    target_sets=exercise_data.get("sets", exercise_type.default_sets),
-                    target_reps=exercise_data.get("reps", exercise_type.default_reps),
-                    current_sets=exercise_data.get("sets", exercise_type.default_sets),
-                    current_reps=exercise_data.get("reps", exercise_type.default_reps),
-                    rest_seconds=exercise_data.get("rest_seconds", 60),
-                    notes=exercise_data.get("notes")
-                )
-                session.add(exercise_instance)
-        
-        await session.commit()
-        
-        return {
-            "plan_id": plan.id,
-            "title": plan.title,
-            "description": plan.description,
-            "total_days": plan.total_days,
-            "status": "generated"
-        }
-        
+    
+    try:
+        if request.deadline_seconds:
+            return await create_plan_within_deadline(user, request)
+        return await create_generated_plan(user, request)
+    except HTTPException:
+        raise
+    except ModelOverloadedError as e:
+        logger.warning(f"Plan generation rejected for user {user_id}: {e}")
+        raise overloaded_http_error(e)
     except Exception as e:
-        await session.rollback()
         logger.error(f"Plan generation failed for user {user_id}: {e}")
         raise HTTPException(status_code=500, detail=f"Failed to generate plan: {str(e)}")
 
+@app.get("/jobs/{job_id}")
+async def get_plan_job(job_id: str):
+    """Get status, timings and the resulting plan id of a plan-generation job"""
+    job = plan_jobs.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.summary()
+
+def _ndjson(event: Dict[str, Any]) -> str:
+    return json.dumps(event, default=str) + "\n"
+
+async def _stream_plan_events(user: User, request: PlanGenerationRequest) -> AsyncIterator[str]:
+    """Forward the streamed plan writer's events to the client as NDJSON"""
+    plan_id: Optional[int] = None
+    days_generated = 0
+    try:
+        async for item in write_streamed_plan(user, request):
+            plan_id = item.get("plan_id", plan_id)
+            days_generated += item["event"] == "day"
+            yield _ndjson(item)
+    except Exception as e:
+        logger.error(f"Streaming plan generation failed for user {user.id}: {e}")
+        yield _ndjson({
+            "event": "error",
+            "plan_id": plan_id,
+            "days_generated": days_generated,
+            "detail": f"Failed to generate plan: {getattr(e, 'detail', e)}"
+        })
+
+@app.post("/users/{user_id}/plans/generate/stream")
+async def generate_workout_plan_stream(
+    user_id: int,
+    request: PlanGenerationRequest,
+    session: AsyncSession = Depends(get_session)
+):
+    """Generate a workout plan and stream each day as NDJSON as soon as it is persisted.
+    
+    Events: ``plan`` (plan row created), ``day`` (one per persisted day),
+    then ``complete`` or ``error``. Days already streamed stay persisted on error.
+    """
+    user = await get_user_or_404(user_id, session)
+    request = model_client.admit_plan_request(request)
+    return StreamingResponse(
+        _stream_plan_events(user, request),
+        media_type="application/x-ndjson"
+    )
+
 @app.get("/users/{user_id}/plans")
 async def get_user_plans(user_id: int, session: AsyncSession = Depends(get_session)):
     """Get all plans for a user"""
@@ -533,6 +4291,37 @@ async def get_user_plans(user_id: int, session: AsyncSession = Depends(get_sessi
     result = await session.execute(query)
     return result.scalars().all()
 
+@app.get("/users/{user_id}/plans/next")
+async def get_next_plan(user_id: int, session: AsyncSession = Depends(get_session)):
+    """Get the pre-generated follow-up to the user's most recent active plan, if one is staged"""
+    await get_user_or_404(user_id, session)
+    source = aliased(Plan)
+    query = (
+        select(Plan)
+        .join(source, Plan.source_plan_id == source.id)
+        .where(source.user_id == user_id, source.is_active == True, Plan.is_active == False)
+        .order_by(source.created_at.desc(), Plan.created_at.desc())
+        .limit(1)
+    )
+    result = await session.execute(query)
+    plan = result.scalars().first()
+    if not plan:
+        raise HTTPException(status_code=404, detail="No follow-up plan staged")
+    return plan
+
+@app.post("/plans/{plan_id}/activate")
+async def activate_plan(plan_id: int, session: AsyncSession = Depends(get_session)):
+    """Activate a plan; activating a staged follow-up retires the plan it follows"""
+    plan = await get_plan_or_404(plan_id, session)
+    plan.is_active = True
+    if plan.source_plan_id:
+        source = await session.get(Plan, plan.source_plan_id)
+        if source:
+            source.is_active = False
+    await session.commit()
+    await session.refresh(plan)
+    return plan
+
 @app.get("/plans/{plan_id}")
 async def get_plan_details(plan_id: int, session: AsyncSession = Depends(get_session)):
     """Get detailed plan with all days and exercises"""
@@ -572,6 +4361,20 @@ async def get_plan_details(plan_id: int, session: AsyncSession = Depends(get_ses
     
     return plan_details
 
+@app.post("/plans/{plan_id}/substitutions")
+async def substitute_exercises(
+    plan_id: int,
+    request: SubstitutionRequest,
+    session: AsyncSession = Depends(get_session)
+):
+    """Swap exercises in a plan for alternatives from the catalog, without calling the model.
+    
+    Replacements share the muscle group (or move to a related group for
+    ``avoid_muscles``) and keep the instance's sets, reps and position.
+    """
+    await get_plan_or_404(plan_id, session)
+    return await substitute_plan_exercises(session, plan_id, request)
+
 @app.put("/plans/{plan_id}")
 async def update_plan(plan_id: int, plan_update: PlanUpdate, session: AsyncSession = Depends(get_session)):
     """Update plan details"""
@@ -589,6 +4392,8 @@ async def update_plan(plan_id: int, plan_update: PlanUpdate, session: AsyncSessi
 async def delete_plan(plan_id: int, session: AsyncSession = Depends(get_session)):
     """Delete a plan and all associated data"""
     plan = await get_plan_or_404(plan_id, session)
+    # A plan still being filled after its deadline would get days written after the delete
+    await cancel_background_generation(plan_id)
     
     try:
         # Delete in correct order to maintain referential integrity
@@ -606,10 +4411,14 @@ async def delete_plan(plan_id: int, session: AsyncSession = Depends(get_session)
         # 3. Delete plan days
         await session.execute(delete(PlanDay).where(PlanDay.plan_id == plan_id))
         
-        # 4. Delete plan
+        # 4. Detach staged follow-ups and drop its similarity record, then delete the plan
+        await session.execute(update(Plan).where(Plan.source_plan_id == plan_id).values(source_plan_id=None))
+        await session.execute(delete(PlanGenerationRecord).where(PlanGenerationRecord.plan_id == plan_id))
         await session.delete(plan)
         
         await session.commit()
+        if plan_index is not None:
+            plan_index.remove(plan_id)
         return {"status": "deleted", "plan_id": plan_id}
         
     except Exception as e:
@@ -617,6 +4426,44 @@ async def delete_plan(plan_id: int, session: AsyncSession = Depends(get_session)
         logger.error(f"Failed to delete plan {plan_id}: {e}")
         raise HTTPException(status_code=500, detail=f"Failed to delete plan: {str(e)}")
 
+# ----------------------------
+# Live coaching
+# ----------------------------
+@app.get("/users/{user_id}/coaching/cue")
+async def stream_coaching_cue_endpoint(
+    user_id: int,
+    exercise_instance_id: int,
+    phase: str = Query("set"),
+    session: AsyncSession = Depends(get_session)
+):
+    """Stream a short coaching cue for one exercise as server-sent events.
+
+    A pre-generated cue from the cue library is served when one exists. Otherwise
+    the cue is generated, grounded in the instance's targets and last reported RPE. Events:
+    ``token`` (text as it is generated) then ``done`` (full cue, source and
+    time to first token).
+    """
+    if phase not in COACHING_PHASES:
+        raise HTTPException(status_code=422, detail=f"phase must be one of {list(COACHING_PHASES)}")
+    user = await get_user_or_404(user_id, session)
+    query = (
+        select(ExerciseInstance, ExerciseType)
+        .join(ExerciseType, ExerciseInstance.exercise_type_id == ExerciseType.id)
+        .join(PlanDay, ExerciseInstance.plan_day_id == PlanDay.id)
+        .join(Plan, PlanDay.plan_id == Plan.id)
+        .where(ExerciseInstance.id == exercise_instance_id, Plan.user_id == user_id)
+    )
+    row = (await session.execute(query)).first()
+    if not row:
+        raise HTTPException(status_code=404, detail="Exercise instance not found for user")
+    instance, exercise_type = row
+    library_cue = await lookup_library_cue(session, exercise_type.id, user.fitness_level, instance.last_rpe, phase)
+    return StreamingResponse(
+        stream_coaching_cue(instance, exercise_type, phase, library_cue),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 # ----------------------------
 # Session reporting
 # ----------------------------
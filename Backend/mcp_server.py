@@ -35,9 +35,10 @@ from mcp.types import (
 from main import (
     User, ExerciseType, Plan, PlanDay, ExerciseInstance, SessionReport,
     UserCreate, ExerciseTypeCreate, PlanGenerationRequest, SessionReportCreate,
-    async_engine, AsyncSessionLocal, get_session
+    AsyncSessionLocal, get_session, init_db, create_exercise_type_record
 )
-from sqlmodel import select, SQLModel
+from fastapi import HTTPException
+from sqlmodel import select
 from sqlalchemy.ext.asyncio import AsyncSession
 
 # Configure logging
@@ -450,10 +451,10 @@ async def handle_call_tool(name: str, arguments: Dict[str, Any]) -> CallToolResu
         elif name == "create_exercise_type":
             exercise_data = ExerciseTypeCreate(**arguments)
             async with await get_db_session() as session:
-                exercise = ExerciseType(**exercise_data.dict())
-                session.add(exercise)
-                await session.commit()
-                await session.refresh(exercise)
+                try:
+                    exercise = await create_exercise_type_record(session, exercise_data)
+                except HTTPException as e:
+                    return CallToolResult(content=[TextContent(type="text", text=e.detail)])
                 return CallToolResult(
                     content=[TextContent(type="text", text=f"Exercise type created successfully: {json.dumps(exercise.model_dump(), default=str, indent=2)}")]
                 )
@@ -639,9 +640,8 @@ async def handle_call_tool(name: str, arguments: Dict[str, Any]) -> CallToolResu
 
 async def main():
     """Run the MCP server"""
-    # Initialize database
-    async with async_engine.begin() as conn:
-        await conn.run_sync(SQLModel.metadata.create_all)
+    # Initialize database (including migrations)
+    await init_db()
     
     # Run the server
     async with stdio_server() as (read_stream, write_stream):
@@ -5,7 +5,6 @@ Enhanced MCP Server for Fitness Application with AI Workout Generation
 import asyncio
 import json
 import logging
-import os
 from typing import Any, Dict, List
 from datetime import datetime, timedelta
 import traceback
@@ -17,22 +16,18 @@ from mcp.types import CallToolResult, ListToolsResult, Tool, TextContent
 
 # Import your existing database models and setup
 from main import (
-    User, ExerciseType, Plan, PlanDay, ExerciseInstance, SessionReport,
+    User, SessionReport,
     UserCreate, ExerciseTypeCreate, PlanGenerationRequest, SessionReportCreate,
-    async_engine, AsyncSessionLocal, ModelClient
+    AsyncSessionLocal, model_client, create_generated_plan, OLLAMA_PRELOAD,
+    init_db, exercise_type_index
 )
-from sqlmodel import select, delete, SQLModel
+from sqlmodel import select, delete
 from sqlalchemy.ext.asyncio import AsyncSession
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Initialize the AI model client
-OLLAMA_URL = os.getenv("OLLAMA_URL", "http://localhost:11434")
-OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "gemma3:4b")
-model_client = ModelClient(OLLAMA_URL, OLLAMA_MODEL)
-
 # Create MCP server
 server = Server("fitness-mcp-server-enhanced")
 
@@ -78,7 +73,9 @@ async def handle_list_tools() -> ListToolsResult:
                         "days": {"type": "integer", "description": "Number of days for the workout plan (3-21)", "default": 7},
                         "preferences": {"type": "string", "description": "Additional preferences for the workout plan"},
                         "include_equipment": {"type": "boolean", "description": "Whether to include equipment-based exercises", "default": False},
-                        "focus_areas": {"type": "array", "items": {"type": "string"}, "description": "Focus areas: strength, cardio, flexibility, weight_loss, muscle_gain, endurance"}
+                        "focus_areas": {"type": "array", "items": {"type": "string"}, "description": "Focus areas: strength, cardio, flexibility, weight_loss, muscle_gain, endurance"},
+                        "bypass_cache": {"type": "boolean", "description": "Skip the generated-plan cache and always call the model", "default": False},
+                        "generator": {"type": "string", "enum": ["llm", "rules"], "description": "'rules' builds the plan instantly from the exercise catalog without the model", "default": "llm"}
                     },
                     "required": ["user_id"]
                 }
@@ -130,78 +127,17 @@ async def handle_call_tool(name: str, arguments: Dict[str, Any]) -> CallToolResu
             
             async with await get_db_session() as session:
                 user = await session.get(User, user_id)
-                if not user:
-                    return CallToolResult(content=[TextContent(type="text", text=f"User with ID {user_id} not found")])
-                
-                try:
-                    # Generate plan using AI
-                    plan_data = await model_client.generate_plan(user, request)
-                    
-                    # Create plan in database
-                    plan = Plan(
-                        user_id=user_id,
-                        title=plan_data.get("plan_title", f"AI Plan for {user.name}"),
-                        description=plan_data.get("plan_description", "AI-generated workout plan"),
-                        total_days=request.days
-                    )
-                    session.add(plan)
-                    await session.commit()
-                    await session.refresh(plan)
-                    
-                    # Create days and exercises
-                    for day_data in plan_data.get("days", []):
-                        plan_day = PlanDay(
-                            plan_id=plan.id,
-                            day_number=day_data.get("day_number", 1),
-                            title=day_data.get("title", f"Day {day_data.get('day_number', 1)}"),
-                            rest_day=day_data.get("rest_day", False)
-                        )
-                        session.add(plan_day)
-                        await session.commit()
-                        await session.refresh(plan_day)
-                        
-                        # Add exercises to the day
-                        for i, exercise_data in enumerate(day_data.get("exercises", [])):
-                            # Find or create exercise type
-                            exercise_name = exercise_data.get("name", "Unknown Exercise")
-                            query = select(ExerciseType).where(ExerciseType.name == exercise_name)
-                            result = await session.execute(query)
-                            exercise_type = result.scalar_one_or_none()
-                            
-                            if not exercise_type:
-                                exercise_type = ExerciseType(
-                                    name=exercise_name,
-                                    primary_muscle=exercise_data.get("primary_muscle"),
-                                    equipment_needed=exercise_data.get("equipment_needed", False),
-                                    default_sets=exercise_data.get("sets", 3),
-                                    default_reps=exercise_data.get("reps", 10)
-                                )
-                                session.add(exercise_type)
-                                await session.commit()
-                                await session.refresh(exercise_type)
-                            
-                            # Create exercise instance
-                            exercise_instance = ExerciseInstance(
-                                plan_day_id=plan_day.id,
-                                exercise_type_id=exercise_type.id,
-                                order_index=i,
-                                target_sets=exercise_data.get("sets", exercise_type.default_sets),
-                                target_reps=exercise_data.get("reps", exercise_type.default_reps),
-                                current_sets=exercise_data.get("sets", exercise_type.default_sets),
-                                current_reps=exercise_data.get("reps", exercise_type.default_reps),
-                                rest_seconds=exercise_data.get("rest_seconds", 60),
-                                notes=exercise_data.get("notes")
-                            )
-                            session.add(exercise_instance)
-                    
-                    await session.commit()
-                    
-                    return CallToolResult(content=[TextContent(type="text", text=f"AI workout plan generated successfully! Plan ID: {plan.id}\nTitle: {plan.title}\nDescription: {plan.description}\nDays: {plan.total_days}")])
-                    
-                except Exception as e:
-                    await session.rollback()
-                    logger.error(f"Plan generation failed for user {user_id}: {e}")
-                    return CallToolResult(content=[TextContent(type="text", text=f"Failed to generate plan: {str(e)}")])
+            if not user:
+                return CallToolResult(content=[TextContent(type="text", text=f"User with ID {user_id} not found")])
+            
+            try:
+                # Generate with the model first; a DB session is only opened to persist the result
+                plan = await create_generated_plan(user, request, lane="agent")
+                return CallToolResult(content=[TextContent(type="text", text=f"AI workout plan generated successfully! Plan ID: {plan['plan_id']}\nTitle: {plan['title']}\nDescription: {plan['description']}\nDays: {plan['total_days']}")])
+            
+            except Exception as e:
+                logger.error(f"Plan generation failed for user {user_id}: {e}")
+                return CallToolResult(content=[TextContent(type="text", text=f"Failed to generate plan: {str(e)}")])
         
         elif name == "get_user_progress":
             user_id = arguments["user_id"]
@@ -252,9 +188,15 @@ async def handle_call_tool(name: str, arguments: Dict[str, Any]) -> CallToolResu
 async def main():
     """Run the MCP server"""
     try:
-        # Initialize database
-        async with async_engine.begin() as conn:
-            await conn.run_sync(SQLModel.metadata.create_all)
+        # Initialize database (including migrations) and the exercise name index
+        await init_db()
+        await exercise_type_index.ensure_loaded()
+        
+        # Open the shared, pooled Ollama client (configured from the same env vars as main.py)
+        await model_client.start()
+        if OLLAMA_PRELOAD:
+            model_client.start_warm_up()
+        model_client.start_status_refresh()
         
         # Run the server
         async with stdio_server() as (read_stream, write_stream):
@@ -274,6 +216,9 @@ async def main():
         logger.error(f"Fatal error in main: {e}\n{traceback.format_exc()}")
         print(f"❌ Fatal error: {e}")
         raise
+    finally:
+        # Also cancels the warm-up and model status refresh tasks
+        await model_client.close()
 
 if __name__ == "__main__":
     asyncio.run(main())
@@ -0,0 +1,313 @@
+#!/usr/bin/env python3
+"""
+Offline stand-in for Ollama used to load-test the plan generation path
+Serves /api/generate (streaming and non-streaming), /api/tags and /api/ps with
+configurable latency, throughput and failure injection, and answers with plan
+JSON in the shapes ModelClient asks for (full plan, outline, week chunk).
+
+Run: python ollama_simulator.py --port 11435 --ttft 0.5 --tokens-per-sec 40
+Then point the app at it: OLLAMA_URL=http://localhost:11435 uvicorn main:app
+"""
+
+import os
+import re
+import json
+import time
+import random
+import asyncio
+import argparse
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# ----------------------------
+# Simulation settings (overridable from the command line)
+# ----------------------------
+class SimulatorConfig:
+    def __init__(self):
+        self.model = os.getenv("OLLAMA_MODEL", "gemma3:4b")
+        self.ttft = float(os.getenv("SIM_TTFT", "0.3"))  # seconds before the first token
+        self.tokens_per_sec = float(os.getenv("SIM_TOKENS_PER_SEC", "50"))
+        # Prompt evaluation speed; 0 folds it into ttft. Tokens passed back via `context` are not re-evaluated.
+        self.prompt_tokens_per_sec = float(os.getenv("SIM_PROMPT_TOKENS_PER_SEC", "0"))
+        self.failure_rate = float(os.getenv("SIM_FAILURE_RATE", "0.0"))  # HTTP 500 responses
+        self.malformed_rate = float(os.getenv("SIM_MALFORMED_RATE", "0.0"))  # broken JSON bodies
+        self.parallel = int(os.getenv("SIM_PARALLEL", "1"))  # requests decoded at once, like OLLAMA_NUM_PARALLEL
+        self.load_seconds = float(os.getenv("SIM_LOAD_SECONDS", "2.0"))  # cold model load time
+        # Models that always answer with broken output, to exercise escalation in model routing
+        self.weak_models = [m for m in os.getenv("SIM_WEAK_MODELS", "").split(",") if m]
+        self.seed: Optional[int] = None
+
+config = SimulatorConfig()
+
+# ----------------------------
+# Plan content
+# ----------------------------
+BODYWEIGHT_EXERCISES = [
+    ("Push-ups", "chest"), ("Bodyweight Squats", "legs"), ("Plank", "core"),
+    ("Glute Bridges", "glutes"), ("Lunges", "legs"), ("Superman", "back"),
+    ("Mountain Climbers", "core"), ("Pike Push-ups", "shoulders"), ("Burpees", "full body"),
+    ("Tricep Dips", "triceps"), ("Jumping Jacks", "cardio"), ("Bird Dog", "core"),
+]
+
+EQUIPMENT_EXERCISES = [
+    ("Dumbbell Bench Press", "chest"), ("Barbell Squat", "legs"), ("Bent-over Row", "back"),
+    ("Overhead Press", "shoulders"), ("Romanian Deadlift", "hamstrings"), ("Lat Pulldown", "back"),
+    ("Dumbbell Curl", "biceps"), ("Cable Tricep Pushdown", "triceps"), ("Leg Press", "legs"),
+]
+
+SPLIT = [
+    ("Upper Body", False), ("Lower Body", False), ("Core & Conditioning", False),
+    ("Active Recovery", True), ("Full Body", False), ("Push & Pull", False), ("Rest", True),
+]
+
+# Answers to anything that is not a plan request (e.g. live coaching cues)
+COACHING_CUES = [
+    "Keep your core tight and breathe out on the effort.",
+    "Slow on the way down, drive hard on the way up.",
+    "Shoulders back, chest proud, own every rep.",
+    "Great pace, stay smooth and finish strong.",
+]
+
+def _fitness_level(prompt: str) -> str:
+    match = re.search(r'"fitness_level":\s*"(\w+)"', prompt)
+    return match.group(1) if match else "beginner"
+
+def _make_day(day_number: int, rng: random.Random, with_equipment: bool, level: str) -> Dict[str, Any]:
+    title, rest_day = SPLIT[(day_number - 1) % len(SPLIT)]
+    pool = BODYWEIGHT_EXERCISES + (EQUIPMENT_EXERCISES if with_equipment else [])
+    sets = {"beginner": 2, "intermediate": 3, "advanced": 4}.get(level, 3)
+    exercises = [] if rest_day else [
+        {
+            "name": name,
+            "sets": sets,
+            "reps": rng.choice([8, 10, 12, 15]),
+            "rest_seconds": rng.choice([45, 60, 90]),
+            "primary_muscle": muscle,
+            "equipment_needed": (name, muscle) in EQUIPMENT_EXERCISES,
+            "notes": "Controlled tempo"
+        }
+        for name, muscle in rng.sample(pool, k=min(len(pool), rng.randint(3, 5)))
+    ]
+    return {"day_number": day_number, "title": f"Day {day_number} - {title}", "rest_day": rest_day, "exercises": exercises}
+
+def build_response(prompt: str, rng: random.Random) -> str:
+    """Produce model output in whatever shape the prompt asks for"""
+    level = _fitness_level(prompt)
+    with_equipment = "Equipment: with equipment" in prompt
+
+    if '"weekly_split"' in prompt:
+        entries = re.search(r"exactly (\d+) entries", prompt)
+        count = int(entries.group(1)) if entries else len(SPLIT)
+        return json.dumps({
+            "plan_title": f"Simulated {level.title()} Program",
+            "plan_description": "Outline produced by the Ollama simulator",
+            "weekly_split": [
+                {"day_of_week": i + 1, "title": SPLIT[i % len(SPLIT)][0], "rest_day": SPLIT[i % len(SPLIT)][1], "focus": "general"}
+                for i in range(count)
+            ]
+        })
+
+    only = re.search(r"Write only days ([\d, ]+)", prompt)
+    if only:
+        numbers = [int(n) for n in re.findall(r"\d+", only.group(1))]
+        return json.dumps({"days": [_make_day(n, rng, with_equipment, level) for n in numbers]})
+
+    chunk = re.search(r"Write days (\d+) to (\d+)", prompt)
+    if chunk:
+        start, end = int(chunk.group(1)), int(chunk.group(2))
+        return json.dumps({"days": [_make_day(n, rng, with_equipment, level) for n in range(start, end + 1)]})
+
+    cue_set = re.search(r"Write (\d+) different cues for each moment", prompt)
+    if cue_set:
+        count = int(cue_set.group(1))
+        return json.dumps({phase: rng.sample(COACHING_CUES, k=min(count, len(COACHING_CUES))) for phase in ("setup", "set", "rest")})
+
+    plan = re.search(r"Create a (\d+)-day workout plan", prompt)
+    if plan:
+        days = int(plan.group(1))
+        return json.dumps({
+            "plan_title": f"Simulated {days}-Day {level.title()} Plan",
+            "plan_description": "Plan produced by the Ollama simulator",
+            "days": [_make_day(n, rng, with_equipment, level) for n in range(1, days + 1)]
+        }, indent=2)
+
+    return rng.choice(COACHING_CUES)
+
+def corrupt(text: str, rng: random.Random) -> str:
+    """Inject one of the defects real models produce: truncation, trailing comma or chatter"""
+    defect = rng.choice(["truncate", "trailing_comma", "chatter"])
+    if defect == "truncate":
+        return text[: rng.randint(len(text) // 3, max(len(text) // 3 + 1, len(text) - 1))]
+    if defect == "trailing_comma":
+        index = text.rfind("}", 0, len(text) - 1)
+        return text[:index + 1] + "," + text[index + 1:] if index != -1 else text
+    return "Sure! Here is your plan:\n```json\n" + text + "\n```"
+
+def tokenize(text: str) -> List[str]:
+    """Split text into roughly token-sized pieces (about four characters each)"""
+    return re.findall(r"\s*\S{1,4}|\s+", text)
+
+# ----------------------------
+# Simulated server
+# ----------------------------
+app = FastAPI(title="Ollama Simulator", version="1.0.0")
+
+_decode_slots: Optional[asyncio.Semaphore] = None
+_loaded_until: Optional[datetime] = None
+_stats = {"requests": 0, "failures": 0, "malformed": 0, "tokens": 0}
+
+def _slots() -> asyncio.Semaphore:
+    global _decode_slots
+    if _decode_slots is None:
+        _decode_slots = asyncio.Semaphore(max(1, config.parallel))
+    return _decode_slots
+
+def _rng() -> random.Random:
+    return random.Random(None if config.seed is None else config.seed + _stats["requests"])
+
+def _keep_alive_seconds(value: Any) -> float:
+    if isinstance(value, (int, float)):
+        return float(value)
+    match = re.fullmatch(r"(\d+)([smh]?)", str(value or "5m"))
+    if not match:
+        return 300.0
+    return int(match.group(1)) * {"": 1, "s": 1, "m": 60, "h": 3600}[match.group(2)]
+
+async def _ensure_loaded(keep_alive: Any):
+    """Pay the cold-load penalty when the model is not resident, then extend residency"""
+    global _loaded_until
+    now = datetime.utcnow()
+    if _loaded_until is None or _loaded_until < now:
+        await asyncio.sleep(config.load_seconds)
+    _loaded_until = datetime.utcnow() + timedelta(seconds=_keep_alive_seconds(keep_alive))
+
+def _prompt_eval_seconds(prompt: str) -> float:
+    if config.prompt_tokens_per_sec <= 0:
+        return config.ttft
+    return config.ttft + len(tokenize(prompt)) / config.prompt_tokens_per_sec
+
+def _final_chunk(started: float, prompt: str, eval_count: int, context: List[int]) -> Dict[str, Any]:
+    total_ns = int((time.perf_counter() - started) * 1e9)
+    prompt_count = len(tokenize(prompt))
+    prompt_ns = int(_prompt_eval_seconds(prompt) * 1e9)
+    return {
+        "model": config.model,
+        "created_at": datetime.utcnow().isoformat() + "Z",
+        "response": "",
+        "done": True,
+        "context": context + list(range(prompt_count + eval_count)),
+        "total_duration": total_ns,
+        "prompt_eval_count": prompt_count,
+        "prompt_eval_duration": prompt_ns,
+        "eval_count": eval_count,
+        "eval_duration": max(0, total_ns - prompt_ns),
+    }
+
+@app.get("/api/tags")
+async def tags():
+    return {"models": [{"name": config.model, "model": config.model, "size": 3_300_000_000}]}
+
+@app.get("/api/ps")
+async def ps():
+    if _loaded_until is None or _loaded_until < datetime.utcnow():
+        return {"models": []}
+    return {"models": [{"name": config.model, "model": config.model, "expires_at": _loaded_until.isoformat() + "Z"}]}
+
+@app.get("/stats")
+async def stats():
+    return _stats
+
+@app.post("/api/generate")
+async def generate(request: Request):
+    body = await request.json()
+    prompt = body.get("prompt", "")
+    stream = body.get("stream", True)  # Ollama streams unless told otherwise
+    _stats["requests"] += 1
+    rng = _rng()
+
+    if rng.random() < config.failure_rate:
+        _stats["failures"] += 1
+        return JSONResponse(status_code=500, content={"error": "simulated model failure"})
+
+    if not prompt:
+        # Load-only request (warm-up)
+        await _ensure_loaded(body.get("keep_alive"))
+        return {"model": config.model, "response": "", "done": True, "done_reason": "load"}
+
+    text = build_response(prompt, rng)
+    if body.get("model") in config.weak_models or rng.random() < config.malformed_rate:
+        _stats["malformed"] += 1
+        text = corrupt(text, rng)
+    tokens = tokenize(text)
+    num_predict = (body.get("options") or {}).get("num_predict")
+    if num_predict and num_predict > 0:
+        tokens = tokens[:num_predict]  # like Ollama, stop at the token budget
+        text = "".join(tokens)
+    token_delay = 1.0 / config.tokens_per_sec if config.tokens_per_sec > 0 else 0.0
+    context = body.get("context") or []
+
+    if not stream:
+        async with _slots():
+            started = time.perf_counter()
+            await _ensure_loaded(body.get("keep_alive"))
+            await asyncio.sleep(_prompt_eval_seconds(prompt) + token_delay * len(tokens))
+            _stats["tokens"] += len(tokens)
+            return {**_final_chunk(started, prompt, len(tokens), context), "response": text}
+
+    async def token_stream():
+        async with _slots():
+            started = time.perf_counter()
+            await _ensure_loaded(body.get("keep_alive"))
+            await asyncio.sleep(_prompt_eval_seconds(prompt))
+            for token in tokens:
+                yield json.dumps({"model": config.model, "response": token, "done": False}) + "\n"
+                _stats["tokens"] += 1
+                if token_delay:
+                    await asyncio.sleep(token_delay)
+            yield json.dumps(_final_chunk(started, prompt, len(tokens), context)) + "\n"
+
+    return StreamingResponse(token_stream(), media_type="application/x-ndjson")
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline Ollama simulator for load tests")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--model", default=config.model)
+    parser.add_argument("--ttft", type=float, default=config.ttft, help="seconds before the first token")
+    parser.add_argument("--tokens-per-sec", type=float, default=config.tokens_per_sec)
+    parser.add_argument("--prompt-tokens-per-sec", type=float, default=config.prompt_tokens_per_sec, help="prompt evaluation speed (0: included in ttft)")
+    parser.add_argument("--failure-rate", type=float, default=config.failure_rate)
+    parser.add_argument("--malformed-rate", type=float, default=config.malformed_rate)
+    parser.add_argument("--parallel", type=int, default=config.parallel, help="requests decoded concurrently")
+    parser.add_argument("--load-seconds", type=float, default=config.load_seconds, help="cold model load time")
+    parser.add_argument("--seed", type=int, default=None, help="make responses reproducible")
+    parser.add_argument("--weak-models", default=",".join(config.weak_models), help="comma-separated models that always return broken output")
+    args = parser.parse_args()
+
+    config.model = args.model
+    config.ttft = args.ttft
+    config.tokens_per_sec = args.tokens_per_sec
+    config.prompt_tokens_per_sec = args.prompt_tokens_per_sec
+    config.failure_rate = args.failure_rate
+    config.malformed_rate = args.malformed_rate
+    config.parallel = args.parallel
+    config.load_seconds = args.load_seconds
+    config.seed = args.seed
+    config.weak_models = [m for m in args.weak_models.split(",") if m]
+
+    import uvicorn
+    logger.info(
+        f"Simulating {config.model}: ttft={config.ttft}s, {config.tokens_per_sec} tok/s, "
+        f"parallel={config.parallel}, failures={config.failure_rate:.0%}, malformed={config.malformed_rate:.0%}"
+    )
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+if __name__ == "__main__":
+    main()
@@ -48,19 +48,35 @@ def check_database():
 
 def check_ollama():
     """Check if Ollama is running (optional)"""
+    ollama_url = os.getenv("OLLAMA_URL", "http://localhost:11434")
+    ollama_urls = [u.strip() for u in os.getenv("OLLAMA_URLS", ollama_url).split(",") if u.strip()]
+    available = [url for url in ollama_urls if check_ollama_backend(url, len(ollama_urls) > 1)]
+    if not available:
+        print("   AI workout plan generation will not be available")
+    return bool(available)
+
+def check_ollama_backend(ollama_url, show_url=False):
+    """Check one Ollama backend and whether the configured model is loaded on it"""
+    label = f"Ollama at {ollama_url}" if show_url else "Ollama"
     try:
         import httpx
-        ollama_url = os.getenv("OLLAMA_URL", "http://localhost:11434")
+        ollama_model = os.getenv("OLLAMA_MODEL", "gemma3:4b")
         response = httpx.get(f"{ollama_url}/api/tags", timeout=3.0)
         if response.status_code == 200:
-            print("✓ Ollama is running and accessible")
+            print(f"✓ {label} is running and accessible")
+            loaded = httpx.get(f"{ollama_url}/api/ps", timeout=3.0).json().get("models", [])
+            if any(ollama_model in (m.get("name"), m.get("model")) for m in loaded):
+                print(f"✓ Model {ollama_model} is loaded")
+            else:
+                print(f"ℹ️  Model {ollama_model} is not loaded yet; it will be preloaded on startup"
+                      if os.getenv("OLLAMA_PRELOAD", "true").lower() == "true"
+                      else f"ℹ️  Model {ollama_model} is not loaded; the first plan will pay the load time")
             return True
         else:
-            print("⚠️  Ollama is not responding properly")
+            print(f"⚠️  {label} is not responding properly")
             return False
     except Exception:
-        print("⚠️  Ollama is not running or not accessible")
-        print("   AI workout plan generation will not be available")
+        print(f"⚠️  {label} is not running or not accessible")
         return False
 
 async def start_server(server_type="enhanced"):
@@ -0,0 +1,28 @@
+"""
+Shared test setup
+main reads its configuration at import time, so the environment is set here,
+before any test module imports it: a throwaway SQLite database, no background
+pre-generation or model preload, and an Ollama URL nothing listens on.
+"""
+
+import os
+import sys
+import asyncio
+import tempfile
+
+import pytest
+
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{tempfile.mkdtemp()}/test.db"
+os.environ["OLLAMA_URL"] = "http://127.0.0.1:9"
+os.environ.pop("OLLAMA_URLS", None)
+os.environ["OLLAMA_PRELOAD"] = "false"
+os.environ["PREGEN_ENABLED"] = "false"
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+@pytest.fixture(scope="session")
+def database():
+    """Create the tables (and run startup migrations) once per test run"""
+    import main
+    asyncio.run(main.init_db())
+    return main
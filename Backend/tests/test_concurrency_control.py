@@ -0,0 +1,98 @@
+import asyncio
+
+import pytest
+
+from main import AdaptiveLimiter, CircuitBreaker, ModelOverloadedError
+
+def test_limit_grows_only_while_saturated_and_backs_off_on_slow_calls():
+    limiter = AdaptiveLimiter(initial_limit=2, min_limit=1, max_limit=4, latency_target=1.0, backoff=0.5)
+    
+    async def run():
+        await limiter.acquire()
+        limiter.release(0.1, ok=True)  # not saturated: no probe upwards
+        assert limiter.limit == 2
+        await limiter.acquire()
+        await limiter.acquire()
+        limiter.release(0.1, ok=True)  # saturated and fast: +1/limit
+        assert limiter.limit == 2.5
+        limiter.release(5.0, ok=True)  # slower than the target
+        assert limiter.limit == 1.25
+        await limiter.acquire()
+        limiter.release(0.1, ok=False)
+        assert limiter.limit == 1  # never below min_limit
+    
+    asyncio.run(run())
+
+def test_waiters_are_admitted_in_order_and_overflow_is_rejected():
+    limiter = AdaptiveLimiter(initial_limit=1, min_limit=1, max_limit=1, max_queue=2, queue_timeout=5)
+    
+    async def run():
+        admitted = []
+        
+        async def call(name):
+            await limiter.acquire()
+            admitted.append(name)
+        
+        await limiter.acquire()
+        waiters = [asyncio.create_task(call(name)) for name in ("first", "second")]
+        await asyncio.sleep(0)
+        assert not limiter.has_capacity()
+        with pytest.raises(ModelOverloadedError):
+            await limiter.acquire()
+        for _ in waiters:
+            limiter.release(0.1, ok=True, adjust=False)
+            await asyncio.sleep(0)
+        await asyncio.gather(*waiters)
+        return admitted
+    
+    assert asyncio.run(run()) == ["first", "second"]
+    assert limiter.stats()["rejected"] == 1
+
+def test_queued_caller_times_out():
+    limiter = AdaptiveLimiter(initial_limit=1, min_limit=1, max_limit=1, queue_timeout=0.01)
+    
+    async def run():
+        await limiter.acquire()
+        with pytest.raises(ModelOverloadedError):
+            await limiter.acquire()
+    
+    asyncio.run(run())
+    assert limiter.stats()["timed_out"] == 1
+    assert limiter.stats()["waiting"] == 0
+
+def test_breaker_opens_after_threshold_and_probes_with_one_call():
+    breaker = CircuitBreaker(failure_threshold=2, reset_seconds=60)
+    breaker.before_call()
+    breaker.record_failure()
+    assert breaker.state == "closed"
+    breaker.before_call()
+    breaker.record_failure()
+    assert breaker.state == "open" and not breaker.allows_calls()
+    with pytest.raises(ModelOverloadedError):
+        breaker.before_call()
+    
+    breaker._opened_at -= 60  # the reset period has passed
+    breaker.before_call()
+    assert breaker.state == "half_open"
+    with pytest.raises(ModelOverloadedError):
+        breaker.before_call()  # only one trial call at a time
+    breaker.record_success()
+    assert breaker.state == "closed" and breaker.failures == 0
+
+def test_failed_trial_reopens_the_breaker():
+    breaker = CircuitBreaker(failure_threshold=3, reset_seconds=0)
+    for _ in range(3):
+        breaker.record_failure()
+    breaker.before_call()
+    assert breaker.state == "half_open"
+    breaker.record_failure()
+    assert breaker.state == "open"
+    assert breaker.stats()["opened"] == 2
+
+def test_released_trial_does_not_change_the_state():
+    breaker = CircuitBreaker(failure_threshold=1, reset_seconds=0)
+    breaker.record_failure()
+    breaker.before_call()
+    breaker.release_trial()
+    breaker.before_call()  # a new trial is allowed
+    assert breaker.state == "half_open"
@@ -0,0 +1,86 @@
+import asyncio
+
+import pytest
+
+import main
+from main import ExerciseType, ExerciseTypeIndex, TrigramIndex, canonical_exercise_name, same_exercise_words
+
+@pytest.mark.parametrize("name, canonical", [
+    ("Push-ups", "pushup"),
+    ("Push Ups (knees)", "pushup"),
+    ("push up [modified]", "pushup"),
+    ("Dumbbell Rows", "dumbbellrow"),
+    ("Bench Presses", "benchpress"),
+    ("Glutes", "glute"),
+    ("Ｐｕｓｈ－ｕｐｓ", "pushup"),
+    ("Жим лёжа", "жимлёжа"),
+    ("俯卧撑", "俯卧撑"),
+    ("---", "---"),
+    ("  ", ""),
+])
+def test_canonical_names(name, canonical):
+    assert canonical_exercise_name(name) == canonical
+
+def test_non_latin_names_keep_distinct_keys():
+    names = ["Жим лёжа", "Приседания", "俯卧撑", "深蹲"]
+    assert len({canonical_exercise_name(name) for name in names}) == len(names)
+
+def test_trigram_search_ranks_by_similarity():
+    index = TrigramIndex()
+    for key in ("dumbbellrow", "dumbbellcurl", "pushup", ""):
+        index.add(key)
+    matches = index.search("dumbellrow", 0.5)
+    assert [key for key, _ in matches][0] == "dumbbellrow"
+    assert all(score >= 0.5 for _, score in matches)
+    assert "pushup" not in dict(matches)
+    assert index.search("", 0.0) == []
+
+def test_trigram_search_never_matches_different_numbers():
+    index = TrigramIndex()
+    index.add("variation30")
+    assert index.search("variation31", 0.1) == []
+
+@pytest.mark.parametrize("name, other, same", [
+    ("Dumbell Row", "Dumbbell Row", True),
+    ("Bulgarian Split Squat Jump", "Bulgarian Split Squat", False),
+    ("Incline Dumbbell Bench Press", "Decline Dumbbell Bench Press", False),
+    ("Variation 3 1", "Variation 3 0", False),
+])
+def test_same_exercise_words(name, other, same):
+    tokens, other_tokens = main.exercise_name_tokens(name), main.exercise_name_tokens(other)
+    assert same_exercise_words(tokens, other_tokens) is same
+
+def make_index(names):
+    index = ExerciseTypeIndex(match_threshold=0.75)
+    for exercise_id, name in enumerate(names, 1):
+        index.add(ExerciseType(id=exercise_id, name=name, canonical_name=canonical_exercise_name(name)))
+    return index
+
+def test_index_matches_spelling_variants_but_not_different_exercises():
+    index = make_index(["Push-ups", "Dumbbell Rows", "Bulgarian Split Squat", "Decline Dumbbell Bench Press", "Жим лёжа"])
+    assert index.match("Push Ups (knees)")[0].name == "Push-ups"
+    assert index.match("Dumbell Row")[0].name == "Dumbbell Rows"
+    assert index.match("Bulgarian Split Squat Jump") is None
+    assert index.match("Incline Dumbbell Bench Press") is None
+    assert index.match("Приседания") is None
+    assert index.get("Push Ups (knees)").name == "Push-ups"  # remembered as an alias
+    stats = index.stats()
+    assert (stats["canonical_matches"], stats["similar_matches"]) == (1, 1)
+
+def test_oldest_type_owns_a_canonical_name():
+    index = make_index(["Pushups", "Push-ups"])
+    assert index.get_canonical("pushup").id == 1
+    assert index.get_canonical("") is None
+
+def test_resolving_new_names_in_one_plan(database):
+    async def run():
+        async with main.AsyncSessionLocal() as session:
+            types = await main.resolve_exercise_types(session, [
+                {"name": name} for name in ("Side Plank", "Side Planks", "Жим лёжа", "Приседания", "俯卧撑")
+            ])
+            await session.commit()
+        return types
+    
+    types = asyncio.run(run())
+    assert types["Side Plank"].id == types["Side Planks"].id
+    assert len({types[name].id for name in ("Жим лёжа", "Приседания", "俯卧撑")}) == 3
@@ -0,0 +1,84 @@
+import asyncio
+
+import pytest
+
+from main import GenerationScheduler, ModelOverloadedError
+
+def run_in_order(requests, capacity: int = 1, lane_limits=None, max_queue: int = 50):
+    """Queue ``requests`` (name, user, lane, cost) behind a running generation and return the order they start in"""
+    scheduler = GenerationScheduler(
+        capacity=lambda: capacity,
+        lane_limits=lane_limits or {"interactive": 1, "agent": 1, "batch": 1},
+        max_queue=max_queue
+    )
+    started = []
+    
+    async def generate(name, user, lane, cost):
+        async with scheduler.slot(user, lane, cost=cost):
+            started.append(name)
+            await asyncio.sleep(0)
+    
+    async def run():
+        blocker = scheduler.slot("blocker", "interactive")
+        await blocker.__aenter__()
+        tasks = []
+        for request in requests:
+            tasks.append(asyncio.create_task(generate(*request)))
+            await asyncio.sleep(0)  # enqueue in list order
+        await blocker.__aexit__(None, None, None)
+        await asyncio.gather(*tasks)
+    
+    asyncio.run(run())
+    return started
+
+def test_short_plan_is_not_stuck_behind_another_users_long_plans():
+    order = run_in_order([
+        ("a1", "alice", "interactive", 21),
+        ("a2", "alice", "interactive", 21),
+        ("a3", "alice", "interactive", 21),
+        ("b1", "bob", "interactive", 3),
+    ])
+    assert order == ["b1", "a1", "a2", "a3"]
+
+def test_users_with_equal_costs_alternate():
+    order = run_in_order([
+        ("a1", "alice", "interactive", 7),
+        ("a2", "alice", "interactive", 7),
+        ("b1", "bob", "interactive", 7),
+        ("b2", "bob", "interactive", 7),
+    ])
+    assert order == ["a1", "b1", "a2", "b2"]
+
+def test_higher_priority_lanes_are_served_first():
+    order = run_in_order([
+        ("batch", "carol", "batch", 1),
+        ("agent", "dave", "agent", 1),
+        ("interactive", "erin", "interactive", 1),
+    ])
+    assert order == ["interactive", "agent", "batch"]
+
+def test_full_lane_rejects_new_work():
+    scheduler = GenerationScheduler(capacity=lambda: 1, lane_limits={"interactive": 1}, max_queue=0)
+    
+    async def run():
+        async with scheduler.slot("alice"):
+            pass
+    
+    with pytest.raises(ModelOverloadedError):
+        asyncio.run(run())
+    assert not scheduler.has_capacity("interactive")
+
+def test_queued_work_is_rejected_after_the_queue_timeout():
+    scheduler = GenerationScheduler(capacity=lambda: 1, lane_limits={"interactive": 1}, queue_timeout=0.05)
+    
+    async def run():
+        async with scheduler.slot("alice"):
+            with pytest.raises(ModelOverloadedError) as rejected:
+                async with scheduler.slot("bob"):
+                    pass
+        return rejected.value
+    
+    error = asyncio.run(run())
+    assert error.retry_after > 0
+    assert scheduler.stats()["lanes"]["interactive"]["timed_out"] == 1
+    assert scheduler.is_idle()
@@ -0,0 +1,40 @@
+import asyncio
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from main import ModelClient, ModelRouter
+
+def ollama_ps(loaded):
+    """A fake Ollama whose /api/ps lists ``loaded`` models per backend host"""
+    def handler(request: httpx.Request) -> httpx.Response:
+        if request.url.host not in loaded:
+            raise httpx.ConnectError("connection refused", request=request)
+        models = [{"name": name, "model": name, "expires_at": "later"} for name in loaded[request.url.host]]
+        return httpx.Response(200, json={"models": models})
+    return httpx.MockTransport(handler)
+
+def test_snapshot_covers_every_routable_model_on_every_backend():
+    router = ModelRouter(default_model="small", rules=[{"model": "medium", "min_days": 14}], escalation=["large"])
+    client = ModelClient(base_urls=["http://one:11434", "http://two:11434", "http://down:11434"], model="small", router=router)
+    client._client = httpx.AsyncClient(transport=ollama_ps({"one": ["small:latest"], "two": ["large:latest", "other"]}))
+    assert client.model_status()["checked_at"] is None
+    
+    snapshot = asyncio.run(client.refresh_model_status())
+    assert snapshot is client.model_status()
+    assert snapshot["resident"] is True
+    assert snapshot["models"] == {"small": True, "medium": False, "large": True}
+    assert [backend["resident"] for backend in snapshot["backends"]] == [{"small": "later"}, {"large": "later"}, {}]
+    assert "error" in snapshot["backends"][2]
+
+def test_health_serves_the_snapshot_without_calling_ollama(monkeypatch):
+    async def unreachable(*args, **kwargs):
+        raise AssertionError("/health must not call Ollama")
+    
+    with TestClient(main.app) as client:
+        monkeypatch.setattr(main.model_client, "_backend_model_status", unreachable)
+        response = client.get("/health")
+    assert response.status_code == 200
+    assert set(response.json()["model"]) == {"model", "keep_alive", "resident", "models", "checked_at", "backends"}
@@ -0,0 +1,73 @@
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+
+@pytest.fixture
+def client():
+    with TestClient(main.app) as client:
+        yield client
+
+@pytest.fixture
+def user(client):
+    response = client.post("/users", json={"name": "Overloaded User", "fitness_level": "beginner"})
+    return response.json()
+
+@pytest.fixture
+def overloaded(monkeypatch):
+    """The interactive lane accepts no more waiting generations"""
+    monkeypatch.setattr(main.model_client.scheduler, "max_queue", 0)
+
+def test_rejected_generation_returns_503_with_retry_after(client, user, overloaded, monkeypatch):
+    monkeypatch.setattr(main.model_client, "rules_fallback", False)
+    response = client.post(f"/users/{user['id']}/plans/generate", json={"days": 5, "bypass_cache": True})
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "30"
+
+def test_rejected_deadline_generation_returns_503_without_leaving_a_plan(client, user, overloaded, monkeypatch):
+    monkeypatch.setattr(main.model_client, "rules_fallback", False)
+    response = client.post(
+        f"/users/{user['id']}/plans/generate",
+        json={"days": 5, "deadline_seconds": 5, "bypass_cache": True}
+    )
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "30"
+    assert client.get(f"/users/{user['id']}/plans").json() == []
+
+def test_rejected_generation_falls_back_to_rules(client, user, overloaded, monkeypatch):
+    monkeypatch.setattr(main.model_client, "rules_fallback", True)
+    response = client.post(f"/users/{user['id']}/plans/generate", json={"days": 5, "bypass_cache": True})
+    assert response.status_code == 201
+    assert response.json()["generator"] == "rules"
+    assert len(client.get(f"/plans/{response.json()['plan_id']}").json()["days"]) == 5
+
+def test_rejected_deadline_generation_falls_back_to_rules(client, user, overloaded, monkeypatch):
+    monkeypatch.setattr(main.model_client, "rules_fallback", True)
+    response = client.post(
+        f"/users/{user['id']}/plans/generate",
+        json={"days": 5, "deadline_seconds": 5, "bypass_cache": True}
+    )
+    assert response.status_code == 201
+    assert response.json()["status"] == "generated"
+    assert response.json()["generator"] == "rules"
+    assert response.json()["days_generated"] == 5
+
+def test_rejected_stream_falls_back_to_rules(client, user, overloaded, monkeypatch):
+    monkeypatch.setattr(main.model_client, "rules_fallback", True)
+    with client.stream("POST", f"/users/{user['id']}/plans/generate/stream", json={"days": 5, "bypass_cache": True}) as response:
+        events = [json.loads(line)["event"] for line in response.iter_lines() if line]
+    assert events == ["plan"] + ["day"] * 5 + ["complete"]
+
+def test_deadline_generation_rejected_by_the_scheduler_falls_back_to_rules(client, user, overloaded, monkeypatch):
+    # The lane fills up between the capacity check and the scheduler slot
+    monkeypatch.setattr(main.model_client, "rules_fallback", True)
+    monkeypatch.setattr(main.model_client.scheduler, "has_capacity", lambda lane="interactive": True)
+    response = client.post(
+        f"/users/{user['id']}/plans/generate",
+        json={"days": 5, "deadline_seconds": 5, "bypass_cache": True}
+    )
+    assert response.status_code == 201
+    assert response.json()["days_generated"] == 5
+    assert response.json()["generator"] == "rules"
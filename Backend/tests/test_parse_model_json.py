@@ -0,0 +1,37 @@
+import json
+
+import pytest
+
+from main import parse_model_json, salvage_plan_days
+
+PLAN = {"plan_title": "T", "plan_description": "D", "days": [{"day_number": 1, "exercises": []}]}
+
+def test_clean_output_is_not_reported_as_repaired():
+    assert parse_model_json(json.dumps(PLAN)) == (PLAN, {"repaired": False, "truncated": False})
+
+def test_code_fences_and_surrounding_text_are_ignored():
+    response = "```json\nSure! " + json.dumps(PLAN) + " Enjoy.\n```"
+    assert parse_model_json(response)[0] == PLAN
+
+def test_trailing_commas_are_removed_outside_strings():
+    response = '{"plan_title": "a, ]", "days": [{"day_number": 1,},],}'
+    plan, report = parse_model_json(response)
+    assert plan == {"plan_title": "a, ]", "days": [{"day_number": 1}]}
+    assert report == {"repaired": True, "truncated": False}
+
+def test_truncated_output_is_closed_at_the_last_complete_value():
+    response = '{"plan_title": "T", "days": [{"day_number": 1, "exercises": []}, {"day_number": 2, "title": "Le'
+    plan, report = parse_model_json(response)
+    assert plan["days"][0] == {"day_number": 1, "exercises": []}
+    assert report == {"repaired": True, "truncated": True}
+
+def test_unparseable_output_raises():
+    with pytest.raises(json.JSONDecodeError):
+        parse_model_json("I cannot help with that.")
+    with pytest.raises(json.JSONDecodeError):
+        parse_model_json('{"plan_title": "T" "days": []}')
+
+def test_salvage_recovers_complete_days_only():
+    response = '{"plan_title": "T", "days": [{"day_number": 1, "exercises": []}, {"day_number": 2, "exer'
+    assert salvage_plan_days(response) == {"plan_title": "T", "days": [{"day_number": 1, "exercises": []}]}
+    assert salvage_plan_days('{"plan_title": "T", "days": [') is None
@@ -0,0 +1,28 @@
+import asyncio
+
+from sqlmodel import select
+
+from main import AsyncSessionLocal, Plan, PlanDay, User, persist_plan_days
+
+def test_bulk_inserted_days_get_their_own_ids(database):
+    days = [
+        {"day_number": number, "title": f"Day {number}", "exercises": [{"name": "Squat", "sets": 3, "reps": 10}]}
+        for number in (4, 1, 6, 2, 5, 3)
+    ]
+    
+    async def run():
+        async with AsyncSessionLocal() as session:
+            user = User(name="Persistence User", fitness_level="beginner")
+            session.add(user)
+            await session.commit()
+            plan = Plan(user_id=user.id, title="Bulk", total_days=6)
+            session.add(plan)
+            await session.commit()
+            plan_days = await persist_plan_days(session, plan.id, days)
+            await session.commit()
+            stored = dict((await session.execute(select(PlanDay.id, PlanDay.day_number).where(PlanDay.plan_id == plan.id))).all())
+        return plan_days, stored
+    
+    plan_days, stored = asyncio.run(run())
+    assert [plan_day.day_number for plan_day in plan_days] == [4, 1, 6, 2, 5, 3]
+    assert {plan_day.id: plan_day.day_number for plan_day in plan_days} == stored
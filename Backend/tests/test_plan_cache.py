@@ -0,0 +1,70 @@
+import json
+import asyncio
+
+import httpx
+
+from main import ModelClient, ModelRouter, PlanCache, PlanGenerationRequest, User, plan_fingerprint
+
+USER = User(id=1, name="Short", age=30, fitness_level="beginner", goals="Build strength")
+SHORT_PLAN = {
+    "plan_title": "Short",
+    "plan_description": "Stops after two days",
+    "days": [
+        {"day_number": number, "focus": "Strength", "exercises": [{"name": "Squat", "sets": 3, "reps": 10}]}
+        for number in (1, 2)
+    ],
+}
+
+def short_plan_ollama():
+    """A fake Ollama that always answers with a two-day plan, streamed or not"""
+    def handler(request: httpx.Request) -> httpx.Response:
+        text = json.dumps(SHORT_PLAN)
+        if json.loads(request.content).get("stream"):
+            lines = [json.dumps({"response": text[i:i + 40]}) for i in range(0, len(text), 40)]
+            return httpx.Response(200, text="\n".join(lines + [json.dumps({"done": True})]))
+        return httpx.Response(200, json={"response": text, "done": True})
+    return httpx.MockTransport(handler)
+
+def short_plan_client():
+    router = ModelRouter(default_model="small", rules=[], escalation=[])
+    client = ModelClient(base_urls=["http://fake:11434"], model="small", router=router, cache=PlanCache(), repair=False)
+    client._client = httpx.AsyncClient(transport=short_plan_ollama())
+    return client
+
+def test_cached_plan_does_not_carry_the_original_parse_report(database):
+    async def run():
+        cache = PlanCache()
+        await cache.set("key", "model", {"plan_title": "T", "days": [], "parse_report": {"repaired": True}})
+        from_memory = await cache.get("key")
+        cache._entries.clear()
+        from_database = await cache.get("key")
+        return from_memory, from_database
+    
+    from_memory, from_database = asyncio.run(run())
+    assert from_memory == {"plan_title": "T", "days": []}
+    assert from_database == {"plan_title": "T", "days": []}
+
+def test_entries_expire_after_the_ttl(database):
+    async def run():
+        cache = PlanCache(ttl_seconds=0)
+        await cache.set("expiring", "model", {"days": []})
+        return await cache.get("expiring"), cache.stats()
+    
+    plan_data, stats = asyncio.run(run())
+    assert plan_data is None
+    assert stats["misses"] == 1
+
+def test_incomplete_plans_are_not_cached(database):
+    request = PlanGenerationRequest(days=5)
+    
+    async def run():
+        client = short_plan_client()
+        plan_data = await client.generate_plan(USER, request)
+        events = [item async for item in client.stream_plan(USER, request)]
+        return plan_data, events, client.cache
+    
+    plan_data, events, cache = asyncio.run(run())
+    assert len(plan_data["days"]) == 2
+    assert len([item for item in events if item["type"] == "day"]) == 2
+    assert not cache._entries
+    assert asyncio.run(cache.get(plan_fingerprint(USER, request, "small"))) is None
@@ -0,0 +1,11 @@
+from fastapi.testclient import TestClient
+
+import main
+
+def test_queued_generation_runs_on_the_batch_lane():
+    with TestClient(main.app) as client:
+        user = client.post("/users", json={"name": "Queued User", "fitness_level": "beginner"}).json()
+        response = client.post(f"/users/{user['id']}/plans/generate?async=true", json={"days": 3, "generator": "rules"})
+    assert response.status_code == 202
+    assert response.json()["lane"] == "batch"
+    assert response.headers["Location"] == f"/jobs/{response.json()['id']}"
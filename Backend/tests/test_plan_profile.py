@@ -0,0 +1,25 @@
+from main import PlanGenerationRequest, User, normalized_plan_profile, plan_features, plan_fingerprint
+
+FIRST = User(id=1, name="First", age=31, fitness_level="Beginner", goals="Build strength, lose weight")
+SECOND = User(id=2, name="Second", age=38, fitness_level="beginner", goals="lose weight / build strength")
+
+def test_equivalent_profiles_share_cache_key_and_similarity_features():
+    request = PlanGenerationRequest(days=7, focus_areas=["strength", "cardio"], preferences="No jumping!")
+    reordered = PlanGenerationRequest(days=7, focus_areas=["cardio", "strength"], preferences="no jumping")
+    assert plan_fingerprint(FIRST, request, "model") == plan_fingerprint(SECOND, reordered, "model")
+    assert plan_features(FIRST, request) == plan_features(SECOND, reordered)
+
+def test_features_are_the_fingerprinted_profile():
+    request = PlanGenerationRequest(days=10, include_equipment=True, preferences="short sessions, no running")
+    profile, features = normalized_plan_profile(FIRST, request), plan_features(FIRST, request)
+    assert {key: value for key, value in features.items() if key != "preferences"} == {
+        key: value for key, value in profile.items() if key != "preferences"
+    }
+    assert features["preferences"] == sorted(set(profile["preferences"].split()))
+
+def test_fields_that_change_the_plan_change_the_key():
+    request = PlanGenerationRequest(days=7)
+    key = plan_fingerprint(FIRST, request, "model")
+    assert plan_fingerprint(FIRST, PlanGenerationRequest(days=8), "model") != key
+    assert plan_fingerprint(FIRST, request, "other-model") != key
+    assert plan_fingerprint(User(id=3, name="Third", age=45, fitness_level="beginner", goals=FIRST.goals), request, "model") != key
@@ -0,0 +1,60 @@
+import json
+
+from main import PlanStreamParser
+
+PLAN = {
+    "plan_title": "Test Plan",
+    "plan_description": "Two days",
+    "days": [
+        {"day_number": 1, "title": "Push {a}", "rest_day": False, "exercises": [
+            {"name": "Push-ups", "sets": 3, "reps": 10, "rest_seconds": 60, "notes": "say \"go\" ]"}
+        ]},
+        {"day_number": 2, "title": "Rest", "rest_day": True, "exercises": []},
+    ],
+}
+
+def feed_in_chunks(parser: PlanStreamParser, text: str, size: int):
+    events = []
+    for i in range(0, len(text), size):
+        events.extend(parser.feed(text[i:i + size]))
+    return events
+
+def test_emits_meta_then_each_day_for_any_chunking():
+    text = json.dumps(PLAN)
+    for size in (1, 3, 17, len(text)):
+        events = feed_in_chunks(PlanStreamParser(), text, size)
+        assert [event["type"] for event in events] == ["meta", "day", "day"]
+        assert events[0] == {"type": "meta", "plan_title": "Test Plan", "plan_description": "Two days"}
+        assert [event["day"] for event in events[1:]] == PLAN["days"]
+
+def test_day_is_emitted_as_soon_as_it_closes():
+    text = json.dumps(PLAN)
+    first_day_end = text.index('"day_number": 2')
+    parser = PlanStreamParser()
+    events = parser.feed(text[:first_day_end])
+    assert [event["type"] for event in events] == ["meta", "day"]
+    assert parser.days_seen == 1
+    assert [event["type"] for event in parser.feed(text[first_day_end:])] == ["day"]
+
+def test_ignores_text_around_the_document():
+    parser = PlanStreamParser()
+    events = parser.feed("Here is your plan:\n```json\n" + json.dumps(PLAN) + "\n```")
+    assert parser.days_seen == 2
+    assert events[1]["day"]["title"] == "Push {a}"
+
+def test_repairs_trailing_commas_and_skips_broken_days():
+    text = (
+        '{"plan_title": "T", "days": ['
+        '{"day_number": 1, "title": "A", "exercises": [],},'
+        '{"day_number": 2, "title": oops},'
+        '{"day_number": 3, "title": "C", "exercises": []}]}'
+    )
+    parser = PlanStreamParser()
+    days = [event["day"]["day_number"] for event in parser.feed(text) if event["type"] == "day"]
+    assert days == [1, 3]
+
+def test_days_key_must_be_top_level():
+    text = '{"plan_title": "T", "notes": {"days": [{"day_number": 9}]}, "days": [{"day_number": 1}]}'
+    parser = PlanStreamParser()
+    days = [event["day"] for event in parser.feed(text) if event["type"] == "day"]
+    assert days == [{"day_number": 1}]
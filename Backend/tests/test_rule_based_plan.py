@@ -0,0 +1,52 @@
+import copy
+
+import pytest
+
+from main import BUILTIN_EXERCISES, PlanGenerationRequest, User, build_rule_based_plan, validate_plan, _muscle_group
+
+def build(level="beginner", **request):
+    user = User(id=1, name="Rules User", fitness_level=level)
+    return build_rule_based_plan(user, PlanGenerationRequest(**request), copy.deepcopy(BUILTIN_EXERCISES))
+
+@pytest.mark.parametrize("level", ["beginner", "intermediate", "advanced"])
+@pytest.mark.parametrize("days", [3, 7, 21])
+def test_plans_are_complete_and_within_limits(level, days):
+    plan = build(level, days=days, include_equipment=True)
+    report = validate_plan(copy.deepcopy(plan), days)
+    assert report == {"clamped_values": 0, "missing_days": []}
+    assert [day["day_number"] for day in plan["days"]] == list(range(1, days + 1))
+    assert plan["generator"] == "rules"
+    for day in plan["days"]:
+        names = [exercise["name"] for exercise in day["exercises"]]
+        assert len(names) == len(set(names))
+
+def test_same_input_gives_the_same_plan():
+    assert build("intermediate", days=14) == build("intermediate", days=14)
+
+def test_weekly_split_follows_the_fitness_level():
+    plan = build("beginner", days=7)
+    assert [day["rest_day"] for day in plan["days"]] == [False, True, False, False, False, True, True]
+    assert plan["days"][3]["title"] == "Day 4 - Mobility"
+
+def test_without_equipment_only_bodyweight_exercises_are_used():
+    plan = build("advanced", days=7, include_equipment=False)
+    exercises = [exercise for day in plan["days"] for exercise in day["exercises"]]
+    assert exercises and not any(exercise["equipment_needed"] for exercise in exercises)
+
+def test_strength_focus_uses_low_reps_and_long_rests():
+    plan = build("intermediate", days=7, include_equipment=True, focus_areas=["strength"])
+    first_week = [exercise for day in plan["days"] for exercise in day["exercises"]]
+    lifts = [exercise for exercise in first_week if _muscle_group(exercise["primary_muscle"]) not in ("core", "mobility")]
+    assert lifts and all(5 <= exercise["reps"] <= 8 and exercise["rest_seconds"] == 120 for exercise in lifts)
+
+def test_reps_progress_by_one_per_week():
+    plan = build("beginner", days=21)
+    reps = {}
+    for day in plan["days"]:
+        for exercise in day["exercises"]:
+            reps.setdefault(exercise["name"], []).append(((day["day_number"] - 1) // 7, exercise["reps"]))
+    progressed = [weeks for weeks in reps.values() if len({week for week, _ in weeks}) > 1]
+    assert progressed
+    for weeks in progressed:
+        (first_week, first_reps), (last_week, last_reps) = weeks[0], weeks[-1]
+        assert last_reps - first_reps == last_week - first_week
@@ -0,0 +1,91 @@
+import json
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+
+@pytest.fixture
+def client():
+    with TestClient(main.app) as client:
+        yield client
+
+@pytest.fixture
+def user(client):
+    response = client.post("/users", json={"name": "Streamed Plan User", "fitness_level": "beginner"})
+    return response.json()
+
+def short_days(request):
+    days = [{"day_number": number, "focus": "Strength", "exercises": [{"name": "Squat", "sets": 3, "reps": 10}]} for number in (1, 2)]
+    return [main.normalize_plan_day(day, request.days)[0] for day in days]
+
+@pytest.fixture
+def short_stream(monkeypatch):
+    """The model stops after two days, whatever was requested"""
+    async def stream_plan(user, request, lane="interactive"):
+        yield {"type": "meta", "plan_title": "Short", "plan_description": "Stops early", "generator": "llm"}
+        for day in short_days(request):
+            yield {"type": "day", "day": day}
+    monkeypatch.setattr(main.model_client, "stream_plan", stream_plan)
+
+@pytest.fixture
+def indexed(monkeypatch):
+    """Plan ids recorded in the similar-plan index"""
+    plan_ids = []
+    async def add(session, plan_id, user, request):
+        plan_ids.append(plan_id)
+    monkeypatch.setattr(main.plan_index, "add", add)
+    return plan_ids
+
+def plan_status(client, user, plan_id):
+    plans = client.get(f"/users/{user['id']}/plans").json()
+    return next(plan["generation_status"] for plan in plans if plan["id"] == plan_id)
+
+def test_stream_that_stops_short_leaves_the_plan_incomplete(client, user, short_stream, indexed):
+    with client.stream("POST", f"/users/{user['id']}/plans/generate/stream", json={"days": 5, "bypass_cache": True}) as response:
+        events = [json.loads(line) for line in response.iter_lines() if line]
+    assert [item["event"] for item in events] == ["plan", "day", "day", "complete"]
+    assert events[-1]["status"] == "incomplete"
+    assert plan_status(client, user, events[0]["plan_id"]) == "incomplete"
+    assert indexed == []
+
+def test_deadline_response_reports_the_stored_status(client, user, short_stream, indexed):
+    response = client.post(
+        f"/users/{user['id']}/plans/generate",
+        json={"days": 5, "deadline_seconds": 5, "bypass_cache": True}
+    )
+    assert response.status_code == 201
+    assert response.json()["days_generated"] == 2
+    assert response.json()["status"] == "incomplete"
+    assert plan_status(client, user, response.json()["plan_id"]) == "incomplete"
+    assert indexed == []
+
+def test_short_generated_plan_is_not_indexed(client, user, indexed, monkeypatch):
+    async def generate_plan(user, request, lane="interactive", reference=None):
+        return {"plan_title": "Short", "plan_description": "Stops early", "days": short_days(request)}
+    monkeypatch.setattr(main.model_client, "generate_plan", generate_plan)
+    response = client.post(f"/users/{user['id']}/plans/generate", json={"days": 5, "bypass_cache": True})
+    assert response.status_code == 201
+    assert indexed == []
+
+def test_deleting_a_plan_stops_its_background_generation(client, user, monkeypatch):
+    cancelled = []
+    
+    async def stream_plan(user, request, lane="interactive"):
+        yield {"type": "meta", "plan_title": "Slow", "plan_description": "Still generating", "generator": "llm"}
+        yield {"type": "day", "day": short_days(request)[0]}
+        try:
+            await asyncio.sleep(3600)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+    monkeypatch.setattr(main.model_client, "stream_plan", stream_plan)
+    
+    response = client.post(f"/users/{user['id']}/plans/generate", json={"days": 5, "deadline_seconds": 1, "bypass_cache": True})
+    assert response.json()["status"] == "incomplete"
+    plan_id = response.json()["plan_id"]
+    assert client.delete(f"/plans/{plan_id}").status_code == 200
+    assert cancelled == [True]
+    assert plan_id not in main._background_generations
+    assert client.get(f"/plans/{plan_id}").status_code == 404
@@ -0,0 +1,39 @@
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+
+@pytest.fixture
+def client():
+    with TestClient(main.app) as client:
+        yield client
+
+def plan_instances(client, plan_id):
+    days = client.get(f"/plans/{plan_id}").json()["days"]
+    return {exercise["instance"]["id"]: exercise for day in days for exercise in day["exercises"]}
+
+def test_substituted_instance_starts_over_from_its_targets(client):
+    for exercise in main.BUILTIN_EXERCISES:
+        client.post("/exercise-types", json=exercise)  # 409 for the ones already present
+    user = client.post("/users", json={"name": "Substitution User", "fitness_level": "intermediate"}).json()
+    plan = client.post(
+        f"/users/{user['id']}/plans/generate",
+        json={"days": 3, "generator": "rules", "include_equipment": True}
+    ).json()
+    instance_id, exercise = next(iter(plan_instances(client, plan["plan_id"]).items()))
+    response = client.post(
+        f"/users/{user['id']}/plans/{plan['plan_id']}/session",
+        json=[{"exercise_instance_id": instance_id, "rpe": 9.5, "reps_completed": 4, "sets_completed": 2, "success": False}]
+    )
+    assert response.status_code < 300
+    assert plan_instances(client, plan["plan_id"])[instance_id]["instance"]["last_rpe"] == 9.5
+    
+    result = client.post(f"/plans/{plan['plan_id']}/substitutions", json={"exercise_instance_ids": [instance_id]}).json()
+    assert [entry["exercise_instance_id"] for entry in result["substituted"]] == [instance_id]
+    
+    instance = plan_instances(client, plan["plan_id"])[instance_id]["instance"]
+    assert instance["exercise_type_id"] != exercise["exercise_type"]["id"]
+    assert instance["last_rpe"] is None
+    assert instance["notes"] is None
+    assert (instance["current_sets"], instance["current_reps"]) == (instance["target_sets"], instance["target_reps"])
+    assert instance["target_sets"] == exercise["instance"]["target_sets"]
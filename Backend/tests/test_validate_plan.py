@@ -0,0 +1,15 @@
+import json
+
+from main import normalize_plan_day, validate_plan
+
+def test_out_of_range_values_are_clamped():
+    day, changed = normalize_plan_day({"day_number": 1, "exercises": [{"name": "Squat", "sets": 40, "reps": "12", "rest_seconds": 5}]}, 7)
+    assert day["exercises"][0] == {"name": "Squat", "sets": 10, "reps": 12, "rest_seconds": 30}
+    assert changed == 3
+
+def test_infinite_values_fall_back_to_defaults():
+    # JSON numbers too large for a float, as a model may emit, parse to inf
+    plan_data = json.loads('{"days": [{"day_number": 1, "exercises": [{"name": "Squat", "sets": 1e999, "reps": -1e999}]}, {"day_number": 1e999, "exercises": [{"name": "Row"}]}]}')
+    report = validate_plan(plan_data, 2)
+    assert plan_data["days"][0]["exercises"][0] == {"name": "Squat", "sets": 3, "reps": 10, "rest_seconds": 60}
+    assert report["missing_days"] == [2]